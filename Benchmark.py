@@ -0,0 +1,260 @@
+# Generation benchmarks, no ROM needed. Compares the search counters with the stored baseline:
+#   python3 ./Benchmark.py
+# Record a new baseline after an intended change:
+#   python3 ./Benchmark.py --update_baseline
+# Times and memory depend on the machine and are only reported. To compare them, write the full
+# results of one run with --output and pass that file as --baseline of the next run on the same machine.
+# Time the rom checksum implementations instead:
+#   python3 ./Benchmark.py --crc
+
+from __future__ import annotations
+
+import argparse
+import json
+import logging
+import multiprocessing
+import os
+import platform
+import random
+import struct
+import sys
+import tempfile
+import time
+from dataclasses import dataclass
+from typing import Any, NoReturn, Optional
+
+import crc
+from ntype import BigStream
+from Utils import data_path, local_path
+from version import __version__
+
+# Peak memory is only measured where the resource module exists, which isn't on Windows
+try:
+    import resource
+except ImportError:
+    resource = None
+
+BASELINE_PATH: str = local_path(os.path.join('tests', 'benchmark_baseline.json'))
+
+# Presets from presets_default.json, and settings files in tests/
+DEFAULT_CASES: list[str] = [
+    'S8 Tournament',
+    'Hell Mode',
+    'Multiworld Tournament Season 4',
+    'plentiful.sav',
+    'entrance.sav',
+    'multiworld.sav',
+    'triforce.sav',
+    'ludicrous.sav',
+]
+DEFAULT_SEEDS: list[str] = ['BENCHMARK0', 'BENCHMARK1']
+
+# Counters of Metrics that only depend on the code and the seed, which the baseline gates on
+COMPARED_COUNTERS: list[str] = [
+    'rule_evaluations',
+    'searches',
+    'search_copies',
+    'state_copies',
+]
+
+
+@dataclass
+class Tolerances:
+    # allowed increase as a fraction of the baseline
+    counters: float = 0.05
+
+
+def case_settings(case: str) -> dict[str, Any]:
+    if case.endswith('.sav'):
+        with open(local_path(os.path.join('tests', case)), encoding='utf-8') as f:
+            return json.load(f)
+    with open(data_path('presets_default.json'), encoding='utf-8') as f:
+        presets = json.load(f)
+    if case not in presets:
+        raise Exception(f'No preset or test settings file named {case!r}')
+    return presets[case]
+
+
+def peak_rss() -> Optional[int]:
+    if resource is None:
+        return None
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # kilobytes, except on macOS
+    return rss if platform.system() == 'Darwin' else rss * 1024
+
+
+# Generates one seed in a fresh process, so every case starts with empty caches and its own peak memory.
+def run_case(case: str, seed: str, output_dir: str) -> dict[str, Any]:
+    from Main import SeedResult, main
+    from Settings import Settings
+
+    logging.basicConfig(level=logging.ERROR)
+    settings_dict = case_settings(case)
+    settings_dict.update({
+        'create_patch_file': False,
+        'create_compressed_rom': False,
+        'create_wad_file': False,
+        'create_uncompressed_rom': False,
+        'create_spoiler': True,
+        'count': 1,
+        'output_dir': output_dir,
+        'output_file': 'benchmark',
+        'seed': seed,
+    })
+    settings = Settings(settings_dict)
+    result = SeedResult(settings.seed)
+    try:
+        spoiler = main(settings, result=result)
+    except Exception as e:
+        return {'attempts': result.attempts, 'error': f'{type(e).__name__}: {e}'}
+    return {'attempts': result.attempts, 'peak_rss': peak_rss(), **spoiler.metrics.to_json()}
+
+
+def run_benchmarks(cases: list[str], seeds: list[str]) -> dict[str, Any]:
+    results = {
+        'version': __version__,
+        'python': platform.python_version(),
+        'platform': f'{platform.system()} {platform.machine()}',
+        'cases': {},
+    }
+    context = multiprocessing.get_context('spawn')
+    with tempfile.TemporaryDirectory() as output_dir:
+        for case in cases:
+            for seed in seeds:
+                name = f'{case} #{seed}'
+                print(f'Generating {name}', file=sys.stderr)
+                with context.Pool(1) as pool:
+                    results['cases'][name] = pool.apply(run_case, (case, seed, output_dir))
+    return results
+
+
+# Best time of each checksum implementation of crc.py on the same random rom, in seconds.
+def time_crc(repeat: int = 5) -> dict[str, float]:
+    stream = BigStream(bytearray(random.Random(0).randbytes(crc.CRC_START + crc.CRC_LENGTH)))
+    words = struct.unpack(f'>{crc.CRC_LENGTH // 4}I', stream.read_bytes(crc.CRC_START, crc.CRC_LENGTH))
+    words2 = struct.unpack('>64I', stream.read_bytes(0x750, 0x100))
+    implementations = {'python': crc.crc_python}
+    if crc.numpy is not None:
+        implementations['numpy'] = crc.crc_numpy
+    timings = {}
+    checksums = set()
+    for name, implementation in implementations.items():
+        times = []
+        for _ in range(repeat):
+            start = time.perf_counter()
+            checksums.add(bytes(implementation(words, words2)))
+            times.append(time.perf_counter() - start)
+        timings[name] = min(times)
+    if len(checksums) != 1:
+        raise Exception('The checksum implementations disagree')
+    return timings
+
+
+def percent_change(value: float, baseline: float) -> str:
+    return f'{(value - baseline) / baseline:+.1%}' if baseline else 'new'
+
+
+# The part of the results stored as the baseline, which is the same on every machine.
+def baseline_results(results: dict[str, Any]) -> dict[str, Any]:
+    cases = {}
+    for name, result in results['cases'].items():
+        if 'error' in result:
+            cases[name] = {'attempts': result['attempts'], 'error': result['error']}
+        else:
+            cases[name] = {'attempts': result['attempts'],
+                           'counters': {counter: result['counters'][counter] for counter in COMPARED_COUNTERS if counter in result['counters']}}
+    return {'version': results['version'], 'cases': cases}
+
+
+# Returns a line for every case that needed more attempts than in the baseline, or whose search counters
+# grew by more than the tolerance. Times and memory depend on the machine and aren't compared.
+def compare_results(results: dict[str, Any], baseline: dict[str, Any], tolerances: Tolerances) -> list[str]:
+    regressions = []
+    for name, result in results['cases'].items():
+        base = baseline['cases'].get(name, None)
+        if base is None:
+            continue
+        if 'error' in result or 'error' in base:
+            if 'error' in result and 'error' not in base:
+                regressions.append(f'{name}: failed with {result["error"]}')
+            continue
+
+        if result['attempts'] > base['attempts']:
+            regressions.append(f'{name}: {result["attempts"]} attempts vs {base["attempts"]}')
+        for counter in COMPARED_COUNTERS:
+            value = result['counters'].get(counter, None)
+            base_value = base['counters'].get(counter, None)
+            if value is not None and base_value is not None and value > base_value * (1 + tolerances.counters):
+                regressions.append(f'{name}: {counter} {value} vs {base_value} ({percent_change(value, base_value)})')
+    return regressions
+
+
+def print_summary(results: dict[str, Any], baseline: Optional[dict[str, Any]]) -> None:
+    print(f'{"case":48} {"tries":>5} {"cpu (s)":>8} {"change":>7} {"rss (MB)":>8} {"rule evals":>11} {"change":>7}')
+    for name, result in results['cases'].items():
+        if 'error' in result:
+            print(f'{name:48} {result["attempts"]:5} {result["error"]}')
+            continue
+        base = (baseline or {'cases': {}})['cases'].get(name, None)
+        if base is None or 'error' in base:
+            base = {'counters': {}}
+        rss = f'{result["peak_rss"] / 2**20:.0f}' if result.get('peak_rss') else '-'
+        # only a baseline with the full results of a run has times
+        cpu_change = percent_change(result['cpu_time'], base['cpu_time']) if 'cpu_time' in base else '-'
+        evaluations = result['counters']['rule_evaluations']
+        print(f'{name:48} {result["attempts"]:5} {result["cpu_time"]:8.2f} {cpu_change:>7} '
+              f'{rss:>8} {evaluations:11} {percent_change(evaluations, base["counters"].get("rule_evaluations", 0)):>7}')
+
+
+def run_benchmark_checks() -> NoReturn:
+    parser = argparse.ArgumentParser()
+    parser.add_argument('--cases', nargs='+', default=DEFAULT_CASES, help='Presets and tests/ settings files to generate.')
+    parser.add_argument('--seeds', nargs='+', default=DEFAULT_SEEDS, help='Seeds generated for every case.')
+    parser.add_argument('--baseline', default=BASELINE_PATH, help='Baseline results to compare with.')
+    parser.add_argument('--update_baseline', help='Write the results as the new baseline instead of comparing.', action='store_true')
+    parser.add_argument('--output', help='Also write the results to this file.')
+    parser.add_argument('--counter_tolerance', type=float, default=Tolerances.counters, help='Allowed increase of the search counters, as a fraction.')
+    parser.add_argument('--crc', help='Time the rom checksum implementations instead of generating seeds.', action='store_true')
+    args = parser.parse_args()
+
+    if args.crc:
+        for name, best in time_crc().items():
+            print(f'{name:8} best {best * 1000:7.1f} ms')
+        sys.exit(0)
+
+    results = run_benchmarks(args.cases, args.seeds)
+    if args.output:
+        with open(args.output, 'w', encoding='utf-8') as f:
+            json.dump(results, f, indent=4)
+            print(file=f)
+
+    if args.update_baseline:
+        with open(args.baseline, 'w', encoding='utf-8') as f:
+            json.dump(baseline_results(results), f, indent=4)
+            print(file=f)
+        print_summary(results, None)
+        print(f'Baseline written to {args.baseline}.')
+        sys.exit(0)
+
+    try:
+        with open(args.baseline, encoding='utf-8') as f:
+            baseline = json.load(f)
+    except FileNotFoundError:
+        baseline = None
+    print_summary(results, baseline)
+    if baseline is None:
+        print(f'No baseline at {args.baseline}, run with --update_baseline to record one.', file=sys.stderr)
+        sys.exit(0)
+
+    regressions = compare_results(results, baseline, Tolerances(args.counter_tolerance))
+    if regressions:
+        print(f'{len(regressions)} regressions against the baseline:', file=sys.stderr)
+        for regression in regressions:
+            print(f'  {regression}', file=sys.stderr)
+        sys.exit(1)
+    print('No regressions against the baseline.')
+    sys.exit(0)
+
+
+if __name__ == '__main__':
+    run_benchmark_checks()
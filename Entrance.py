@@ -55,14 +55,20 @@ class Entrance:
             return
         self.access_rules.append(lambda_rule)
         self.access_rule = lambda state, **kwargs: all(rule(state, **kwargs) for rule in self.access_rules)
+        if self.world is not None:
+            self.world.parser.dependents = None
 
     def set_rule(self, lambda_rule: AccessRule) -> None:
         self.access_rule = lambda_rule
         self.access_rules = [lambda_rule]
+        if self.world is not None:
+            self.world.parser.dependents = None
 
     def connect(self, region: Region) -> None:
         self.connected_region = region
         region.entrances.append(self)
+        region.world.invalidate_hint_areas(region)
+        region.world.invalidate_unreachable_as(region)
 
     def disconnect(self) -> Optional[Region]:
         if self.connected_region is None:
@@ -73,6 +79,8 @@ class Entrance:
             raise e
         previously_connected = self.connected_region
         self.connected_region = None
+        previously_connected.world.invalidate_hint_areas(previously_connected)
+        previously_connected.world.invalidate_unreachable_as(previously_connected)
         return previously_connected
 
     def bind_two_way(self, other_entrance: Entrance) -> None:
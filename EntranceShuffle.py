@@ -1,13 +1,14 @@
 from __future__ import annotations
 import random
 import logging
-from collections import OrderedDict
-from collections.abc import Iterable, Container
+from collections import OrderedDict, defaultdict, deque
+from collections.abc import Callable, Container, Iterable, Iterator
+from contextlib import contextmanager
 from itertools import chain
 from typing import TYPE_CHECKING, Optional
 
 from Fill import ShuffleError
-from Search import Search
+from Search import Search, IncrementalSearch
 from Region import Region, TimeOfDay
 from Rules import set_entrances_based_rules
 from State import State
@@ -832,14 +833,200 @@ def split_entrances_by_requirements(worlds: list[World], entrances_to_split: lis
     return restrictive_entrances, soft_entrances
 
 
+# The searches validate_world checks the worlds with, made at most once per validation.
+# While shuffle_entrances places the entrances of a pool they are kept between placements instead of exploring
+# the worlds from scratch for every target tried. Placing an entrance of the pool disconnects assumed entrances
+# of the pool, which are hidden from the kept searches, while all other connections are only ever added.
+# A placement is checked with copies of the kept searches, continued with the assumed entrances of the pool
+# that are left and the connections of the placement. When the placement is kept, the kept searches are
+# continued with its connections, which is the only update they need.
+class ValidationSearches:
+    def __init__(self, worlds: list[World], itempool: list[Item],
+                 entrances: Optional[list[Entrance]] = None, target_entrances: Optional[list[Entrance]] = None) -> None:
+        self.worlds: list[World] = worlds
+        self.itempool: list[Item] = itempool
+        # searches are only kept for the placements of a pool
+        self.keep: bool = entrances is not None
+        self.entrances: list[Entrance] = entrances or []
+        self.target_entrances: list[Entrance] = target_entrances or []
+        self.kept: dict[str, Search] = {}
+        self.current: dict[str, Search] = {}
+        self.progression_locations: list[Location] = []
+        # connections of the placement being checked, not in the kept searches yet
+        self.connections: list[Entrance] = []
+
+    # Max explore with the items of the pool
+    def max_explore(self) -> Search:
+        return self.get('max_explore', lambda: IncrementalSearch.max_explore([w.state for w in self.worlds], self.itempool))
+
+    # Note this creates new empty states rather than reuse the worlds' states (which already have starting items)
+    def no_items(self) -> Search:
+        return self.get('no_items', lambda: Search([State(w) for w in self.worlds]))
+
+    def time_travel(self) -> Search:
+        return self.get('time_travel', lambda: Search.with_items([w.state for w in self.worlds], [ItemFactory('Time Travel', world=w) for w in self.worlds]))
+
+    def get(self, name: str, build: Callable[[], Search]) -> Search:
+        if name in self.current:
+            return self.current[name]
+        if not self.keep:
+            search = build()
+        else:
+            if name not in self.kept:
+                with self.hidden(self.connections):
+                    self.kept[name] = build()
+                if not self.progression_locations:
+                    self.progression_locations = self.kept[name].progression_locations()
+            search = self.kept[name].copy()
+            self.continue_search(name, search, [*self.assumed_entrances(), *self.connections])
+        self.current[name] = search
+        return search
+
+    def continue_search(self, name: str, search: Search, exits: list[Entrance]) -> None:
+        search.queue_exits(exits)
+        if name == 'max_explore':
+            search.collect_locations(self.progression_locations)
+        else:
+            search.next_sphere()
+
+    # The assumed entrances placing the entrances of the pool can disconnect, see change_connections
+    def assumed_entrances(self) -> list[Entrance]:
+        assumed = [target for target in self.target_entrances if target.connected_region is not None]
+        for entrance in self.entrances:
+            if entrance.reverse and not entrance.decoupled and entrance.reverse.assumed and entrance.reverse.assumed.connected_region is not None:
+                assumed.append(entrance.reverse.assumed)
+        return assumed
+
+    # Disconnects the assumed entrances and the given exits from their regions, only as far as searches can tell
+    @contextmanager
+    def hidden(self, exits: Iterable[Entrance]) -> Iterator[None]:
+        hidden = [(exit, exit.connected_region) for exit in chain(self.assumed_entrances(), exits)]
+        for exit, _ in hidden:
+            exit.connected_region = None
+        try:
+            yield
+        finally:
+            for exit, region in hidden:
+                exit.connected_region = region
+
+    # Called after connecting an entrance, with the new connections
+    def place(self, connections: list[Entrance]) -> None:
+        self.connections = connections
+        self.current = {}
+
+    # Called once the placement is kept
+    def confirm(self) -> None:
+        with self.hidden(()):
+            for name, search in self.kept.items():
+                self.continue_search(name, search, self.connections)
+        self.place([])
+
+    # Called once the placement is undone
+    def discard(self) -> None:
+        self.place([])
+
+    # Called once a placement that was kept is undone, which the kept searches can't forget
+    def reset(self) -> None:
+        self.kept = {}
+        self.place([])
+
+
+# Which targets of a pool each entrance can replace, so that placements that can't be valid are skipped
+# before connecting anything and running validate_world. Self scene connections never change, so they are
+# worked out once for the pool. The one way hint areas and the entrances forbidden as an age depend on the
+# placements, so they are worked out again for every entrance placed.
+class TargetCompatibility:
+    def __init__(self, target_entrances: list[Entrance]) -> None:
+        self.scene_targets: defaultdict[str, set[Entrance]] = defaultdict(set)
+        for target in target_entrances:
+            if target.connected_region is not None and target.connected_region.get_scene():
+                self.scene_targets[target.connected_region.get_scene()].add(target)
+
+    # The targets still connected that the entrance could replace, in order. The placements must not change until the
+    # entrance is placed, besides the ones tried and restored by replace_entrance.
+    def compatible_targets(self, entrance: Entrance, target_entrances: Iterable[Entrance], rollbacks: list[tuple[Entrance, Entrance]],
+                           placed_one_way_entrances: list[tuple[Entrance, Entrance]]) -> Iterator[Entrance]:
+        self_scene_targets = self.scene_targets.get(entrance.parent_region.get_scene(), ())
+
+        used_hint_areas = set()
+        if entrance.type in ('OverworldOneWay', 'OwlDrop', 'Spawn', 'WarpSong'):
+            for placed_entrance, _ in (*rollbacks, *placed_one_way_entrances):
+                if placed_entrance.type == entrance.type:
+                    try:
+                        used_hint_areas.add(HintArea.at(placed_entrance.connected_region))
+                    except HintAreaNotFound:
+                        pass
+
+        # validate_world doesn't check the ages when entrances are decoupled
+        age_forbidden = ([], [])
+        age_checks = []
+        if not entrance.world.settings.decouple_entrances:
+            age_forbidden = age_forbidden_entrances(entrance.world)
+            for checked, age, already_checked, _ in age_forbidden_checks(entrance.world):
+                checked_regions = set()
+                if entrance_unreachable_as(checked, age, already_checked=already_checked, checked_regions=checked_regions):
+                    age_checks.append((age, checked_regions, [*already_checked, checked]))
+
+        for target in target_entrances:
+            if target.connected_region is None or target in self_scene_targets:
+                continue
+            if used_hint_areas:
+                try:
+                    if HintArea.at(target.connected_region) in used_hint_areas:
+                        continue
+                except HintAreaNotFound:
+                    pass
+            if forbidden_as_age(entrance, target, age_forbidden) or opens_forbidden_entrance(entrance, target, age_checks):
+                continue
+            yield target
+
+
+# Whether replacing the target with the entrance lets the player go through it as an age it is forbidden as,
+# like validate_world checks after connecting them. The assumed entrances they replace lead back to Root,
+# which nothing leads to, so checking before connecting them gives the same result.
+def forbidden_as_age(entrance: Entrance, target: Entrance, age_forbidden: tuple[list[str], list[str]]) -> bool:
+    for age, forbidden in zip(('child', 'adult'), age_forbidden):
+        if target.replaces.name in forbidden and not entrance_unreachable_as(entrance, age, already_checked=[target.replaces.reverse]):
+            return True
+        if entrance.reverse and not entrance.decoupled and entrance.reverse.name in forbidden \
+           and not entrance_unreachable_as(target.replaces.reverse, age, already_checked=[entrance]):
+            return True
+    return False
+
+
+# Whether replacing the target with the entrance makes an entrance forbidden as an age reachable as it. age_checks are the
+# checks of validate_world that pass before connecting them, with the regions they went through. Only the new connections
+# into those regions can make them fail, if they can be reached as the age themselves.
+def opens_forbidden_entrance(entrance: Entrance, target: Entrance, age_checks: list[tuple[str, set[Region], list[Entrance]]]) -> bool:
+    for age, checked_regions, already_checked in age_checks:
+        if target.connected_region in checked_regions and not entrance_unreachable_as(entrance, age, already_checked=already_checked):
+            return True
+        if entrance.reverse and not entrance.decoupled and entrance.reverse.assumed.connected_region in checked_regions \
+           and not entrance_unreachable_as(target.replaces.reverse, age, already_checked=[*already_checked, entrance]):
+            return True
+    return False
+
+
+# The connections change_connections makes for the entrance
+def placed_connections(entrance: Entrance) -> list[Entrance]:
+    if entrance.reverse and not entrance.decoupled:
+        return [entrance, entrance.replaces.reverse]
+    return [entrance]
+
+
 def replace_entrance(worlds: list[World], entrance: Entrance, target: Entrance, rollbacks: list[tuple[Entrance, Entrance]],
-                     locations_to_ensure_reachable: Iterable[Location], itempool: list[Item], placed_one_way_entrances: Optional[list[tuple[Entrance, Entrance]]] = None) -> bool:
+                     locations_to_ensure_reachable: Iterable[Location], itempool: list[Item], placed_one_way_entrances: Optional[list[tuple[Entrance, Entrance]]] = None,
+                     searches: Optional[ValidationSearches] = None) -> bool:
     if placed_one_way_entrances is None:
         placed_one_way_entrances = []
+    if searches is None:
+        searches = ValidationSearches(worlds, itempool)
     try:
         check_entrances_compatibility(entrance, target, rollbacks, placed_one_way_entrances)
         change_connections(entrance, target)
-        validate_world(entrance.world, worlds, entrance, locations_to_ensure_reachable, itempool, placed_one_way_entrances=placed_one_way_entrances)
+        searches.place(placed_connections(entrance))
+        validate_world(entrance.world, worlds, entrance, locations_to_ensure_reachable, itempool, placed_one_way_entrances=placed_one_way_entrances, searches=searches)
+        searches.confirm()
         rollbacks.append((entrance, target))
         return True
     except EntranceShuffleError as error:
@@ -848,6 +1035,7 @@ def replace_entrance(worlds: list[World], entrance: Entrance, target: Entrance,
                                     entrance, entrance.connected_region or target.connected_region, error, entrance.world.id)
         if entrance.connected_region:
             restore_connections(entrance, target)
+        searches.discard()
     return False
 
 
@@ -891,26 +1079,87 @@ def shuffle_entrances(worlds: list[World], entrances: list[Entrance], target_ent
         placed_one_way_entrances = []
     # Retrieve all items in the itempool, all worlds included
     complete_itempool = [item for world in worlds for item in world.get_itempool_with_dungeon_items()]
+    searches = ValidationSearches(worlds, complete_itempool, entrances, target_entrances)
+    compatibility = TargetCompatibility(target_entrances)
+    # Entrances that gave up their target for another entrance, by that entrance and target
+    nogoods: defaultdict[tuple[Entrance, Entrance], set[Entrance]] = defaultdict(set)
+    # Rollbacks before this call are placements of another part of the pool, which are never undone here
+    first_rollback = len(rollbacks)
+    repair_count = len(entrances)
 
     random.shuffle(entrances)
+    pending = deque(entrances)
 
     # Place all entrances in the pool, validating worlds during every placement
-    for entrance in entrances:
+    while pending:
+        entrance = pending.popleft()
         if entrance.connected_region is not None:
             continue
-        random.shuffle(target_entrances)
-
-        for target in target_entrances:
-            if target.connected_region is None:
-                continue
+        if place_entrance(worlds, entrance, target_entrances, rollbacks, locations_to_ensure_reachable, complete_itempool,
+                          placed_one_way_entrances, searches, compatibility):
+            continue
 
-            if replace_entrance(worlds, entrance, target, rollbacks, locations_to_ensure_reachable, complete_itempool, placed_one_way_entrances=placed_one_way_entrances):
-                break
+        # Rather than starting the pool over, take the target of an entrance placed before and place that one elsewhere
+        if repair_count:
+            repair_count -= 1
+            undone = take_placed_target(worlds, entrance, entrances, target_entrances, rollbacks[first_rollback:], rollbacks, locations_to_ensure_reachable,
+                                        complete_itempool, placed_one_way_entrances, searches, compatibility, nogoods)
+            pending.extendleft(undone)
 
         if entrance.connected_region is None:
             raise EntranceShuffleError('No more valid entrances to replace with %s in world %d' % (entrance, entrance.world.id))
 
 
+# Places the entrance on one of the targets left, unless none is valid
+def place_entrance(worlds: list[World], entrance: Entrance, target_entrances: list[Entrance], rollbacks: list[tuple[Entrance, Entrance]],
+                   locations_to_ensure_reachable: Iterable[Location], itempool: list[Item], placed_one_way_entrances: list[tuple[Entrance, Entrance]],
+                   searches: ValidationSearches, compatibility: TargetCompatibility) -> bool:
+    random.shuffle(target_entrances)
+
+    for target in compatibility.compatible_targets(entrance, target_entrances, rollbacks, placed_one_way_entrances):
+        if replace_entrance(worlds, entrance, target, rollbacks, locations_to_ensure_reachable, itempool,
+                            placed_one_way_entrances=placed_one_way_entrances, searches=searches):
+            return True
+    return False
+
+
+# Tries to place the entrance on the targets of placements of the pool, latest first, when no target is left for it.
+# The entrance placed there must then fit on one of the targets left, which nogoods keep from taking its target back.
+# Returns the other entrances of the pool that were disconnected by moving it, to be placed again.
+def take_placed_target(worlds: list[World], entrance: Entrance, entrances: Container[Entrance], target_entrances: list[Entrance],
+                       placements: list[tuple[Entrance, Entrance]], rollbacks: list[tuple[Entrance, Entrance]], locations_to_ensure_reachable: Iterable[Location],
+                       itempool: list[Item], placed_one_way_entrances: list[tuple[Entrance, Entrance]], searches: ValidationSearches,
+                       compatibility: TargetCompatibility, nogoods: dict[tuple[Entrance, Entrance], set[Entrance]]) -> list[Entrance]:
+    for previous_entrance, previous_target in reversed(placements):
+        if entrance in nogoods.get((previous_entrance, previous_target), ()):
+            continue
+        # placing an entrance can connect another entrance of the pool, which is disconnected with it
+        undone = [undone_entrance for undone_entrance in placed_connections(previous_entrance) if undone_entrance in entrances]
+        index = rollbacks.index((previous_entrance, previous_target))
+        del rollbacks[index]
+        restore_connections(previous_entrance, previous_target)
+
+        # The kept searches can't forget the placement, so the entrance is validated with new searches
+        if any(compatibility.compatible_targets(entrance, [previous_target], rollbacks, placed_one_way_entrances)) and \
+           replace_entrance(worlds, entrance, previous_target, rollbacks, locations_to_ensure_reachable, itempool, placed_one_way_entrances=placed_one_way_entrances):
+            searches.reset()
+            nogoods[(entrance, previous_target)].add(previous_entrance)
+            if place_entrance(worlds, previous_entrance, target_entrances, rollbacks, locations_to_ensure_reachable, itempool,
+                              placed_one_way_entrances, searches, compatibility):
+                logging.getLogger('').debug('Moved %s to place %s [World %d]', previous_entrance, entrance, entrance.world.id)
+                return [undone_entrance for undone_entrance in undone if undone_entrance.connected_region is None]
+            nogoods[(entrance, previous_target)].discard(previous_entrance)
+            rollbacks.pop()
+            restore_connections(entrance, previous_target)
+            # The kept searches were built with the entrance placed, which is undone
+            searches.reset()
+
+        # Put the placement back as it was, the kept searches were either built with it or are built again after the reset above
+        change_connections(previous_entrance, previous_target)
+        rollbacks.insert(index, (previous_entrance, previous_target))
+    return []
+
+
 # Check and validate that an entrance is compatible to replace a specific target
 def check_entrances_compatibility(entrance: Entrance, target: Entrance, rollbacks: list[tuple[Entrance, Entrance]] = (),
                                   placed_one_way_entrances: Optional[list[tuple[Entrance, Entrance]]] = None) -> None:
@@ -939,9 +1188,12 @@ def check_entrances_compatibility(entrance: Entrance, target: Entrance, rollback
 
 # Validate the provided worlds' structures, raising an error if it's not valid based on our criterias
 def validate_world(world: World, worlds: list[World], entrance_placed: Optional[Entrance], locations_to_ensure_reachable: Iterable[Location],
-                   itempool: list[Item], placed_one_way_entrances: Optional[list[tuple[Entrance, Entrance]]] = None) -> None:
+                   itempool: list[Item], placed_one_way_entrances: Optional[list[tuple[Entrance, Entrance]]] = None,
+                   searches: Optional[ValidationSearches] = None) -> None:
     if placed_one_way_entrances is None:
         placed_one_way_entrances = []
+    if searches is None:
+        searches = ValidationSearches(worlds, itempool)
 
     if not world.settings.decouple_entrances:
         # Unless entrances are decoupled, we don't want the player to end up through certain entrances as the wrong age
@@ -949,27 +1201,12 @@ def validate_world(world: World, worlds: list[World], entrance_placed: Optional[
         # This is mostly relevant when mixing entrance pools or shuffling special interiors (such as windmill or kak potion shop)
         # Warp Songs and Overworld Spawns can also end up inside certain indoors so those need to be handled as well
         # Allowing child to enter Spirit from the boss would severely complicate key logic
-        CHILD_FORBIDDEN = ['OGC Great Fairy Fountain -> Castle Grounds', 'GV Carpenter Tent -> GV Fortress Side', 'Ganons Castle Lobby -> Castle Grounds From Ganons Castle', 'Bongo Bongo Boss Room -> Shadow Temple Before Boss', 'Twinrova Boss Room -> Spirit Temple Before Boss']
-        ADULT_FORBIDDEN = ['HC Great Fairy Fountain -> Castle Grounds', 'HC Storms Grotto -> Castle Grounds', 'Bongo Bongo Boss Room -> Shadow Temple Before Boss', 'Twinrova Boss Room -> Spirit Temple Before Boss']
-        if world.dungeon_mq['Forest Temple'] and 'Forest Temple' in world.settings.dungeon_shortcuts:
-            CHILD_FORBIDDEN.append('Phantom Ganon Boss Room -> Forest Temple Before Boss')
-            ADULT_FORBIDDEN.append('Phantom Ganon Boss Room -> Forest Temple Before Boss')
-
-        for entrance in world.get_shufflable_entrances():
-            if entrance.shuffled:
-                if entrance.replaces:
-                    if entrance.replaces.name in CHILD_FORBIDDEN and not entrance_unreachable_as(entrance, 'child', already_checked=[entrance.replaces.reverse]):
-                        raise EntranceShuffleError('%s is replaced by an entrance with a potential child access' % entrance.replaces.name)
-                    elif entrance.replaces.name in ADULT_FORBIDDEN and not entrance_unreachable_as(entrance, 'adult', already_checked=[entrance.replaces.reverse]):
-                        raise EntranceShuffleError('%s is replaced by an entrance with a potential adult access' % entrance.replaces.name)
-            else:
-                if entrance.name in CHILD_FORBIDDEN and not entrance_unreachable_as(entrance, 'child', already_checked=[entrance.reverse]):
-                    raise EntranceShuffleError('%s is potentially accessible as child' % entrance.name)
-                elif entrance.name in ADULT_FORBIDDEN and not entrance_unreachable_as(entrance, 'adult', already_checked=[entrance.reverse]):
-                    raise EntranceShuffleError('%s is potentially accessible as adult' % entrance.name)
+        for entrance, age, already_checked, error in age_forbidden_checks(world):
+            if not entrance_unreachable_as(entrance, age, already_checked=already_checked):
+                raise EntranceShuffleError(error)
 
     if locations_to_ensure_reachable:
-        max_search = Search.max_explore([w.state for w in worlds], itempool)
+        max_search = searches.max_explore()
         if world.check_beatable_only:
             if worlds[0].settings.reachable_locations == 'goals':
                 # If this entrance is required for a goal, it must be placed somewhere reachable.
@@ -1004,15 +1241,14 @@ def validate_world(world: World, worlds: list[World], entrance_placed: Optional[
     if (world.shuffle_special_interior_entrances or world.settings.shuffle_overworld_entrances or world.settings.spawn_positions) and \
        (entrance_placed == None or entrance_placed.type in ('SpecialInterior', 'Hideout', 'Overworld', 'OverworldOneWay', 'Spawn', 'WarpSong', 'OwlDrop')):
         # At least one valid starting region with all basic refills should be reachable without using any items at the beginning of the seed
-        # Note this creates new empty states rather than reuse the worlds' states (which already have starting items)
-        no_items_search = Search([State(w) for w in worlds])
+        no_items_search = searches.no_items()
 
         valid_starting_regions = ('Kokiri Forest', 'Kakariko Village')
         if not any(no_items_search.can_reach(world.get_region(region)) for region in valid_starting_regions):
             raise EntranceShuffleError('Invalid starting area')
 
         # Check that a region where time passes is always reachable as both ages without having collected any items
-        time_travel_search = Search.with_items([w.state for w in worlds], [ItemFactory('Time Travel', world=w) for w in worlds])
+        time_travel_search = searches.time_travel()
 
         if not (any(region for region in time_travel_search.reachable_regions('child') if region.time_passes and region.world == world) and
                 any(region for region in time_travel_search.reachable_regions('adult') if region.time_passes and region.world == world)):
@@ -1030,7 +1266,7 @@ def validate_world(world: World, worlds: list[World], entrance_placed: Optional[
         # The Big Poe Shop should always be accessible as adult without the need to use any bottles
         # This is important to ensure that players can never lock their only bottles by filling them with Big Poes they can't sell
         # We can use starting items in this check as long as there are no exits requiring the use of a bottle without refills
-        time_travel_search = Search.with_items([w.state for w in worlds], [ItemFactory('Time Travel', world=w) for w in worlds])
+        time_travel_search = searches.time_travel()
 
         if not time_travel_search.can_reach(world.get_region('Market Guard House'), age='adult'):
             raise EntranceShuffleError('Big Poe Shop access is not guaranteed as adult')
@@ -1053,12 +1289,54 @@ def validate_world(world: World, worlds: list[World], entrance_placed: Optional[
                     pass
 
 
-# Returns whether or not we can affirm the entrance can never be accessed as the given age
-def entrance_unreachable_as(entrance: Entrance, age: str, already_checked: Optional[list[Entrance]] = None) -> bool:
-    if already_checked is None:
-        already_checked = []
-
-    already_checked.append(entrance)
+# Names of the entrances the player shouldn't go through as child and as adult, unless entrances are decoupled
+def age_forbidden_entrances(world: World) -> tuple[list[str], list[str]]:
+    child_forbidden = ['OGC Great Fairy Fountain -> Castle Grounds', 'GV Carpenter Tent -> GV Fortress Side', 'Ganons Castle Lobby -> Castle Grounds From Ganons Castle', 'Bongo Bongo Boss Room -> Shadow Temple Before Boss', 'Twinrova Boss Room -> Spirit Temple Before Boss']
+    adult_forbidden = ['HC Great Fairy Fountain -> Castle Grounds', 'HC Storms Grotto -> Castle Grounds', 'Bongo Bongo Boss Room -> Shadow Temple Before Boss', 'Twinrova Boss Room -> Spirit Temple Before Boss']
+    if world.dungeon_mq['Forest Temple'] and 'Forest Temple' in world.settings.dungeon_shortcuts:
+        child_forbidden.append('Phantom Ganon Boss Room -> Forest Temple Before Boss')
+        adult_forbidden.append('Phantom Ganon Boss Room -> Forest Temple Before Boss')
+    return child_forbidden, adult_forbidden
+
+
+# The checks of the entrances the player shouldn't go through as child or as adult, see validate_world,
+# as the entrance to check, the age, the entrances to check it with and the error if it may be reachable
+def age_forbidden_checks(world: World) -> Iterator[tuple[Entrance, str, list[Entrance], str]]:
+    child_forbidden, adult_forbidden = age_forbidden_entrances(world)
+    for entrance in world.get_shufflable_entrances():
+        if entrance.shuffled:
+            if entrance.replaces:
+                if entrance.replaces.name in child_forbidden:
+                    yield entrance, 'child', [entrance.replaces.reverse], '%s is replaced by an entrance with a potential child access' % entrance.replaces.name
+                if entrance.replaces.name in adult_forbidden:
+                    yield entrance, 'adult', [entrance.replaces.reverse], '%s is replaced by an entrance with a potential adult access' % entrance.replaces.name
+        else:
+            if entrance.name in child_forbidden:
+                yield entrance, 'child', [entrance.reverse], '%s is potentially accessible as child' % entrance.name
+            if entrance.name in adult_forbidden:
+                yield entrance, 'adult', [entrance.reverse], '%s is potentially accessible as adult' % entrance.name
+
+
+# Returns whether or not we can affirm the entrance can never be accessed as the given age, without going through the
+# already checked entrances. The regions whose entrances were checked are added to checked_regions if given.
+# The world keeps the result until an entrance into one of those regions is connected or disconnected.
+def entrance_unreachable_as(entrance: Entrance, age: str, already_checked: Iterable[Entrance] = (),
+                            checked_regions: Optional[set[Region]] = None) -> bool:
+    world = entrance.world
+    key = (entrance, age, frozenset(already_checked))
+    if key not in world.unreachable_as_cache:
+        regions = set()
+        world.unreachable_as_cache[key] = check_unreachable_as(entrance, age, set(key[2]), regions), regions
+        for region in regions:
+            world.unreachable_as_dependents[region.name].add(key)
+    unreachable, regions = world.unreachable_as_cache[key]
+    if checked_regions is not None:
+        checked_regions.update(regions)
+    return unreachable
+
+
+def check_unreachable_as(entrance: Entrance, age: str, already_checked: set[Entrance], checked_regions: set[Region]) -> bool:
+    already_checked.add(entrance)
 
     # The following cases determine when we say an entrance is not safe to affirm unreachable as the given age
     if entrance.type in ('WarpSong', 'OverworldOneWay', 'Overworld'):
@@ -1073,6 +1351,7 @@ def entrance_unreachable_as(entrance: Entrance, age: str, already_checked: Optio
 
     # Other entrances such as Interior, Dungeon or Grotto are fine unless they have a parent which is one of the above cases
     # Recursively check parent entrances to verify that they are also not reachable as the wrong age
+    checked_regions.add(entrance.parent_region)
     for parent_entrance in entrance.parent_region.entrances:
         if parent_entrance in already_checked:
             continue
@@ -1081,7 +1360,7 @@ def entrance_unreachable_as(entrance: Entrance, age: str, already_checked: Optio
         if parent_entrance.parent_region.name == 'Farores Wind Warp':
             continue
 
-        unreachable = entrance_unreachable_as(parent_entrance, age, already_checked)
+        unreachable = check_unreachable_as(parent_entrance, age, already_checked, checked_regions)
         if not unreachable:
             return False
 
@@ -9,7 +9,7 @@ from ItemPool import remove_junk_items
 from Location import Location, DisableType
 from LocationList import location_groups
 from Rules import set_shop_rules
-from Search import Search
+from Search import Search, IncrementalSearch
 from State import State
 
 if TYPE_CHECKING:
@@ -119,7 +119,7 @@ def distribute_items_restrictive(worlds: list[World], fill_locations: Optional[l
         ice_trap.looks_like_item = random_item
 
     # Start a search cache here.
-    search = Search([world.state for world in worlds])
+    search = IncrementalSearch([world.state for world in worlds])
 
     # We place all the shop items first. Like songs, they have a more limited
     # set of locations that they can be placed in, so placing them first will
@@ -178,7 +178,8 @@ def replace_goal_names(worlds: list[World]) -> None:
                             goal.hint_text = flavor_text
 
 
-def update_goal_items(spoiler: Spoiler) -> None:
+# WOTH locations are only searched with search_woth, otherwise the spoiler gets empty WOTH lists.
+def update_goal_items(spoiler: Spoiler, search_woth: bool = True) -> None:
     worlds = spoiler.worlds
 
     # get list of all the progressive items that can appear in hints
@@ -243,10 +244,9 @@ def update_goal_items(spoiler: Spoiler) -> None:
         for cat_name, category in worlds[0].unlocked_goal_categories.items():
             category.update_reachable_goals(search, full_search)
         reachable_goals = full_search.beatable_goals_fast(worlds[0].unlocked_goal_categories)
-    identified_locations = search_goals(worlds[0].unlocked_goal_categories, reachable_goals, search, priority_locations, all_locations, item_locations, always_locations, search_woth=True)
+    identified_locations = search_goals(worlds[0].unlocked_goal_categories, reachable_goals, search, priority_locations, all_locations, item_locations, always_locations, search_woth=search_woth)
     required_locations.update(identified_locations)
-    woth_locations = list(required_locations['way of the hero'])
-    del required_locations['way of the hero']
+    woth_locations = list(required_locations.pop('way of the hero', []))
 
     # Update WOTH items
     woth_locations_dict = {}
@@ -331,9 +331,11 @@ def search_goals(categories: dict[str, GoalCategory], reachable_goals: ValidGoal
     if search_woth:
         required_locations['way of the hero'] = []
     remaining_locations = all_locations[:]
+    # Without WOTH or reachable goals, the search is only needed for the misc. item hints
+    check_goals = search_woth or any(category.name in reachable_goals and reachable_goals[category.name] for category in categories.values())
     for location in search.iter_reachable_locations(all_locations):
         # Try to remove items one at a time and see if the goal is still reachable
-        if location in item_locations:
+        if check_goals and location in item_locations:
             old_item = location.item
             location.item = None
             # copies state! This is very important as we're in the middle of a search
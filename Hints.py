@@ -6,7 +6,7 @@ import os
 import random
 import sys
 import urllib.request
-from collections import OrderedDict, defaultdict
+from collections import OrderedDict, defaultdict, deque
 from collections.abc import Callable, Iterable
 from enum import Enum
 from typing import TYPE_CHECKING, Optional
@@ -417,40 +417,55 @@ class HintArea(Enum):
 
     # Performs a breadth first search to find the closest hint area from a given spot (region, location, or entrance).
     # May fail to find a hint if the given spot is only accessible from the root and not from any other region with a hint area
+    # The result only depends on the parent region of the spot, and is cached per world until
+    # the entrances into one of the regions the search went through are connected or disconnected.
     @staticmethod
     def at(spot: Spot, use_alt_hint: bool = False) -> HintArea:
         if isinstance(spot, Region):
             original_parent = spot
         else:
             original_parent = spot.parent_region
-        already_checked = []
-        spot_queue = [spot]
-        fallback_spot_queue = []
+        world = original_parent.world
+        key = (original_parent.name, use_alt_hint)
+        hint_area = world.hint_area_cache.get(key, None)
+        if hint_area is not None:
+            return hint_area
+
+        checked_regions = set()
+        spot_queue = deque([original_parent])
+        fallback_spot_queue = deque()
 
         while spot_queue or fallback_spot_queue:
             if not spot_queue:
                 spot_queue = fallback_spot_queue
-                fallback_spot_queue = []
-            current_spot = spot_queue.pop(0)
-            already_checked.append(current_spot)
+                fallback_spot_queue = deque()
+            current_spot = spot_queue.popleft()
 
             if isinstance(current_spot, Region):
                 parent_region = current_spot
             else:
                 parent_region = current_spot.parent_region
+            # a region reached again has nothing new to add to the search
+            if parent_region in checked_regions:
+                continue
 
             if (parent_region.hint or (use_alt_hint and parent_region.alt_hint)) and (original_parent.name == 'Root' or parent_region.name != 'Root'):
                 if use_alt_hint and parent_region.alt_hint:
-                    return parent_region.alt_hint
-                return parent_region.hint
+                    hint_area = parent_region.alt_hint
+                else:
+                    hint_area = parent_region.hint
+                world.hint_area_cache[key] = hint_area
+                for region in checked_regions:
+                    world.hint_area_dependents[region.name].add(key)
+                return hint_area
 
+            checked_regions.add(parent_region)
             for entrance in parent_region.entrances:
-                if entrance not in already_checked:
-                    # prioritize two-way entrances
-                    if entrance.type in ('OverworldOneWay', 'OwlDrop', 'Spawn', 'WarpSong'):
-                        fallback_spot_queue.append(entrance)
-                    else:
-                        spot_queue.append(entrance)
+                # prioritize two-way entrances
+                if entrance.type in ('OverworldOneWay', 'OwlDrop', 'Spawn', 'WarpSong'):
+                    fallback_spot_queue.append(entrance)
+                else:
+                    spot_queue.append(entrance)
 
         raise HintAreaNotFound('No hint area could be found for %s [World %d]' % (spot, spot.world.id))
 
@@ -80,6 +80,8 @@ class Location:
             return
         self.access_rules.append(lambda_rule)
         self.access_rule = self._run_rules
+        if self.world is not None:
+            self.world.parser.dependents = None
 
     def _run_rules(self, state, **kwargs):
         for rule in self.access_rules:
@@ -90,6 +92,8 @@ class Location:
     def set_rule(self, lambda_rule: AccessRule) -> None:
         self.access_rule = lambda_rule
         self.access_rules = [lambda_rule]
+        if self.world is not None:
+            self.world.parser.dependents = None
 
     def can_fill(self, state: State, item: Item, check_access: bool = True) -> bool:
         if state.search is None:
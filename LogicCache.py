@@ -0,0 +1,136 @@
+from __future__ import annotations
+import ast
+import hashlib
+import importlib.util
+import logging
+import marshal
+import os
+import pickle
+from dataclasses import dataclass
+from types import CodeType
+from typing import TYPE_CHECKING, Optional, Any
+
+from Utils import data_path, local_path, read_logic_file
+from version import __version__
+
+if TYPE_CHECKING:
+    from World import World
+
+
+# Code of the compiled access rules by rule ast string, shared by all worlds
+compiled_rule_code: dict[str, CodeType] = {}
+
+
+@dataclass
+class CachedRule:
+    # (source, name) -> repr of each world attribute, setting or spot attribute the transformation read
+    reads: dict[tuple[str, str], str]
+    # names that were checked as possible events: (escaped name, always an event)
+    events: list[tuple[str, bool]]
+    # at() and here() subrules it created: (target region name, untransformed rule, escaped event name)
+    subrules: list[tuple[str, ast.AST, str]]
+    # LogicHelpers.json entries that were expanded into the rule
+    helpers: frozenset[str]
+    # the transformed rule and its ast string
+    body: ast.expr
+    rule_str: str
+
+
+# The regions of a logic file and the transformed access rules found in it.
+class LogicFile:
+    def __init__(self, key: str, regions: list[dict[str, Any]]) -> None:
+        self.key: str = key
+        self.regions: list[dict[str, Any]] = regions
+        # rule string -> its transformations for different settings
+        self.rules: dict[str, list[CachedRule]] = {}
+        self.changed: bool = False
+
+    def add_rule(self, rule_string: str, cached_rule: CachedRule) -> None:
+        self.rules.setdefault(rule_string, []).append(cached_rule)
+        self.changed = True
+
+    def save(self, cache_dir: str) -> None:
+        code = {}
+        for cached_rules in self.rules.values():
+            for cached_rule in cached_rules:
+                if cached_rule.rule_str in compiled_rule_code:
+                    code[cached_rule.rule_str] = marshal.dumps(compiled_rule_code[cached_rule.rule_str])
+        path = os.path.join(cache_dir, self.key + '.pickle')
+        try:
+            os.makedirs(cache_dir, exist_ok=True)
+            # Write to a temporary file first so other processes never read a partial file
+            temp_path = f'{path}.{os.getpid()}.tmp'
+            with open(temp_path, 'wb') as f:
+                pickle.dump({'regions': self.regions, 'rules': self.rules, 'code': code}, f, pickle.HIGHEST_PROTOCOL)
+            os.replace(temp_path, path)
+        except OSError as e:
+            logging.getLogger('').warning('Unable to write logic cache file %s: %s', path, e)
+            return
+        self.changed = False
+
+    @staticmethod
+    def load(key: str, cache_dir: str) -> Optional[LogicFile]:
+        path = os.path.join(cache_dir, key + '.pickle')
+        try:
+            with open(path, 'rb') as f:
+                data = pickle.load(f)
+            for rule_str, code in data['code'].items():
+                compiled_rule_code.setdefault(rule_str, marshal.loads(code))
+        except FileNotFoundError:
+            return None
+        except Exception as e:
+            logging.getLogger('').warning('Ignoring unreadable logic cache file %s: %s', path, e)
+            return None
+        logic_file = LogicFile(key, data['regions'])
+        logic_file.rules = data['rules']
+        return logic_file
+
+
+# Logic files already loaded by this process, by cache key
+logic_files: dict[str, LogicFile] = {}
+parser_version: Optional[str] = None
+
+
+def cache_path() -> str:
+    return local_path('Cache')
+
+
+# Sources the transformed rules depend on: the parser, which names are items or events (ItemList.py, Item.py),
+# the State methods rules can call, the boulder rules and the escaping and keyword defaults of rules.
+parser_sources: tuple[str, ...] = ('RuleParser.py', 'LogicCache.py', 'ItemList.py', 'Item.py', 'State.py', 'Boulders.py', 'RulesCommon.py')
+
+
+# Hash of everything parsing a logic file depends on besides the world attributes and settings
+# recorded with each rule: the file itself, the helpers, the parser sources and the python version.
+def logic_file_key(file_path: str, world: World) -> str:
+    global parser_version
+    if parser_version is None:
+        version_hash = hashlib.sha256(f'{__version__} {importlib.util.MAGIC_NUMBER!r}'.encode('utf-8'))
+        source_dir = os.path.dirname(os.path.realpath(__file__))
+        for path in (data_path('LogicHelpers.json'), *(os.path.join(source_dir, source) for source in parser_sources)):
+            try:
+                with open(path, 'rb') as f:
+                    version_hash.update(f.read())
+            except OSError:
+                # Bundled builds don't ship the sources, their version is enough.
+                pass
+        parser_version = version_hash.hexdigest()
+
+    file_hash = hashlib.sha256(parser_version.encode('utf-8'))
+    with open(file_path, 'rb') as f:
+        file_hash.update(f.read())
+    # Names of world attributes and settings are looked up while parsing
+    file_hash.update(' '.join(world.__dict__.keys()).encode('utf-8'))
+    file_hash.update(' '.join(world.settings.settings_dict.keys()).encode('utf-8'))
+    return file_hash.hexdigest()
+
+
+def load_logic_file(file_path: str, world: World) -> LogicFile:
+    key = logic_file_key(file_path, world)
+    if key not in logic_files:
+        logic_file = LogicFile.load(key, cache_path()) if world.settings.logic_cache else None
+        if logic_file is None:
+            logic_file = LogicFile(key, read_logic_file(file_path))
+            logic_file.changed = True
+        logic_files[key] = logic_file
+    return logic_files[key]
@@ -4,11 +4,16 @@ import gzip
 import os
 import platform
 import shutil
-from typing import Optional
+from collections.abc import Sequence
 
 from Rom import Rom
 from Utils import default_output_path, is_bundled, local_path, run_process
-from ntype import BigStream
+
+# NumPy is optional, it only speeds up adding the diff blocks
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
 
 # Handle 3.0 website patches.
@@ -38,9 +43,13 @@ def apply_ootr_3_web_patch(settings, rom: Rom) -> None:
     else:
         minibsdiff_python = True
 
+    # Fall back to python when the binary isn't shipped
+    if not minibsdiff_python and not os.path.isfile(minibsdiff_path):
+        minibsdiff_python = True
+
     if minibsdiff_python:
-        # Use the (slow) python re-implementation of minibsdiff.
-        logger.info("Patching ROM using slow Python implementation of minibsdiff. This might take some time.")
+        # Use the python re-implementation of minibsdiff.
+        logger.info("Patching ROM using Python implementation of minibsdiff.")
         apply_minibsdiff_patch_file(rom, settings.patch_file)
     else:
         # Use the minibsdiff binary.
@@ -82,14 +91,14 @@ def apply_ootr_3_web_patch(settings, rom: Rom) -> None:
 # Re-implementation of https://github.com/mhinds7/minibsdiff
 def apply_minibsdiff_patch_file(rom: Rom, file: str) -> None:
     with gzip.open(file, 'r') as stream:
-        patch_data: BigStream = BigStream(bytearray(stream.read()))
+        patch_data = memoryview(stream.read())
 
-    if patch_data.read_bytes(length=8) != b'MBSDIF43':  # minibsdiff header
+    if patch_data[:8] != b'MBSDIF43':  # minibsdiff header
         raise Exception("Patch file does not have a valid header. Aborting.")
 
-    ctrl_len: int = minibsdiff_read_int64(patch_data)
-    data_len: int = minibsdiff_read_int64(patch_data)
-    new_size: int = minibsdiff_read_int64(patch_data)
+    ctrl_len: int = minibsdiff_read_int64(patch_data, 8)
+    data_len: int = minibsdiff_read_int64(patch_data, 16)
+    new_size: int = minibsdiff_read_int64(patch_data, 24)
 
     if ctrl_len < 0 or data_len < 0 or new_size < 0:
         raise Exception("Patch file is invalid. Aborting.")
@@ -97,71 +106,77 @@ def apply_minibsdiff_patch_file(rom: Rom, file: str) -> None:
     original_size: int = len(rom.original.buffer)
     size_difference: int = new_size - len(rom.buffer)
     if size_difference > 0:
-        rom.append_bytes([0] * size_difference)
+        rom.buffer.extend(bytes(size_difference))
 
-    ctrl_block: list[int] = [0] * 3
     ctrl_block_address: int = 32
     diff_block_address: int = ctrl_block_address + ctrl_len
     extra_block_address: int = diff_block_address + data_len
 
+    # The new rom is built in the buffer directly, the changed bytes are found afterwards.
     old_pos: int = 0
     new_pos: int = 0
     while new_pos < new_size:
-        ctrl_block[0] = minibsdiff_read_int64(patch_data, ctrl_block_address)
-        ctrl_block[1] = minibsdiff_read_int64(patch_data)
-        ctrl_block[2] = minibsdiff_read_int64(patch_data)
+        diff_size = minibsdiff_read_int64(patch_data, ctrl_block_address)
+        extra_size = minibsdiff_read_int64(patch_data, ctrl_block_address + 8)
+        old_seek = minibsdiff_read_int64(patch_data, ctrl_block_address + 16)
         ctrl_block_address += 24
 
-        if ctrl_block[0] > 0:
+        if diff_size > 0:
             # Sanity check.
-            if new_pos + ctrl_block[0] > new_size:
+            if new_pos + diff_size > new_size:
                 raise Exception("Patch file is invalid. Aborting.")
 
-            # Read diff bytes.
-            diff_bytes: bytearray = patch_data.read_bytes(diff_block_address, ctrl_block[0])
-            diff_block_address += ctrl_block[0]
-
-            # Check for differences.
-            for i, diff_byte in enumerate(diff_bytes):
-                if old_pos + i > original_size:
-                    break
-                original_byte = rom.original.read_byte(old_pos + i)
-                current_byte = rom.read_byte(new_pos + i)
-                new_byte = (original_byte + diff_byte) & 0xFF
-                if new_byte != current_byte:
-                    rom.write_byte(new_pos + i, new_byte)
+            # Add the diff bytes to the original bytes. Outside the original rom, the diff bytes are used as is.
+            diff_bytes = patch_data[diff_block_address:diff_block_address + diff_size]
+            diff_block_address += diff_size
+            old_start = min(max(old_pos, 0), original_size)
+            old_end = min(max(old_pos + diff_size, 0), original_size)
+            new_bytes = bytearray(diff_bytes)
+            if old_start < old_end:
+                offset = old_start - old_pos
+                new_bytes[offset:offset + old_end - old_start] = add_bytes(rom.original.buffer[old_start:old_end], diff_bytes[offset:offset + old_end - old_start])
+            if rom.buffer[new_pos:new_pos + diff_size] != new_bytes:
+                rom.buffer[new_pos:new_pos + diff_size] = new_bytes
 
             # Increment positions.
-            old_pos += ctrl_block[0]
-            new_pos += ctrl_block[0]
+            old_pos += diff_size
+            new_pos += diff_size
 
-        if ctrl_block[1] > 0:
+        if extra_size > 0:
             # Sanity check.
-            if new_pos + ctrl_block[1] > new_size:
+            if new_pos + extra_size > new_size:
                 raise Exception("Patch file is invalid. Aborting.")
 
-            # Read extra bytes.
-            extra_bytes = patch_data.read_bytes(extra_block_address, ctrl_block[1])
-            extra_block_address += ctrl_block[1]
-
-            # Check for differences.
-            for i, extra_byte in enumerate(extra_bytes):
-                current_byte = rom.read_byte(new_pos + i)
-                if extra_byte != current_byte:
-                    rom.write_byte(new_pos + i, extra_byte)
+            # Copy the extra bytes.
+            extra_bytes = patch_data[extra_block_address:extra_block_address + extra_size]
+            extra_block_address += extra_size
+            if rom.buffer[new_pos:new_pos + extra_size] != extra_bytes:
+                rom.buffer[new_pos:new_pos + extra_size] = extra_bytes
 
         # Increment positions.
-        old_pos += ctrl_block[2]
-        new_pos += ctrl_block[1]
-
-
-def minibsdiff_read_int64(patch_data: BigStream, position: Optional[int] = None) -> int:
-    buffer: bytearray = patch_data.read_bytes(position, 8)
-    y: int = 0
-
-    for i in reversed(range(0, 8)):
-        y *= 256
-        y += buffer[i] & (0xFF if i != 7 else 0x7F)
-
-    y *= -1 if buffer[7] & 0x80 else 1
-    return y
+        old_pos += old_seek
+        new_pos += extra_size
+
+    rom.rescan_changed_bytes()
+
+
+# Bytewise addition modulo 256 of two equally long byte strings.
+def add_bytes(a: Sequence[int], b: Sequence[int]) -> bytes:
+    if numpy is not None:
+        return (numpy.frombuffer(a, numpy.uint8) + numpy.frombuffer(b, numpy.uint8)).tobytes()
+    # Add all bytes as one integer, without the top bit of each byte so
+    # that no carry crosses into the next byte, then xor the top bits back in.
+    size = len(a)
+    low_bits = int.from_bytes(b'\x7F' * size, 'big')
+    a_value = int.from_bytes(a, 'big')
+    b_value = int.from_bytes(b, 'big')
+    value = ((a_value & low_bits) + (b_value & low_bits)) ^ ((a_value ^ b_value) & ~low_bits)
+    return value.to_bytes(size, 'big')
+
+
+# minibsdiff stores integers as little endian sign and magnitude.
+def minibsdiff_read_int64(patch_data: memoryview, position: int) -> int:
+    value = int.from_bytes(patch_data[position:position + 8], 'little')
+    if value & 0x8000000000000000:
+        return -(value & 0x7FFFFFFFFFFFFFFF)
+    return value
@@ -2,12 +2,18 @@ from __future__ import annotations
 import copy
 import hashlib
 import logging
+import multiprocessing
 import os
+import pickle
 import platform
 import random
 import shutil
 import time
+import traceback
 import zipfile
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from dataclasses import dataclass, field
+from multiprocessing.pool import AsyncResult
 from typing import Optional
 
 
@@ -20,46 +26,219 @@ from Hints import build_gossip_hints
 from HintList import clear_hint_exclusion_cache, misc_item_hint_table, misc_location_hint_table
 from ItemPool import generate_itempool
 from MBSDIFFPatch import apply_ootr_3_web_patch
+from Metrics import phase, start_metrics
 from Models import patch_model_adult, patch_model_child
 from N64Patch import create_patch_file, apply_patch_file
 from Patches import patch_rom
-from Rom import Rom
+from Rom import AddressRanges, Rom
+from RuleProfiler import start_rule_profiler, stop_rule_profiler
 from Rules import set_entrances_based_rules, set_rules, set_shop_rules
 from Settings import Settings
 from SettingsList import logic_tricks
 from Spoiler import Spoiler
 from Utils import default_output_path, is_bundled, run_process, data_path
 from World import World
+from Yaz0 import compress_rom_data, compression_cache_path, has_compressed_files
 from version import __version__
 from BoulderShuffle import set_boulders, shuffle_boulders
 
-def main(settings: Settings, max_attempts: int = 10) -> Spoiler:
+# Outcome of generating one seed, filled in by main when given
+@dataclass
+class SeedResult:
+    seed: str
+    attempts: int = 0
+    error: Optional[str] = None
+    # wall time of each phase of main in seconds, see Metrics
+    times: dict[str, float] = field(default_factory=dict)
+
+
+def main(settings: Settings, max_attempts: int = 10, rom: Optional[Rom] = None, result: Optional[SeedResult] = None) -> Spoiler:
     clear_hint_exclusion_cache()
     logger = logging.getLogger('')
     start = time.process_time()
+    if result is None:
+        result = SeedResult(settings.seed)
+    metrics = start_metrics()
+    # rules are wrapped for the profiler as they are parsed
+    rule_profiler = start_rule_profiler() if settings.profile_rules else None
 
-    rom = resolve_settings(settings)
-    max_attempts = max(max_attempts, 1)
-    spoiler = None
-    for attempt in range(1, max_attempts + 1):
-        settings.reset_distribution()
-        try:
-            spoiler = generate(settings)
-            break
-        except ShuffleError as e:
-            logger.warning('Failed attempt %d of %d: %s', attempt, max_attempts, e)
-            if attempt >= max_attempts:
-                raise
+    try:
+        with phase('resolve'):
+            rom = resolve_settings(settings, rom)
+
+        with phase('generate'):
+            max_attempts = max(max_attempts, 1)
+            spoiler = None
+            if settings.attempt_workers > 1 and max_attempts > 1:
+                spoiler = generate_speculatively(settings, max_attempts, result)
             else:
-                logger.info('Retrying...\n\n')
-    if spoiler is None:
-        raise RuntimeError("Generation failed.")
-    patch_and_output(settings, spoiler, rom)
+                spoiler = generate_attempts(settings, max_attempts, result, random.getstate())
+        if spoiler is None:
+            raise RuntimeError("Generation failed.")
+        spoiler.metrics = metrics
+
+        with phase('output'):
+            patch_and_output(settings, spoiler, rom)
+    finally:
+        result.times.update(metrics.times())
+        stop_rule_profiler()
+
+    if settings.output_metrics:
+        metrics_path = os.path.join(default_output_path(settings.output_dir), '%s_Metrics.json' % get_output_filename_base(settings))
+        metrics.to_file(metrics_path)
+        logger.info("Created metrics log at: %s" % metrics_path)
+    if rule_profiler is not None:
+        rule_profile_path = os.path.join(default_output_path(settings.output_dir), '%s_RuleProfile.txt' % get_output_filename_base(settings))
+        rule_profiler.to_file(rule_profile_path)
+        logger.info("Created rule profile at: %s" % rule_profile_path)
     logger.debug('Total Time: %s', time.process_time() - start)
     return spoiler
 
 
-def resolve_settings(settings: Settings) -> Optional[Rom]:
+# Attempt 1 continues the random state left by resolve_settings, later attempts are seeded from the
+# seed and attempt number. An attempt then comes out the same whichever attempts ran before it, so
+# the number of attempt workers never changes the generated seed.
+def generate_attempts(settings: Settings, max_attempts: int, result: SeedResult, rng_state: tuple,
+                      pending: Optional[dict[int, AsyncResult]] = None) -> Spoiler:
+    logger = logging.getLogger('')
+    for attempt in range(1, max_attempts + 1):
+        result.attempts = attempt
+        error = None
+        if pending is not None and attempt in pending and pending[attempt].ready():
+            outcome = pending[attempt].get()
+            if isinstance(outcome, str):
+                # generated here anyway, where the error shows up again if it wasn't specific to the worker
+                logger.error('Attempt %d failed in a worker process:\n%s', attempt, outcome)
+            else:
+                error = outcome
+        if error is None:
+            try:
+                return generate_attempt(settings, rng_state, attempt)
+            except ShuffleError as e:
+                error = e
+        logger.warning('Failed attempt %d of %d: %s', attempt, max_attempts, error)
+        if attempt < max_attempts:
+            logger.info('Retrying...\n\n')
+    raise error
+
+
+# Worker processes try the later attempts while this process generates the first ones. The worlds of
+# a worker can't be sent back, so this process still generates every attempt itself and never waits
+# for a worker, it only skips the attempts a worker has already seen fail.
+def generate_speculatively(settings: Settings, max_attempts: int, result: SeedResult) -> Spoiler:
+    rng_state = random.getstate()
+    # the pool sends its tasks from another thread, so pickle the settings before they are used here
+    settings_data = pickle.dumps(settings)
+    workers = min(settings.attempt_workers, max_attempts) - 1
+    # leaving the pool terminates the workers still running later attempts
+    with multiprocessing.Pool(workers) as pool:
+        pending = {attempt: pool.apply_async(try_attempt, (settings_data, rng_state, attempt))
+                   for attempt in range(2, max_attempts + 1)}
+        return generate_attempts(settings, max_attempts, result, rng_state, pending)
+
+
+def generate_attempt(settings: Settings, rng_state: tuple, attempt: int) -> Spoiler:
+    settings.reset_distribution()
+    if attempt == 1:
+        random.setstate(rng_state)
+    else:
+        random.seed(hashlib.sha256(f'{settings.numeric_seed}-{attempt}'.encode('utf-8')).digest())
+    return generate(settings)
+
+
+# Returns None if the attempt succeeded, the ShuffleError it failed with,
+# or the traceback of any other error for the main process to log.
+def try_attempt(settings_data: bytes, rng_state: tuple, attempt: int) -> Optional[ShuffleError | str]:
+    # the main process logs the outcome
+    logging.getLogger('').setLevel(logging.ERROR)
+    try:
+        generate_attempt(pickle.loads(settings_data), rng_state, attempt)
+    except ShuffleError as e:
+        return e
+    except Exception:
+        return traceback.format_exc()
+    return None
+
+
+# The rom loaded by this batch worker process, reused by all of its seeds
+batch_rom: Optional[Rom] = None
+# Processes compressing each rom, a single one in batch worker processes which already run side by side
+rom_compression_workers: Optional[int] = None
+
+
+def init_batch_worker(settings: Settings, loglevel: int, compression_workers: Optional[int] = None) -> None:
+    global batch_rom, rom_compression_workers
+    logging.basicConfig(format='%(message)s', level=loglevel)
+    rom_compression_workers = compression_workers
+    if uses_rom(settings):
+        batch_rom = Rom(settings.rom)
+
+
+def generate_batch_seed(settings: Settings, seed: str, max_attempts: int) -> SeedResult:
+    settings.update_seed(seed)
+    result = SeedResult(settings.seed)
+    try:
+        main(settings, max_attempts, batch_rom, result)
+    except Exception as e:
+        logging.getLogger('').exception('Failed to generate seed %s', seed)
+        result.error = f'{type(e).__name__}: {e}'
+    return result
+
+
+# Generate settings.count seeds in worker processes, seed i using the seed string "<seed>-<i>".
+# Every seed starts from the same settings, and each worker loads the rom and logic once.
+def main_batch(settings: Settings, max_attempts: int = 10, workers: Optional[int] = None) -> list[SeedResult]:
+    logger = logging.getLogger('')
+    start = time.perf_counter()
+    count = max(settings.count or 1, 1)
+    if not workers:
+        workers = os.cpu_count() or 1
+    workers = min(workers, count)
+    seeds = [f'{settings.seed}-{i}' for i in range(count)]
+
+    if workers <= 1:
+        init_batch_worker(settings, logger.getEffectiveLevel())
+        results = [generate_batch_seed(copy.deepcopy(settings), seed, max_attempts) for seed in seeds]
+    else:
+        logger.info('Generating %d seeds with %d worker processes.', count, workers)
+        with ProcessPoolExecutor(max_workers=workers, initializer=init_batch_worker,
+                                 initargs=(settings, logger.getEffectiveLevel(), 1)) as executor:
+            futures = {executor.submit(generate_batch_seed, settings, seed, max_attempts): index
+                       for index, seed in enumerate(seeds)}
+            results = [None] * count
+            for future in as_completed(futures):
+                index = futures[future]
+                try:
+                    results[index] = future.result()
+                except Exception as e:
+                    # the worker process itself died
+                    results[index] = SeedResult(seeds[index], error=f'{type(e).__name__}: {e}')
+
+    log_batch_summary(results, time.perf_counter() - start)
+    return results
+
+
+def log_batch_summary(results: list[SeedResult], total_time: float) -> None:
+    logger = logging.getLogger('')
+    successes = [result for result in results if result.error is None]
+    retries = sum(max(result.attempts - 1, 0) for result in results)
+    logger.info('Generated %d of %d seeds in %.2fs with %d retries.', len(successes), len(results), total_time, retries)
+    for result in results:
+        if result.error is not None:
+            logger.info('Seed %s failed: %s', result.seed, result.error)
+    for phase in ('resolve', 'generate', 'output'):
+        times = [result.times[phase] for result in results if phase in result.times]
+        if times:
+            logger.info('%-8s total %8.2fs  mean %6.2fs  max %6.2fs', phase, sum(times), sum(times) / len(times), max(times))
+
+
+# Whether the settings need the base rom to output anything
+def uses_rom(settings: Settings) -> bool:
+    outputting_specific_world = settings.create_uncompressed_rom or settings.create_compressed_rom or settings.create_wad_file
+    return bool(outputting_specific_world or settings.create_patch_file or settings.patch_without_output)
+
+
+def resolve_settings(settings: Settings, rom: Optional[Rom] = None) -> Optional[Rom]:
     logger = logging.getLogger('')
 
     old_tricks = settings.allowed_tricks
@@ -75,14 +254,17 @@ def resolve_settings(settings: Settings) -> Optional[Rom]:
 
     # we load the rom before creating the seed so that errors get caught early
     outputting_specific_world = settings.create_uncompressed_rom or settings.create_compressed_rom or settings.create_wad_file
-    using_rom = outputting_specific_world or settings.create_patch_file or settings.patch_without_output
+    using_rom = uses_rom(settings)
     if not (using_rom or settings.patch_without_output) and not settings.create_spoiler:
         raise Exception('You must have at least one output type or spoiler log enabled to produce anything.')
 
-    if using_rom:
+    if not using_rom:
+        rom = None
+    elif rom is None:
         rom = Rom(settings.rom)
     else:
-        rom = None
+        # reused from a previous seed
+        rom.restore()
 
     if not settings.world_count:
         settings.world_count = 1
@@ -111,8 +293,10 @@ def resolve_settings(settings: Settings) -> Optional[Rom]:
 
 
 def generate(settings: Settings) -> Spoiler:
-    worlds = build_world_graphs(settings)
-    place_items(worlds)
+    with phase('build_world_graphs'):
+        worlds = build_world_graphs(settings)
+    with phase('distribute_items'):
+        place_items(worlds)
     for world in worlds:
         world.distribution.configure_effective_starting_items(worlds, world)
     if worlds[0].enable_goal_hints:
@@ -177,12 +361,17 @@ def build_world_graphs(settings: Settings) -> list[World]:
     shuffle_enemies(worlds)
 
     if worlds[0].entrance_shuffle:
-        shuffle_random_entrances(worlds)
+        with phase('shuffle_entrances'):
+            shuffle_random_entrances(worlds)
 
     shuffle_boulders(worlds)
 
     set_entrances_based_rules(worlds)
 
+    # the entrances are final, the fill and hints look up the hint areas of most regions
+    for world in worlds:
+        world.resolve_hint_areas()
+
     return worlds
 
 
@@ -197,13 +386,19 @@ def make_spoiler(settings: Settings, worlds: list[World]) -> Spoiler:
     spoiler = Spoiler(worlds)
     if settings.create_spoiler:
         logger.info('Calculating playthrough.')
-        spoiler.create_playthrough()
+        with phase('create_playthrough'):
+            spoiler.create_playthrough()
     if settings.create_spoiler or settings.hints != 'none':
         logger.info('Calculating hint data.')
-        update_goal_items(spoiler)
-        build_gossip_hints(spoiler, worlds)
+        # The WOTH search is the most expensive part, skip it if neither the spoiler log nor the hints use it.
+        search_woth = settings.create_spoiler or any(world.enable_woth_hints for world in worlds)
+        with phase('update_goal_items'):
+            update_goal_items(spoiler, search_woth)
+        with phase('build_gossip_hints'):
+            build_gossip_hints(spoiler, worlds)
     elif any(world.dungeon_rewards_hinted for world in worlds) or any(hint_type in settings.misc_hints for hint_type in misc_item_hint_table) or any(hint_type in settings.misc_hints for hint_type in misc_location_hint_table):
-        spoiler.find_misc_hint_items()
+        with phase('find_misc_hint_items'):
+            spoiler.find_misc_hint_items()
     spoiler.build_file_hash()
     spoiler.build_password(settings.password_lock)
     return spoiler
@@ -220,8 +415,10 @@ def prepare_rom(spoiler: Spoiler, world: World, rom: Rom, settings: Settings, rn
 
     if restore:
         rom.restore()
-    patch_rom(spoiler, world, rom)
-    cosmetics_log = patch_cosmetics(settings, rom)
+    with phase('patch_rom'):
+        patch_rom(spoiler, world, rom)
+    with phase('patch_cosmetics'):
+        cosmetics_log = patch_cosmetics(settings, rom)
     if not settings.generating_patch_file:
         if settings.model_adult != "Default" or len(settings.model_adult_filepicker) > 0:
             patch_model_adult(rom, settings, cosmetics_log)
@@ -231,8 +428,32 @@ def prepare_rom(spoiler: Spoiler, world: World, rom: Rom, settings: Settings, rn
     return cosmetics_log
 
 
-def compress_rom(input_file: str, output_file: str, delete_input: bool = False) -> None:
+# The in process compressor wins with several workers or compressed files to reuse, the compressor
+# binary compresses about twice as fast on a single core.
+def compress_rom(input_file: str, output_file: str, delete_input: bool = False, workers: Optional[int] = None, use_cache: bool = True) -> None:
     logger = logging.getLogger('')
+    if workers is None:
+        workers = os.cpu_count() or 1
+    cache_dir = compression_cache_path() if use_cache else None
+    compressor_path = get_compressor_path()
+    if workers <= 1 and compressor_path is not None and os.path.isfile(compressor_path) and not has_compressed_files(cache_dir):
+        compress_rom_binary(input_file, output_file)
+    else:
+        try:
+            with open(input_file, 'rb') as f:
+                data = compress_rom_data(f.read(), workers, cache_dir)
+            with open(output_file, 'wb') as f:
+                f.write(data)
+        except Exception as ex:
+            # The compressor binaries remain as a fallback
+            logger.warning('In process ROM compression failed, using the compressor binary instead: %s', ex)
+            compress_rom_binary(input_file, output_file)
+    if delete_input:
+        os.remove(input_file)
+
+
+# The compressor binary for this platform, or None if there is none.
+def get_compressor_path() -> Optional[str]:
     compressor_path = "./" if is_bundled() else "bin/Compress/"
     if platform.system() == 'Windows':
         if platform.machine() == 'AMD64':
@@ -254,12 +475,18 @@ def compress_rom(input_file: str, output_file: str, delete_input: bool = False)
         else:
             compressor_path += "Compress.out"
     else:
+        return None
+    return compressor_path
+
+
+def compress_rom_binary(input_file: str, output_file: str) -> None:
+    logger = logging.getLogger('')
+    compressor_path = get_compressor_path()
+    if compressor_path is None:
         logger.info("OS not supported for ROM compression.")
         raise Exception("This operating system does not support ROM compression. You may only output patch files or uncompressed ROMs.")
 
     run_process(logger, [compressor_path, input_file, output_file], check=True)
-    if delete_input:
-        os.remove(input_file)
 
 
 def generate_wad(wad_file: str, rom_file: str, output_file: str, channel_title: str, channel_id: str, delete_input: bool = False) -> None:
@@ -303,19 +530,22 @@ def generate_wad(wad_file: str, rom_file: str, output_file: str, channel_title:
         os.remove(rom_file)
 
 
+def get_output_filename_base(settings: Settings) -> str:
+    if settings.output_file:
+        return settings.output_file
+    settings_string_hash = hashlib.sha1(settings.settings_string.encode('utf-8')).hexdigest().upper()[:5]
+    output_filename_base = f"OoT_{settings_string_hash}_{settings.seed}"
+    if settings.world_count > 1:
+        output_filename_base += f"_W{settings.world_count}"
+    return output_filename_base
+
+
 def patch_and_output(settings: Settings, spoiler: Spoiler, rom: Optional[Rom]) -> None:
     logger = logging.getLogger('')
     worlds = spoiler.worlds
     cosmetics_log = None
 
-    settings_string_hash = hashlib.sha1(settings.settings_string.encode('utf-8')).hexdigest().upper()[:5]
-    if settings.output_file:
-        output_filename_base = settings.output_file
-    else:
-        output_filename_base = f"OoT_{settings_string_hash}_{settings.seed}"
-        if settings.world_count > 1:
-            output_filename_base += f"_W{settings.world_count}"
-
+    output_filename_base = get_output_filename_base(settings)
     output_dir = default_output_path(settings.output_dir)
 
     compressed_rom = settings.create_compressed_rom or settings.create_wad_file
@@ -348,7 +578,8 @@ def patch_and_output(settings: Settings, spoiler: Spoiler, rom: Optional[Rom]) -
                 logger.info(f"Creating Patch File: {patch_filename}")
                 output_path = os.path.join(output_dir, patch_filename)
                 file_list.append(patch_filename)
-                create_patch_file(rom, output_path)
+                with phase('create_patch_file'):
+                    create_patch_file(rom, output_path)
 
                 # Cosmetics Log for patch file only.
                 if settings.create_cosmetics_log and patch_cosmetics_log:
@@ -372,7 +603,8 @@ def patch_and_output(settings: Settings, spoiler: Spoiler, rom: Optional[Rom]) -
                 cosmetics_log = prepare_rom(spoiler, world, rom, settings, rng_state, restore_rom)
             else:
                 cosmetics_log = patch_cosmetics_log
-            rom.write_to_file(uncompressed_path)
+            with phase('write_rom'):
+                rom.write_to_file(uncompressed_path)
             logger.info("Created uncompressed ROM at: %s" % uncompressed_path)
 
             # If we aren't compressing the ROM, we're done with this world.
@@ -382,7 +614,9 @@ def patch_and_output(settings: Settings, spoiler: Spoiler, rom: Optional[Rom]) -
             compressed_filename = f"{output_filename_base}{player_filename_suffix}.z64"
             compressed_path = os.path.join(output_dir, compressed_filename)
             logger.info(f"Compressing ROM: {compressed_filename}")
-            compress_rom(uncompressed_path, compressed_path, not settings.create_uncompressed_rom)
+            with phase('compress_rom'):
+                compress_rom(uncompressed_path, compressed_path, not settings.create_uncompressed_rom, rom_compression_workers,
+                             use_cache=settings.rom_compression_cache)
             logger.info("Created compressed ROM at: %s" % compressed_path)
 
             # If we aren't generating a WAD, we're done with this world.
@@ -394,7 +628,8 @@ def patch_and_output(settings: Settings, spoiler: Spoiler, rom: Optional[Rom]) -
             logger.info(f"Generating WAD file: {wad_filename}")
             channel_title = settings.wad_channel_title if settings.wad_channel_title != "" and settings.wad_channel_title is not None else "OoTRandomizer"
             channel_id = settings.wad_channel_id if settings.wad_channel_id != "" and settings.wad_channel_id is not None else "OOTE"
-            generate_wad(settings.wad_file, compressed_path, wad_path, channel_title, channel_id, not settings.create_compressed_rom)
+            with phase('generate_wad'):
+                generate_wad(settings.wad_file, compressed_path, wad_path, channel_title, channel_id, not settings.create_compressed_rom)
             logger.info("Created WAD file at: %s" % wad_path)
 
         # World loop over, make the patch archive if applicable.
@@ -416,9 +651,10 @@ def patch_and_output(settings: Settings, spoiler: Spoiler, rom: Optional[Rom]) -
         settings.distribution.to_file(settings_path, False)
         logger.info("Created settings log at: %s" % ('%s_Settings.json' % output_filename_base))
     if settings.create_spoiler:
-        settings.distribution.update_spoiler(spoiler, True)
-        spoiler_path = os.path.join(output_dir, '%s_Spoiler.json' % output_filename_base)
-        settings.distribution.to_file(spoiler_path, True)
+        with phase('write_spoiler'):
+            settings.distribution.update_spoiler(spoiler, True)
+            spoiler_path = os.path.join(output_dir, '%s_Spoiler.json' % output_filename_base)
+            settings.distribution.to_file(spoiler_path, True)
         logger.info("Created spoiler log at: %s" % ('%s_Spoiler.json' % output_filename_base))
 
     if settings.create_cosmetics_log and cosmetics_log:
@@ -497,7 +733,8 @@ def from_patch_file(settings: Settings) -> None:
     if compressed_rom:
         logger.info('Compressing ROM')
         compressed_path = output_path + '.z64'
-        compress_rom(uncompressed_path, compressed_path, not settings.create_uncompressed_rom)
+        compress_rom(uncompressed_path, compressed_path, not settings.create_uncompressed_rom, rom_compression_workers,
+                     use_cache=settings.rom_compression_cache)
         logger.info("Created compressed rom at: %s" % compressed_path)
 
         if settings.create_wad_file:
@@ -557,7 +794,7 @@ def cosmetic_patch(settings: Settings) -> None:
 
     # clear changes from the base patch file
     patched_base_rom = copy.copy(rom.buffer)
-    rom.changed_address = {}
+    rom.changed_ranges = AddressRanges()
     rom.changed_dma = {}
     rom.force_patch = []
 
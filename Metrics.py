@@ -0,0 +1,105 @@
+from __future__ import annotations
+import json
+import time
+from collections.abc import Iterator
+from contextlib import contextmanager
+from dataclasses import dataclass, field
+from typing import Any, Optional
+
+
+# Counts of the work done while generating, increased in place by the code doing it.
+# With slots an increment costs about as much as one of a local variable.
+class Counters:
+    __slots__ = ('rule_evaluations', 'searches', 'search_copies', 'state_copies')
+
+    def __init__(self) -> None:
+        for name in self.__slots__:
+            setattr(self, name, 0)
+
+    def snapshot(self) -> dict[str, int]:
+        return {name: getattr(self, name) for name in self.__slots__}
+
+
+counters: Counters = Counters()
+
+
+def counters_since(start: dict[str, int]) -> dict[str, int]:
+    return {name: value - start[name] for name, value in counters.snapshot().items()}
+
+
+@dataclass
+class PhaseMetrics:
+    wall_time: float = 0.0
+    cpu_time: float = 0.0
+    # how often the phase ran, eg. once per attempt or per world
+    calls: int = 0
+    counters: dict[str, int] = field(default_factory=dict)
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            'wall_time': round(self.wall_time, 6),
+            'cpu_time': round(self.cpu_time, 6),
+            'calls': self.calls,
+            'counters': self.counters,
+        }
+
+
+# Wall and CPU time of each phase of generating a seed, and the counters of the work done in it.
+# Phases can be nested, a phase includes the phases run inside of it.
+class Metrics:
+    def __init__(self) -> None:
+        self.phases: dict[str, PhaseMetrics] = {}
+        self.wall_start: float = time.perf_counter()
+        self.cpu_start: float = time.process_time()
+        self.counters_start: dict[str, int] = counters.snapshot()
+
+    @contextmanager
+    def phase(self, name: str) -> Iterator[None]:
+        wall_start = time.perf_counter()
+        cpu_start = time.process_time()
+        counters_start = counters.snapshot()
+        # listed in the order the phases first started
+        phase = self.phases.setdefault(name, PhaseMetrics())
+        try:
+            yield
+        finally:
+            phase.wall_time += time.perf_counter() - wall_start
+            phase.cpu_time += time.process_time() - cpu_start
+            phase.calls += 1
+            for counter, value in counters_since(counters_start).items():
+                phase.counters[counter] = phase.counters.get(counter, 0) + value
+
+    # Wall time of each phase in seconds
+    def times(self) -> dict[str, float]:
+        return {name: phase.wall_time for name, phase in self.phases.items()}
+
+    def to_json(self) -> dict[str, Any]:
+        return {
+            'wall_time': round(time.perf_counter() - self.wall_start, 6),
+            'cpu_time': round(time.process_time() - self.cpu_start, 6),
+            'counters': counters_since(self.counters_start),
+            'phases': {name: phase.to_json() for name, phase in self.phases.items()},
+        }
+
+    def to_file(self, filename: str) -> None:
+        with open(filename, 'w', encoding='utf-8') as f:
+            json.dump(self.to_json(), f, indent=4)
+
+
+# The metrics of the seed this process is generating, which phase() records to
+active_metrics: Optional[Metrics] = None
+
+
+def start_metrics() -> Metrics:
+    global active_metrics
+    active_metrics = Metrics()
+    return active_metrics
+
+
+@contextmanager
+def phase(name: str) -> Iterator[None]:
+    if active_metrics is None:
+        yield
+    else:
+        with active_metrics.phase(name):
+            yield
@@ -1,214 +1,309 @@
 from __future__ import annotations
+import bisect
 import copy
+import heapq
 import random
+import struct
 import zipfile
 import zlib
-from typing import TYPE_CHECKING, Optional
+from collections.abc import Iterator
+from typing import TYPE_CHECKING, Any, BinaryIO, Optional
 
-from Rom import Rom
-from ntype import BigStream
+from Rom import Rom, RomBuffer, changed_runs
+from ntype import uint24
 
 if TYPE_CHECKING:
     from Settings import Settings
 
 
-# get the next XOR key. Uses some location in the source rom.
-# This will skip of 0s, since if we hit a block of 0s, the
-# patch data will be raw.
-def key_next(rom: Rom, key_address: int, address_range: tuple[int, int]) -> tuple[int, int]:
-    key = 0
-    while key == 0:
-        key_address += 1
-        if key_address > address_range[1]:
-            key_address = address_range[0]
-        key = rom.original.buffer[key_address]
-    return key, key_address
-
-
 # creates a XOR block for the patch. This might break it up into
 # multiple smaller blocks if there is a concern about the XOR key
-# or if it is too long.
-def write_block(rom: Rom, xor_address: int, xor_range: tuple[int, int], block_start: int,
-                data: list[int], patch_data: BigStream) -> int:
-    new_data = []
+# or if it is too long. keys holds the source rom bytes of xor_range.
+def write_block(keys: bytes, xor_address: int, xor_range: tuple[int, int], block_start: int,
+                data: bytes, patch_data: bytearray) -> int:
+    new_data = bytearray()
     key_offset = 0
     continue_block = False
+    key_index = xor_address - xor_range[0]
+    key_count = len(keys)
 
     for b in data:
         if b == 0:
             # Leave 0s as 0s. Do not XOR
-            new_data += [0]
+            new_data.append(0)
         else:
             # get the next XOR key
-            key, xor_address = key_next(rom, xor_address, xor_range)
+            key = 0
+            while key == 0:
+                key_index += 1
+                if key_index == key_count:
+                    key_index = 0
+                key = keys[key_index]
 
             # if the XOR would result in 0, change the key.
             # This requires breaking up the block.
             if b == key:
                 write_block_section(block_start, key_offset, new_data, patch_data, continue_block)
-                new_data = []
+                new_data = bytearray()
                 key_offset = 0
                 continue_block = True
 
                 # search for next safe XOR key
                 while b == key:
                     key_offset += 1
-                    key, xor_address = key_next(rom, xor_address, xor_range)
+                    key = 0
+                    while key == 0:
+                        key_index += 1
+                        if key_index == key_count:
+                            key_index = 0
+                        key = keys[key_index]
                     # if we aren't able to find one quickly, we may need to break again
                     if key_offset == 0xFF:
                         write_block_section(block_start, key_offset, new_data, patch_data, continue_block)
-                        new_data = []
+                        new_data = bytearray()
                         key_offset = 0
                         continue_block = True
 
             # XOR the key with the byte
-            new_data += [b ^ key]
+            new_data.append(b ^ key)
 
-            # Break the block if it's too long
-            if len(new_data) == 0xFFFF:
-                write_block_section(block_start, key_offset, new_data, patch_data, continue_block)
-                new_data = []
-                key_offset = 0
-                continue_block = True
+        # Break the block if it's too long
+        if len(new_data) == 0xFFFF:
+            write_block_section(block_start, key_offset, new_data, patch_data, continue_block)
+            new_data = bytearray()
+            key_offset = 0
+            continue_block = True
 
     # Save the block
     write_block_section(block_start, key_offset, new_data, patch_data, continue_block)
-    return xor_address
+    return key_index + xor_range[0]
 
 
 # This saves a sub-block for the XOR block. If it's the first part
 # then it will include the address to write to. Otherwise, it will
 # have a number of XOR keys to skip and then continue writing after
 # the previous block
-def write_block_section(start: int, key_skip: int, in_data: list[int], patch_data: BigStream, is_continue: bool) -> None:
+def write_block_section(start: int, key_skip: int, in_data: bytes, patch_data: bytearray, is_continue: bool) -> None:
     if not is_continue:
-        patch_data.append_int32(start)
+        patch_data += struct.pack('>IH', start, len(in_data))
     else:
-        patch_data.append_bytes([0xFF, key_skip])
-    patch_data.append_int16(len(in_data))
-    patch_data.append_bytes(in_data)
+        patch_data += struct.pack('>BBH', 0xFF, key_skip, len(in_data))
+    patch_data += in_data
+
+
+# The addresses the patch needs to change, as sorted (start, end) runs.
+# Make sure to not include any of the DMA table addresses.
+def changed_address_runs(rom: Rom, new_buffer: RomBuffer) -> Iterator[tuple[int, int]]:
+    dma_start, dma_end = rom.dma.dma_start, rom.dma.dma_end
+    force_patch = sorted(set(rom.force_patch))
+    for start, end in rom.changed_ranges:
+        for range_start, range_end in ((start, min(end, dma_start)), (max(start, dma_start, dma_end), end)):
+            if range_start >= range_end:
+                continue
+            data = rom.buffer[range_start:range_end]
+            # addresses past the end of a shrunk rom are changed to 0
+            data.extend(bytes(range_end - range_start - len(data)))
+            original = new_buffer[range_start:range_end]
+            forced = ((address, address + 1) for address in
+                      force_patch[bisect.bisect_left(force_patch, range_start):bisect.bisect_left(force_patch, range_end)])
+            if data == original:
+                yield from forced
+            else:
+                runs = ((range_start + run_start, range_start + run_end) for run_start, run_end in changed_runs(data, original))
+                yield from heapq.merge(runs, forced)
 
 
 # This will create the patch file. Which can be applied to a source rom.
 # xor_range is the range the XOR key will read from. This range is not
 # too important, but I tried to choose from a section that didn't really
 # have big gaps of 0s which we want to avoid.
+# The patch is compressed while it is written, block by block.
 def create_patch_file(rom: Rom, file: str, xor_range: tuple[int, int] = (0x00B8AD30, 0x00F029A0)) -> None:
-    dma_start, dma_end = rom.dma.dma_start, rom.dma.dma_end
-
-    # add header
-    patch_data = BigStream(bytearray())
-    patch_data.append_bytes(list(map(ord, 'ZPFv1')))
-    patch_data.append_int32(dma_start)
-    patch_data.append_int32(xor_range[0])
-    patch_data.append_int32(xor_range[1])
-
-    # get random xor key. This range is chosen because it generally
-    # doesn't have many sections of 0s
-    xor_address = random.Random().randint(*xor_range)
-    patch_data.append_int32(xor_address)
-
-    new_buffer = copy.copy(rom.original.buffer)
-
-    # write every changed DMA entry
-    for dma_index, (from_file, start, size) in rom.changed_dma.items():
-        patch_data.append_int16(dma_index)
-        patch_data.append_int32(from_file)
-        patch_data.append_int32(start)
-        patch_data.append_int24(size)
-
-        # We don't trust files that have modified DMA to have their
-        # changed addresses tracked correctly, so we invalidate the
-        # entire file
-        for address in range(start, start + size):
-            rom.changed_address[address] = rom.buffer[address]
-
-        # Simulate moving the files to know which addresses have changed
-        if from_file >= 0:
-            old_dma_start, old_dma_end, old_size = rom.original.dma.get_dmadata_record_by_key(from_file).as_tuple()
-            copy_size = min(size, old_size)
-            new_buffer[start:start+copy_size] = rom.original.read_bytes(from_file, copy_size)
-            new_buffer[start+copy_size:start+size] = [0] * (size - copy_size)
-        else:
-            # this is a new file, so we just fill with null data
-            new_buffer[start:start+size] = [0] * size
-
-    # end of DMA entries
-    patch_data.append_int16(0xFFFF)
-
-    # filter down the addresses that will actually need to change.
-    # Make sure to not include any of the DMA table addresses
-    changed_addresses = [address for address, value in rom.changed_address.items()
-                         if (address >= dma_end or address < dma_start) and
-                         (address in rom.force_patch or new_buffer[address] != value)]
-    changed_addresses.sort()
-
-    # Write the address changes. We'll store the data with XOR so that
-    # the patch data won't be raw data from the patched rom.
-    data = []
-    block_start = block_end = None
-    BLOCK_HEADER_SIZE = 7  # this is used to break up gaps
-    for address in changed_addresses:
-        # if there's a block to write and there's a gap, write it
-        if block_start:
-            block_end = block_start + len(data) - 1
-            if address > block_end + BLOCK_HEADER_SIZE:
-                xor_address = write_block(rom, xor_address, xor_range, block_start, data, patch_data)
-                data = []
-                block_start = None
-                block_end = None
-
-        # start a new block
-        if not block_start:
-            block_start = address
-            block_end = address - 1
-
-        # save the new data
-        data += rom.buffer[block_end+1:address+1]
-
-    # if there was any leftover blocks, write them out
-    if block_start:
-        xor_address = write_block(rom, xor_address, xor_range, block_start, data, patch_data)
-
-    # compress the patch file
-    patch_data = bytes(patch_data.buffer)
-    patch_data = zlib.compress(patch_data)
-
-    # save the patch file
+    compressor = zlib.compressobj()
     with open(file, 'wb') as outfile:
-        outfile.write(patch_data)
+        # add header
+        patch_data = bytearray(b'ZPFv1')
+        patch_data += struct.pack('>III', rom.dma.dma_start, *xor_range)
+
+        # get random xor key. This range is chosen because it generally
+        # doesn't have many sections of 0s
+        xor_address = random.Random().randint(*xor_range)
+        patch_data += struct.pack('>I', xor_address)
+
+        new_buffer = copy.copy(rom.original.buffer)
+
+        # write every changed DMA entry
+        for dma_index, (from_file, start, size) in rom.changed_dma.items():
+            patch_data += struct.pack('>HII', dma_index, from_file & 0xFFFFFFFF, start) + uint24.bytes(size)
+
+            # We don't trust files that have modified DMA to have their
+            # changed addresses tracked correctly, so we invalidate the
+            # entire file
+            rom.changed_ranges.add(start, start + size)
+
+            # Simulate moving the files to know which addresses have changed
+            if from_file >= 0:
+                old_dma_start, old_dma_end, old_size = rom.original.dma.get_dmadata_record_by_key(from_file).as_tuple()
+                copy_size = min(size, old_size)
+                new_buffer[start:start+copy_size] = rom.original.read_bytes(from_file, copy_size)
+                new_buffer[start+copy_size:start+size] = bytes(size - copy_size)
+            else:
+                # this is a new file, so we just fill with null data
+                new_buffer[start:start+size] = bytes(size)
+
+        # end of DMA entries
+        patch_data += struct.pack('>H', 0xFFFF)
+
+        # Write the address changes. We'll store the data with XOR so that
+        # the patch data won't be raw data from the patched rom.
+        keys = rom.original.read_bytes(xor_range[0], xor_range[1] - xor_range[0] + 1)
+        block_start = block_end = None
+        BLOCK_HEADER_SIZE = 7  # this is used to break up gaps
+        for run_start, run_end in changed_address_runs(rom, new_buffer):
+            # if there's a block to write and there's a gap, write it
+            if block_start is not None and run_start > block_end + BLOCK_HEADER_SIZE:
+                xor_address = write_block(keys, xor_address, xor_range, block_start, rom.buffer[block_start:block_end+1], patch_data)
+                block_start = None
+                if len(patch_data) >= 0x10000:
+                    outfile.write(compressor.compress(patch_data))
+                    patch_data.clear()
+
+            # start a new block
+            if block_start is None:
+                block_start = run_start
+                block_end = run_start - 1
+
+            # save the new data
+            block_end = max(block_end, run_end - 1)
+
+        # if there was any leftover blocks, write them out
+        if block_start is not None:
+            xor_address = write_block(keys, xor_address, xor_range, block_start, rom.buffer[block_start:block_end+1], patch_data)
+
+        # compress the rest of the patch file
+        outfile.write(compressor.compress(patch_data))
+        outfile.write(compressor.flush())
+
+
+# Reads the decompressed data of a patch file from a stream, as it is needed.
+class PatchReader:
+    CHUNK_SIZE: int = 0x10000
+
+    def __init__(self, stream: BinaryIO) -> None:
+        self.stream: BinaryIO = stream
+        self.decompressor = zlib.decompressobj()
+        self.buffer: bytearray = bytearray()
+        self.position: int = 0
+
+    # decompress more data, returns False at the end of the patch
+    def fill(self) -> bool:
+        if self.decompressor.eof:
+            return False
+        data = self.decompressor.unconsumed_tail or self.stream.read(self.CHUNK_SIZE)
+        if not data:
+            raise Exception("Patch file is truncated.")
+        del self.buffer[:self.position]
+        self.position = 0
+        self.buffer += self.decompressor.decompress(data, self.CHUNK_SIZE * 4)
+        return True
+
+    def eof(self) -> bool:
+        while self.position == len(self.buffer):
+            if not self.fill():
+                return True
+        return False
+
+    def read_bytes(self, length: int) -> bytes:
+        while len(self.buffer) - self.position < length:
+            if not self.fill():
+                raise Exception("Patch file is truncated.")
+        data = bytes(memoryview(self.buffer)[self.position:self.position + length])
+        self.position += length
+        return data
+
+    def unpack(self, struct_format: struct.Struct) -> tuple[Any, ...]:
+        return struct_format.unpack(self.read_bytes(struct_format.size))
+
+
+# The nonzero bytes of the XOR key range, in the order the keys are used.
+class XorKeys:
+    def __init__(self, rom: Rom, xor_range: tuple[int, int], xor_address: int) -> None:
+        keys = rom.original.read_bytes(xor_range[0], xor_range[1] - xor_range[0] + 1)
+        self.keys: bytes = bytes(keys).replace(b'\x00', b'')
+        # index of the next key, the first nonzero one after xor_address
+        offset = xor_address - xor_range[0] + 1
+        self.index: int = (offset - keys.count(0, 0, offset)) % len(self.keys)
+
+    def skip(self, count: int) -> None:
+        self.index = (self.index + count) % len(self.keys)
+
+    def take(self, count: int) -> bytes:
+        keys = self.keys[self.index:self.index + count]
+        while len(keys) < count:
+            keys += self.keys[:count - len(keys)]
+        self.skip(count)
+        return keys
+
+    # XOR every nonzero byte of data with the next key. 0s are kept as 0s.
+    def xor(self, data: bytes) -> bytes:
+        keys = self.take(len(data) - data.count(0))
+        parts = []
+        key_index = 0
+        for part in data.split(b'\x00'):
+            size = len(part)
+            if size:
+                value = int.from_bytes(part, 'big') ^ int.from_bytes(keys[key_index:key_index + size], 'big')
+                part = value.to_bytes(size, 'big')
+                key_index += size
+            parts.append(part)
+        return b'\x00'.join(parts)
+
+
+HEADER_FORMAT = struct.Struct('>5sIIII')
+DMA_INDEX_FORMAT = struct.Struct('>H')
+DMA_UPDATE_FORMAT = struct.Struct('>II3s')
+BLOCK_FORMAT = struct.Struct('>IH')
+BLOCK_CONTINUE_FORMAT = struct.Struct('>BH')
 
 
 # This will apply a patch file to a source rom to generate a patched rom.
 def apply_patch_file(rom: Rom, settings: Settings, sub_file: Optional[str] = None) -> None:
-    file = settings.patch_file
-
-    # load the patch file and decompress
     if sub_file:
-        with zipfile.ZipFile(file, 'r') as patch_archive:
-            try:
-                with patch_archive.open(sub_file, 'r') as stream:
-                    patch_data = stream.read()
-            except KeyError as ex:
-                raise FileNotFoundError('Patch file missing from archive. Invalid Player ID.')
+        apply_patch_archive(rom, settings.patch_file, sub_file, settings.repatch_cosmetics)
     else:
-        with open(file, 'rb') as stream:
-            patch_data = stream.read()
-    patch_data = BigStream(bytearray(zlib.decompress(patch_data)))
+        with open(settings.patch_file, 'rb') as stream:
+            apply_patch_stream(rom, stream, settings.repatch_cosmetics)
+
+
+# Applies one player's patch straight from a multiworld patch archive (.zpfz),
+# which can be a path or a file object.
+def apply_patch_archive(rom: Rom, archive: str | BinaryIO, sub_file: str, restrictive: bool = False) -> None:
+    with zipfile.ZipFile(archive, 'r') as patch_archive:
+        try:
+            stream = patch_archive.open(sub_file, 'r')
+        except KeyError:
+            raise FileNotFoundError('Patch file missing from archive. Invalid Player ID.')
+        with stream:
+            apply_patch_stream(rom, stream, restrictive)
+
+
+# Applies a patch file read from a stream. With restrictive, the restrictive bytes
+# of the rom (the player models) are not changed.
+def apply_patch_stream(rom: Rom, stream: BinaryIO, restrictive: bool = False) -> None:
+    patch_data = PatchReader(stream)
 
     # make sure the header is correct
-    if patch_data.read_bytes(length=4) != b'ZPFv':
+    magic, dma_start, xor_range_start, xor_range_end, xor_address = patch_data.unpack(HEADER_FORMAT)
+    if magic[:4] != b'ZPFv':
         raise Exception("File is not in a Zelda Patch Format")
-    if patch_data.read_byte() != ord('1'):
+    if magic[4] != ord('1'):
         # in the future we might want to have revisions for this format
         raise Exception("Unsupported patch version.")
 
     # load the patch configuration info. The fact that the DMA Table is
     # included in the patch is so that this might be able to work with
     # other N64 games.
-    dma_start = patch_data.read_int32()
-    xor_range = (patch_data.read_int32(), patch_data.read_int32())
-    xor_address = patch_data.read_int32()
+    xor_range = (xor_range_start, xor_range_end)
 
     # Load all the DMA table updates. This will move the files around.
     # A key thing is that some of these entries will list a source file
@@ -217,63 +312,47 @@ def apply_patch_file(rom: Rom, settings: Settings, sub_file: Optional[str] = Non
     # is copied. This list is terminated with 0xFFFF
     while True:
         # Load DMA update
-        dma_index = patch_data.read_int16()
+        dma_index, = patch_data.unpack(DMA_INDEX_FORMAT)
         if dma_index == 0xFFFF:
             break
 
-        from_file = patch_data.read_int32()
-        start = patch_data.read_int32()
-        size = patch_data.read_int24()
+        from_file, start, size = patch_data.unpack(DMA_UPDATE_FORMAT)
+        size = int.from_bytes(size, 'big')
 
         # Save new DMA Table entry
         dma_entry = dma_start + (dma_index * 0x10)
         end = start + size
-        rom.write_int32(dma_entry, start)
-        rom.write_int32(None,      end)
-        rom.write_int32(None,      start)
-        rom.write_int32(None,      0)
+        rom.write_int32s(dma_entry, [start, end, start, 0])
 
         if from_file != 0xFFFFFFFF:
             # If a source file is listed, copy from there
             old_dma_start, old_dma_end, old_size = rom.original.dma.get_dmadata_record_by_key(from_file).as_tuple()
             copy_size = min(size, old_size)
             rom.write_bytes(start, rom.original.read_bytes(from_file, copy_size))
-            rom.buffer[start+copy_size:start+size] = [0] * (size - copy_size)
+            rom.buffer[start+copy_size:start+size] = bytes(size - copy_size)
         else:
             # if it's a new file, fill with 0s
-            rom.buffer[start:start+size] = [0] * size
+            rom.buffer[start:start+size] = bytes(size)
 
     # Read in the XOR data blocks. This goes to the end of the file.
+    keys = XorKeys(rom, xor_range, xor_address)
     block_start = 0
     while not patch_data.eof():
-        is_new_block = patch_data.read_byte() != 0xFF
-
-        if is_new_block:
+        marker = patch_data.read_bytes(1)
+        if marker[0] != 0xFF:
             # start writing a new block
-            patch_data.seek_address(delta=-1)
-            block_start = patch_data.read_int32()
-            block_size = patch_data.read_int16()
+            block_start, block_size = BLOCK_FORMAT.unpack(marker + patch_data.read_bytes(BLOCK_FORMAT.size - 1))
         else:
-            # continue writing from previous block
-            key_skip = patch_data.read_byte()
-            block_size = patch_data.read_int16()
-            # skip specified XOR keys
-            for _ in range(key_skip):
-                key, xor_address = key_next(rom, xor_address, xor_range)
-
-        # read in the new data
-        data = []
-        for b in patch_data.read_bytes(length=block_size):
-            if b == 0:
-                # keep 0s as 0s
-                data += [0]
-            else:
-                # The XOR will always be safe and will never produce 0
-                key, xor_address = key_next(rom, xor_address, xor_range)
-                data += [b ^ key]
+            # continue writing from previous block, skipping the specified XOR keys
+            key_skip, block_size = patch_data.unpack(BLOCK_CONTINUE_FORMAT)
+            keys.skip(key_skip)
+
+        # read in the new data.
+        # The XOR will always be safe and will never produce 0
+        data = keys.xor(patch_data.read_bytes(block_size))
 
         # Save the new data to rom
-        if settings.repatch_cosmetics:
+        if restrictive:
             rom.write_bytes_restrictive(block_start, block_size, data)
         else:
             rom.write_bytes(block_start, data)
@@ -11,7 +11,7 @@ import time
 
 
 def start() -> None:
-    from Main import main, from_patch_file, cosmetic_patch, diff_roms
+    from Main import main, main_batch, from_patch_file, cosmetic_patch, diff_roms
     from Settings import get_settings_from_command_line_args
     from Utils import check_version, VersionError, local_path
     settings, gui, args_loglevel, no_log_file, diff_rom = get_settings_from_command_line_args()
@@ -49,10 +49,7 @@ def start() -> None:
         elif settings.patch_file != '':
             from_patch_file(settings)
         elif settings.count is not None and settings.count > 1:
-            orig_seed = settings.seed
-            for i in range(settings.count):
-                settings.update_seed(orig_seed + '-' + str(i))
-                main(settings)
+            main_batch(settings, workers=settings.batch_workers)
         else:
             main(settings)
     except Exception as ex:
@@ -6,7 +6,7 @@ import re
 import random
 from collections import defaultdict
 from collections.abc import Callable, Iterable, Sequence
-from functools import reduce
+from functools import partial, reduce
 from typing import TYPE_CHECKING, Any, Optional
 from Boulders import BOULDER_TYPE
 
@@ -1268,7 +1268,7 @@ class Distribution:
 
         # normalize starting items to use the dictionary format
         starting_items = itertools.chain(self.settings.starting_equipment, self.settings.starting_songs, self.settings.starting_inventory)
-        data: dict[str, StarterRecord | dict[str, StarterRecord]] = defaultdict(lambda: StarterRecord(0))
+        data: dict[str, StarterRecord | dict[str, StarterRecord]] = defaultdict(partial(StarterRecord, 0))
         if isinstance(self.settings.starting_items, dict) and self.settings.starting_items:
             world_names = ['World %d' % (i + 1) for i in range(len(self.world_dists))]
             for name, record in self.settings.starting_items.items():
@@ -1,16 +1,22 @@
 from __future__ import annotations
+import bisect
 import copy
+import heapq
 import json
+import logging
+import mmap
 import os
 import platform
+import re
 import subprocess
-from collections.abc import Iterator, Sequence
-from typing import Optional
+from collections.abc import Iterable, Iterator, Sequence
+from typing import Optional, Any
 
 from Models import restrictiveBytes
 from Utils import is_bundled, subprocess_args, local_path, data_path, get_version_bytes
 from crc import calculate_crc
 from ntype import BigStream
+from Yaz0 import decompress_rom_data
 from version import base_version, branch_identifier, supplementary_version
 
 DMADATA_START: int = 0x7430  # NTSC 1.0/1.1: 0x7430, NTSC 1.2: 0x7960, Debug: 0x012F70
@@ -24,22 +30,244 @@ PAUSE_PLAYER_OVERLAY_TABLE_OFFSET: int = 4
 NUM_OVERLAY_ENTRIES: int = 0x1D7
 NUM_PAUSE_PLAYER_OVERLAY_ENTRIES: int = 2
 
+ROM_PAGE_SHIFT: int = 12
+ROM_PAGE_SIZE: int = 1 << ROM_PAGE_SHIFT
+ROM_PAGE_MASK: int = ROM_PAGE_SIZE - 1
+
+
+# A rom sized buffer on top of read-only data, usually the memory-mapped decompressed rom.
+# Written pages are copied into a dict of dirty pages, so copies of the buffer only copy those,
+# and comparing two buffers over the same data only has to look at their dirty pages.
+# It supports the bytearray operations done on Rom.buffer.
+class RomBuffer:
+    def __init__(self, base: bytes | mmap.mmap, size: Optional[int] = None) -> None:
+        self.base: bytes | mmap.mmap = base
+        self.base_size: int = len(base)
+        # anything past the end of the base data reads as 0
+        self.size: int = self.base_size if size is None else size
+        self.pages: dict[int, bytearray] = {}
+
+    @staticmethod
+    def map_file(path: str) -> RomBuffer:
+        with open(path, 'rb') as stream:
+            try:
+                return RomBuffer(mmap.mmap(stream.fileno(), 0, access=mmap.ACCESS_READ))
+            except (ValueError, OSError):
+                # empty files and file systems that can't be mapped
+                return RomBuffer(stream.read())
+
+    def __len__(self) -> int:
+        return self.size
+
+    def __copy__(self) -> RomBuffer:
+        new_buffer = RomBuffer(self.base, self.size)
+        new_buffer.base_size = self.base_size
+        new_buffer.pages = {index: page[:] for index, page in self.pages.items()}
+        return new_buffer
+
+    def __bytes__(self) -> bytes:
+        return bytes(self.read(0, self.size))
+
+    def __iter__(self) -> Iterator[int]:
+        for start in range(0, self.size, ROM_PAGE_SIZE):
+            yield from self.read(start, min(start + ROM_PAGE_SIZE, self.size))
+
+    def __getitem__(self, key: int | slice) -> int | bytearray:
+        if isinstance(key, slice):
+            start, stop, step = key.start, key.stop, key.step
+            if step is None and start is not None and stop is not None and 0 <= start <= stop <= self.size:
+                # bytes within a single page are most of the reads
+                if start >> ROM_PAGE_SHIFT == (stop - 1) >> ROM_PAGE_SHIFT:
+                    page = self.pages.get(start >> ROM_PAGE_SHIFT)
+                    if page is not None:
+                        return page[start & ROM_PAGE_MASK:(start & ROM_PAGE_MASK) + stop - start]
+                    if stop <= self.base_size:
+                        return bytearray(self.base[start:stop])
+                return self.read(start, stop)
+            start, stop, step = key.indices(self.size)
+            if step == 1:
+                return self.read(start, stop)
+            return self.read(0, self.size)[key]
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError('RomBuffer index out of range')
+        page = self.pages.get(key >> ROM_PAGE_SHIFT)
+        if page is not None:
+            return page[key & ROM_PAGE_MASK]
+        return self.base[key] if key < self.base_size else 0
+
+    def __setitem__(self, key: int | slice, value: Any) -> None:
+        if isinstance(key, slice):
+            start, stop, step = key.indices(self.size)
+            value = bytearray(value)
+            if step != 1 or len(value) != max(stop - start, 0):
+                raise ValueError('RomBuffer slices can only be replaced by data of the same length')
+            self.write(start, value)
+            return
+        if key < 0:
+            key += self.size
+        if not 0 <= key < self.size:
+            raise IndexError('RomBuffer index out of range')
+        self.page(key >> ROM_PAGE_SHIFT)[key & ROM_PAGE_MASK] = value
+
+    def page(self, index: int) -> bytearray:
+        page = self.pages.get(index)
+        if page is None:
+            start = index << ROM_PAGE_SHIFT
+            page = bytearray(self.base[start:min(start + ROM_PAGE_SIZE, self.base_size)])
+            page.extend(bytes(ROM_PAGE_SIZE - len(page)))
+            self.pages[index] = page
+        return page
+
+    def read(self, start: int, stop: int) -> bytearray:
+        if stop <= start:
+            return bytearray()
+        data = bytearray(self.base[start:min(stop, self.base_size)])
+        if len(data) < stop - start:
+            data.extend(bytes(stop - start - len(data)))
+        first, last = start >> ROM_PAGE_SHIFT, (stop - 1) >> ROM_PAGE_SHIFT
+        if last - first < len(self.pages):
+            indexes = [index for index in range(first, last + 1) if index in self.pages]
+        else:
+            indexes = [index for index in self.pages if first <= index <= last]
+        for index in indexes:
+            page_start = index << ROM_PAGE_SHIFT
+            low, high = max(start, page_start), min(stop, page_start + ROM_PAGE_SIZE)
+            data[low - start:high - start] = self.pages[index][low - page_start:high - page_start]
+        return data
+
+    def write(self, start: int, data: bytearray) -> None:
+        offset = 0
+        while offset < len(data):
+            address = start + offset
+            page_offset = address & ROM_PAGE_MASK
+            length = min(ROM_PAGE_SIZE - page_offset, len(data) - offset)
+            self.page(address >> ROM_PAGE_SHIFT)[page_offset:page_offset + length] = data[offset:offset + length]
+            offset += length
+
+    def append(self, value: int) -> None:
+        self.extend((value,))
+
+    def extend(self, values: Sequence[int]) -> None:
+        start = self.size
+        self.resize(self.size + len(values))
+        self.write(start, bytearray(values))
+
+    # Grow or shrink the buffer, any new space reads as 0
+    def resize(self, size: int) -> None:
+        if size < self.size:
+            for index in [index for index in self.pages if index << ROM_PAGE_SHIFT >= size]:
+                del self.pages[index]
+            if size & ROM_PAGE_MASK and (size >> ROM_PAGE_SHIFT) in self.pages:
+                page = self.pages[size >> ROM_PAGE_SHIFT]
+                page[size & ROM_PAGE_MASK:] = bytes(ROM_PAGE_SIZE - (size & ROM_PAGE_MASK))
+            self.base_size = min(self.base_size, size)
+        self.size = size
+
+    # Start addresses of the pages that can differ between the two buffers
+    def changed_pages(self, other: RomBuffer | bytearray) -> Iterator[int]:
+        size = max(self.size, len(other))
+        if isinstance(other, RomBuffer) and other.base is self.base and other.base_size == self.base_size:
+            indexes = set(self.pages) | set(other.pages)
+            if self.size != other.size:
+                indexes.update(range(min(self.size, other.size) >> ROM_PAGE_SHIFT, ((size - 1) >> ROM_PAGE_SHIFT) + 1))
+            for index in sorted(indexes):
+                yield index << ROM_PAGE_SHIFT
+        else:
+            yield from range(0, size, ROM_PAGE_SIZE)
+
+
+# Sorted, disjoint and non-adjacent [start, end) ranges of addresses. New ranges go to a pending
+# list first, extending the last one when they touch it since most writes follow the previous one,
+# and are merged in once that list grows as long as the merged one.
+class AddressRanges:
+    def __init__(self, ranges: Optional[Iterable[tuple[int, int]]] = None) -> None:
+        self.ranges: list[tuple[int, int]] = []
+        self.pending: list[list[int]] = []
+        if ranges is not None:
+            for start, end in ranges:
+                self.add(start, end)
+
+    def add(self, start: int, end: int) -> None:
+        if end <= start:
+            return
+        if self.pending:
+            last = self.pending[-1]
+            if last[0] <= start <= last[1]:
+                if end > last[1]:
+                    last[1] = end
+                return
+        self.pending.append([start, end])
+        if len(self.pending) >= max(len(self.ranges), 1024):
+            self.merge()
+
+    def merge(self) -> None:
+        if not self.pending:
+            return
+        pending = sorted(map(tuple, self.pending))
+        merged = []
+        for start, end in heapq.merge(self.ranges, pending):
+            if merged and start <= merged[-1][1]:
+                if end > merged[-1][1]:
+                    merged[-1] = (merged[-1][0], end)
+            else:
+                merged.append((start, end))
+        self.ranges = merged
+        self.pending = []
+
+    def copy(self) -> AddressRanges:
+        self.merge()
+        new_ranges = AddressRanges()
+        new_ranges.ranges = self.ranges[:]
+        return new_ranges
+
+    def __iter__(self) -> Iterator[tuple[int, int]]:
+        self.merge()
+        return iter(self.ranges)
+
+    def __len__(self) -> int:
+        self.merge()
+        return len(self.ranges)
+
+    def __contains__(self, address: int) -> bool:
+        self.merge()
+        index = bisect.bisect_right(self.ranges, (address, float('inf'))) - 1
+        return index >= 0 and address < self.ranges[index][1]
+
+    def addresses(self) -> Iterator[int]:
+        for start, end in self:
+            yield from range(start, end)
+
+
+# symbols.json and patch_symbols.json, read once per process and shared by every Rom
+rom_symbols: Optional[dict[str, dict[str, int]]] = None
+rom_patch_symbols: Optional[dict[str, int]] = None
+
+
+def load_symbols() -> tuple[dict[str, dict[str, int]], dict[str, int]]:
+    global rom_symbols, rom_patch_symbols
+    if rom_symbols is None:
+        with open(data_path('generated/symbols.json'), 'r') as stream:
+            symbols = json.load(stream)
+            rom_symbols = {name: {'address': int(sym['address'], 16), 'length': sym['length']} for name, sym in symbols.items()}
+
+        with open(data_path('generated/patch_symbols.json'), 'r') as stream:
+            rom_patch_symbols = json.load(stream)
+    return rom_symbols, rom_patch_symbols
+
+
 class Rom(BigStream):
     def __init__(self, file: Optional[str] = None) -> None:
         super().__init__(bytearray())
 
         self.original: Rom = self
-        self.changed_address: dict[int, int] = {}
+        self.changed_ranges: AddressRanges = AddressRanges()
         self.changed_dma: dict[int, tuple[int, int, int]] = {}
         self.force_patch: list[int] = []
         self.dma: DMAIterator = DMAIterator(self, DMADATA_START)
 
-        with open(data_path('generated/symbols.json'), 'r') as stream:
-            symbols = json.load(stream)
-            self.symbols: dict[str, int] = {name: {'address': int(sym['address'], 16), 'length': sym['length']} for name, sym in symbols.items()}
-
-        with open(data_path('generated/patch_symbols.json'), 'r') as stream:
-            self.patch_symbols = json.load(stream)
+        self.symbols, self.patch_symbols = load_symbols()
 
         if file is None:
             return
@@ -51,19 +279,19 @@ class Rom(BigStream):
         if os.path.isfile(decompressed_file):
             # Try to read from previously decompressed rom if one exists.
             try:
-                self.read_rom(decompressed_file)
+                self.read_rom(decompressed_file, map_file=True)
             except (FileNotFoundError, RuntimeError):
                 # Decompress the provided file.
                 if not file:
                     raise FileNotFoundError('Must specify path to base ROM')
-                self.read_rom(file, decompressed_file)
+                self.read_rom(file, decompressed_file, map_file=True)
         elif file:
-            self.read_rom(file, decompressed_file)
+            self.read_rom(file, decompressed_file, map_file=True)
         else:
             raise FileNotFoundError('Must specify path to base ROM')
 
         # Add file to maximum size
-        self.buffer.extend(bytearray([0x00] * (0x4000000 - len(self.buffer))))
+        self.buffer.resize(max(len(self.buffer), 0x4000000))
         self.original = self.copy()
         self.overlay_table = OverlayTable.read_overlay_table(self, OVERLAY_TABLE_START, OVERLAY_TABLE_OFFSET, OVERLAY_TABLE_ENTRY_SIZE, NUM_OVERLAY_ENTRIES) + OverlayTable.read_overlay_table(self, PAUSE_PLAYER_OVERLAY_TABLE_START, PAUSE_PLAYER_OVERLAY_TABLE_OFFSET, PAUSE_PLAYER_OVERLAY_TABLE_ENTRY_SIZE, NUM_PAUSE_PLAYER_OVERLAY_ENTRIES)
         # Add version number to header.
@@ -72,15 +300,19 @@ class Rom(BigStream):
     def copy(self) -> Rom:
         new_rom: Rom = Rom()
         new_rom.buffer = copy.copy(self.buffer)
-        new_rom.changed_address = copy.copy(self.changed_address)
+        new_rom.changed_ranges = self.changed_ranges.copy()
         new_rom.changed_dma = copy.copy(self.changed_dma)
         new_rom.force_patch = copy.copy(self.force_patch)
         return new_rom
 
-    def read_rom(self, input_file: str, output_file: Optional[str] = None, verify_crc: bool = True) -> None:
+    # map_file memory-maps the file instead of reading it, for files that are kept around like ZOOTDEC.z64
+    def read_rom(self, input_file: str, output_file: Optional[str] = None, verify_crc: bool = True, map_file: bool = False) -> None:
         try:
-            with open(input_file, 'rb') as stream:
-                self.buffer = bytearray(stream.read())
+            if map_file:
+                self.buffer = RomBuffer.map_file(input_file)
+            else:
+                with open(input_file, 'rb') as stream:
+                    self.buffer = RomBuffer(stream.read())
         except FileNotFoundError as ex:
             raise FileNotFoundError(f'Invalid path to Base ROM: "{input_file}"')
 
@@ -105,14 +337,26 @@ class Rom(BigStream):
         elif len(self.buffer) == 0x2000000:
             # If Input ROM is compressed, then Decompress it
             if output_file:
-                self.decompress_rom(input_file, output_file, verify_crc)
+                self.decompress_rom(input_file, output_file, verify_crc, map_file)
             else:
                 raise RuntimeError('ROM was unable to be decompressed. Please supply an already decompressed ROM.')
         else:
             # ROM file is a valid and already uncompressed
             pass
 
-    def decompress_rom(self, input_file: str, output_file: str, verify_crc: bool = True) -> None:
+    def decompress_rom(self, input_file: str, output_file: str, verify_crc: bool = True, map_file: bool = False) -> None:
+        try:
+            with open(input_file, 'rb') as f:
+                data = decompress_rom_data(f.read())
+            with open(output_file, 'wb') as f:
+                f.write(data)
+        except Exception as ex:
+            # The decompressor binaries remain as a fallback
+            logging.getLogger('').warning('In process ROM decompression failed, using the decompressor binary instead: %s', ex)
+            self.decompress_rom_binary(input_file, output_file)
+        self.read_rom(output_file, verify_crc=verify_crc, map_file=map_file)
+
+    def decompress_rom_binary(self, input_file: str, output_file: str) -> None:
         sub_dir = "./" if is_bundled() else "bin/Decompress/"
 
         if platform.system() == 'Windows':
@@ -138,27 +382,28 @@ class Rom(BigStream):
             raise RuntimeError('Unsupported operating system for decompression. Please supply an already decompressed ROM.')
 
         subprocess.check_call(subcall, **subprocess_args())
-        self.read_rom(output_file, verify_crc=verify_crc)
 
     def write_byte(self, address: int, value: int) -> None:
         super().write_byte(address, value)
-        self.changed_address[self.last_address-1] = value
+        self.changed_ranges.add(self.last_address - 1, self.last_address)
 
     def write_bytes_restrictive(self, start: int, size: int, values: Sequence[int]) -> None:
-        for i in range(size):
-            address = start + i
-            should_write = True
-            for restrictiveBlock in restrictiveBytes:
-                # If i is between the start of restrictive zone [0] and start + size [1]
-                if restrictiveBlock[0] <= address < restrictiveBlock[0] + restrictiveBlock[1]:
-                    should_write = False
-                    break
-            if should_write:
-                self.write_byte(address, values[i])
+        # Write the parts of the range outside of every restrictive zone
+        end = start + size
+        address = start
+        for restrictive_start, restrictive_size in sorted(restrictiveBytes):
+            restrictive_end = restrictive_start + restrictive_size
+            if restrictive_end <= address or restrictive_start >= end:
+                continue
+            if restrictive_start > address:
+                self.write_bytes(address, values[address - start:restrictive_start - start])
+            address = restrictive_end
+        if address < end:
+            self.write_bytes(address, values[address - start:size])
 
     def write_bytes(self, address: int, values: Sequence[int]) -> None:
         super().write_bytes(address, values)
-        self.changed_address.update(zip(range(address, address + len(values)), values))
+        self.changed_ranges.add(self.last_address - len(values), self.last_address)
 
     def revert_patch(self, patch_name: str) -> None:
         # Get the _START and _END symbols
@@ -169,7 +414,7 @@ class Rom(BigStream):
 
     def restore(self) -> None:
         self.buffer = copy.copy(self.original.buffer)
-        self.changed_address = {}
+        self.changed_ranges = AddressRanges()
         self.changed_dma = {}
         self.force_patch = []
         self.last_address = 0
@@ -185,7 +430,7 @@ class Rom(BigStream):
         self.verify_dmadata()
         self.update_header()
         with open(file, 'wb') as outfile:
-            outfile.write(self.buffer)
+            outfile.write(bytes(self.buffer))
 
     def update_header(self) -> None:
         crc = calculate_crc(self)
@@ -264,20 +509,51 @@ class Rom(BigStream):
                     from_file = old_dma_start
                 self.changed_dma[dma_entry.index] = (from_file, dma_start, dma_end - dma_start)
 
-    # This will rescan the entire ROM, compare to original ROM, and repopulate changed_address.
+    # This will rescan the ROM, compare to original ROM, and repopulate changed_ranges.
+    # Only the pages that may differ from the original are compared.
     def rescan_changed_bytes(self) -> None:
-        self.changed_address = {}
+        self.changed_ranges = AddressRanges()
         size = len(self.buffer)
         original_size = len(self.original.buffer)
-        for i, byte in enumerate(self.buffer):
-            if i >= original_size:
-                self.changed_address[i] = byte
+        if isinstance(self.buffer, RomBuffer):
+            pages = self.buffer.changed_pages(self.original.buffer)
+        else:
+            pages = range(0, size, ROM_PAGE_SIZE)
+        for start in pages:
+            if start >= size:
+                break
+            page = self.buffer[start:start + ROM_PAGE_SIZE]
+            original_page = self.original.buffer[start:start + ROM_PAGE_SIZE]
+            if page == original_page:
                 continue
-            orig_byte = self.original.read_byte(i)
-            if byte != orig_byte:
-                self.changed_address[i] = byte
+            for run_start, run_end in changed_runs(page, original_page):
+                self.changed_ranges.add(start + run_start, start + run_end)
         if size < original_size:
-            self.changed_address.update(zip(range(size, original_size-1), [0]*(original_size-size)))
+            self.changed_ranges.add(size, original_size - 1)
+
+
+# (start, end) runs of the bytes of data that differ from original, or that are past its end.
+def changed_runs(data: Sequence[int], original: Sequence[int]) -> Iterator[tuple[int, int]]:
+    size = min(len(data), len(original))
+    # xor both as one integer, the changed bytes are the nonzero bytes of the difference
+    difference = (int.from_bytes(data[:size], 'big') ^ int.from_bytes(original[:size], 'big')).to_bytes(size, 'big')
+    run_start = run_end = None
+    for match in nonzero_bytes.finditer(difference):
+        if run_start is not None:
+            yield run_start, run_end
+        run_start, run_end = match.span()
+    if len(data) > size:
+        if run_end != size:
+            if run_start is not None:
+                yield run_start, run_end
+            run_start = size
+        run_end = len(data)
+    if run_start is not None:
+        yield run_start, run_end
+
+
+nonzero_bytes: re.Pattern[bytes] = re.compile(rb'[^\x00]+')
+
 
 class DMAEntry:
     def __init__(self, rom: Rom, index: int) -> None:
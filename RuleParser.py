@@ -1,14 +1,21 @@
 from __future__ import annotations
 import ast
+import copy
 import logging
 import re
 from collections import defaultdict
+from dataclasses import dataclass, field
+from itertools import chain
+from operator import attrgetter, ge
 from typing import TYPE_CHECKING, Optional, Any
+from weakref import WeakKeyDictionary
 
 from Entrance import Entrance
 from Item import ItemInfo, Item, make_event_item
+from LogicCache import CachedRule, LogicFile, compiled_rule_code
 from Location import Location
 from Region import TimeOfDay
+from RuleProfiler import profile_rule
 from RulesCommon import AccessRule, allowed_globals, escape_name
 from State import State
 from Utils import data_path, read_logic_file
@@ -39,6 +46,76 @@ allowed_globals.update(special_globals)
 rule_aliases: dict[str, tuple[list[re.Pattern[str]], str]] = {}
 nonaliases: set[str] = set()
 
+# State methods whose result only depends on the solver ids passed to them plus the ones listed here.
+# Calling any other State method (or the search) makes a rule dynamic.
+pure_state_methods: dict[str, frozenset[int]] = {
+    'has': frozenset(),
+    'has_any_of': frozenset(),
+    'has_all_of': frozenset(),
+    'count_distinct': frozenset(),
+    'item_count': frozenset(),
+    'has_bottle': frozenset((*ItemInfo.bottle_ids, ItemInfo.solver_ids['Rutos_Letter'])),
+    'has_hearts': frozenset((ItemInfo.solver_ids['Piece_of_Heart'],)),
+    'heart_count': frozenset((ItemInfo.solver_ids['Piece_of_Heart'],)),
+    'has_medallions': frozenset(ItemInfo.medallion_ids),
+    'has_stones': frozenset(ItemInfo.stone_ids),
+    'has_dungeon_rewards': frozenset((*ItemInfo.medallion_ids, *ItemInfo.stone_ids)),
+    'has_ocarina_buttons': frozenset(ItemInfo.ocarina_buttons_ids),
+    'has_all_notes_for_song': frozenset(ItemInfo.ocarina_buttons_ids),
+    'had_night_start': frozenset(),
+    'can_live_dmg': frozenset(),
+}
+
+
+# Shared by every spot using the same compiled rule, so never changed once recorded
+@dataclass(frozen=True)
+class RuleDependencies:
+    # solver ids of the items and events the rule reads
+    solver_ids: frozenset[int] = frozenset()
+    # whether the result can also change with anything else (search progress, the spot, time of day...)
+    dynamic: bool = False
+
+
+# Compiled access rules by backend and rule ast string
+shared_access_rules: dict[tuple[str, str], AccessRule] = {}
+
+# Filled by make_access_rule for every compiled rule. Weak so it doesn't keep rules alive by itself,
+# while copied worlds (which keep the original rule functions) can still look them up.
+compiled_rule_dependencies: WeakKeyDictionary[AccessRule, RuleDependencies] = WeakKeyDictionary()
+
+
+def get_rule_dependencies(rule: AccessRule) -> Optional[RuleDependencies]:
+    if getattr(rule, '__name__', None) == '_run_rules':
+        # Location.add_rule chains several rules together
+        solver_ids = set()
+        dynamic = False
+        for subrule in rule.__self__.access_rules:
+            subrule_dependencies = get_rule_dependencies(subrule)
+            if subrule_dependencies is None:
+                return None
+            solver_ids.update(subrule_dependencies.solver_ids)
+            dynamic |= subrule_dependencies.dynamic
+        return RuleDependencies(solver_ids=frozenset(solver_ids), dynamic=dynamic)
+    if rule is getattr(State, getattr(rule, '__name__', ''), None):
+        # State methods used directly as rules, eg. State.has_bottle
+        solver_ids = pure_state_methods.get(rule.__name__, None)
+        return RuleDependencies(solver_ids=frozenset(), dynamic=True) if solver_ids is None else RuleDependencies(solver_ids=solver_ids)
+    try:
+        return compiled_rule_dependencies.get(rule, None)
+    except TypeError:
+        # not weak referenceable, so not one of ours
+        return None
+
+
+# Returns the solver ids an access rule reads from the state it is evaluated with,
+# or None if its result may also depend on something else.
+# Such a rule can only change its result for a given age when one of these items is collected or removed.
+def rule_dependencies(rule: AccessRule) -> Optional[frozenset[int]]:
+    dependencies = get_rule_dependencies(rule)
+    if dependencies is None or dependencies.dynamic:
+        return None
+    return dependencies.solver_ids
+
 
 def load_aliases() -> None:
     j = read_logic_file(data_path('LogicHelpers.json'))
@@ -58,6 +135,51 @@ def isliteral(expr: ast.expr) -> bool:
     return isinstance(expr, ast.Constant)
 
 
+# Alternative to compiling a whole rule into one lambda (logic_rule_backend == 'tree'):
+# item checks become AND/OR nodes of minimum item counts, evaluated directly on State.solv_items,
+# and only what's left (search lookups, State helpers, ...) is compiled to Python.
+@dataclass
+class RuleTree:
+    # 'and', 'or' or 'const'
+    op: str
+    # solver id -> minimum count
+    thresholds: dict[int, int] = field(default_factory=dict)
+    # subtrees and compiled residual rules, checked in order after the thresholds
+    children: list[RuleTree | AccessRule] = field(default_factory=list)
+    value: bool = False
+
+    def add_threshold(self, solver_id: int, count: int) -> None:
+        if solver_id in self.thresholds:
+            # Both are required for AND, either is enough for OR
+            count = max(count, self.thresholds[solver_id]) if self.op == 'and' else min(count, self.thresholds[solver_id])
+        self.thresholds[solver_id] = count
+
+    def compile(self) -> AccessRule:
+        if self.op == 'const':
+            value = self.value
+            return lambda state, **kwargs: value
+
+        children = tuple(child.compile() if isinstance(child, RuleTree) else child for child in self.children)
+        if not self.thresholds and len(children) == 1:
+            return children[0]
+        if len(self.thresholds) == 1 and not children:
+            [(solver_id, count)] = self.thresholds.items()
+            return lambda state, **kwargs: state.solv_items[solver_id] >= count
+
+        solver_ids = tuple(self.thresholds.keys())
+        counts = tuple(self.thresholds.values())
+        combine = all if self.op == 'and' else any
+        if all(count == 1 for count in counts):
+            check = lambda items: combine(map(items.__getitem__, solver_ids))
+        else:
+            check = lambda items: combine(map(ge, map(items.__getitem__, solver_ids), counts))
+        if not children:
+            return lambda state, **kwargs: check(state.solv_items)
+        if self.op == 'and':
+            return lambda state, **kwargs: check(state.solv_items) and all(child(state, **kwargs) for child in children)
+        return lambda state, **kwargs: check(state.solv_items) or any(child(state, **kwargs) for child in children)
+
+
 class Rule_AST_Transformer(ast.NodeTransformer):
     def __init__(self, world: World) -> None:
         self.world: World = world
@@ -72,6 +194,24 @@ class Rule_AST_Transformer(ast.NodeTransformer):
             load_aliases()
         # final rule cache
         self.rule_cache: dict[str, AccessRule] = {}
+        # compiled leftovers of the tree backend
+        self.residual_rule_cache: dict[str, AccessRule] = {}
+        # LogicHelpers.json entries expanded while parsing the current rule
+        self.current_helpers: set[str] = set()
+        # map spot -> LogicHelpers.json entries expanded while parsing its rule
+        self.spot_helpers: dict[Location | Entrance, frozenset[str]] = {}
+        # map solver id or helper name -> spots whose access rules depend on it,
+        # built on first use and dropped whenever the rules of a spot change
+        self.dependents: Optional[dict[int | str, set[Location | Entrance]]] = None
+        # spots whose access rules also depend on something else than items and events
+        self.dynamic_spots: set[Location | Entrance] = set()
+        # logic file whose rules are being parsed, if cached
+        self.logic_file: Optional[LogicFile] = None
+        # what the transformation of the current rule depended on, for the logic cache:
+        # world attributes, settings and spot attributes read, possible events and subrules
+        self.current_reads: dict[tuple[str, str], str] = {}
+        self.current_events: list[tuple[str, bool]] = []
+        self.current_subrules: list[tuple[str, ast.AST, str]] = []
 
     def visit_Name(self, node: ast.Name) -> Any:
         if "REDEAD_GROTTO" in node.id:
@@ -83,6 +223,7 @@ class Rule_AST_Transformer(ast.NodeTransformer):
         if node.id in dir(self):
             return getattr(self, node.id)(node)
         elif node.id in rule_aliases:
+            self.current_helpers.add(node.id)
             args, repl = rule_aliases[node.id]
             if args:
                 raise Exception(f'Parse Error: expected {len(args):d} args for {node.id}, not 0',
@@ -97,18 +238,17 @@ class Rule_AST_Transformer(ast.NodeTransformer):
                 args=[node],
                 keywords=[])
         elif node.id in self.world.__dict__:
-            return ast.parse('%r' % self.world.__dict__[node.id], mode='eval').body
+            return ast.parse('%r' % self.read_value('world', node.id), mode='eval').body
         elif node.id in self.world.settings.settings_dict:
             # Settings are constant
-            return ast.parse('%r' % self.world.settings.settings_dict[node.id], mode='eval').body
+            return ast.parse('%r' % self.read_value('settings', node.id), mode='eval').body
         elif node.id in State.__dict__:
             return self.make_call(node, node.id, [], [])
         elif node.id in kwarg_defaults or node.id in special_globals:
             return node
         elif event_name.match(node.id):
-            self.events.add(node.id.replace('_', ' '))
             # Ensure the item info is updated properly
-            Item(node.id, event=True)
+            self.add_event(node.id, always=True)
             return ast.Call(
                 func=ast.Attribute(
                     value=ast.Name(id='state', ctx=ast.Load()),
@@ -121,9 +261,7 @@ class Rule_AST_Transformer(ast.NodeTransformer):
 
     def visit_Str(self, node: ast.Constant) -> Any:
         esc = escape_name(node.value)
-        if esc not in ItemInfo.solver_ids:
-            self.events.add(esc.replace('_', ' '))
-            Item(esc, event=True)
+        self.add_event(esc)
         return ast.Call(
             func=ast.Attribute(
                 value=ast.Name(id='state', ctx=ast.Load()),
@@ -155,10 +293,9 @@ class Rule_AST_Transformer(ast.NodeTransformer):
 
         if isinstance(count, ast.Name):
             # Must be a settings constant
-            count = ast.parse('%r' % self.world.settings.settings_dict[count.id], mode='eval').body
+            count = ast.parse('%r' % self.read_value('settings', count.id), mode='eval').body
 
-        if item.id not in ItemInfo.solver_ids:
-            self.events.add(item.id.replace('_', ' '))
+        self.add_event(item.id)
 
         return ast.Call(
             func=ast.Attribute(
@@ -175,6 +312,7 @@ class Rule_AST_Transformer(ast.NodeTransformer):
         if node.func.id in dir(self):
             return getattr(self, node.func.id)(node)
         elif node.func.id in rule_aliases:
+            self.current_helpers.add(node.func.id)
             args, repl = rule_aliases[node.func.id]
             if len(args) != len(node.args):
                 raise Exception(f'Parse Error: expected {len(args):d} args for {node.func.id}, not {len(node.args):d}',
@@ -336,6 +474,10 @@ class Rule_AST_Transformer(ast.NodeTransformer):
             return ast.Constant(not early_return)
 
         if items:
+            for item in items:
+                # Events are only created by their location later on,
+                # ensure the item info exists for the rule dependencies.
+                self.add_event(item)
             node.values = [ast.Call(
                 func=ast.Attribute(
                     value=ast.Name(id='state', ctx=ast.Load()),
@@ -370,6 +512,7 @@ class Rule_AST_Transformer(ast.NodeTransformer):
     def replace_subrule(self, target: str, node: ast.AST) -> ast.Call:
         rule = ast.dump(node, False)
         if rule in self.replaced_rules[target]:
+            self.current_subrules.append((target, node, self.replaced_rules[target][rule].args[0].id))
             return self.replaced_rules[target][rule]
 
         subrule_name = target + ' Subrule %d' % (1 + len(self.replaced_rules[target]))
@@ -388,6 +531,7 @@ class Rule_AST_Transformer(ast.NodeTransformer):
         # Cache the subrule for any others in this region
         # (and reserve the item name in the process)
         self.replaced_rules[target][rule] = item_rule
+        self.current_subrules.append((target, node, item_rule.args[0].id))
         return item_rule
 
     # Requires the target regions have been defined in the world.
@@ -398,8 +542,10 @@ class Rule_AST_Transformer(ast.NodeTransformer):
             event.world = self.world
 
             self.current_spot = event
+            self.current_helpers = set()
             # This could, in theory, create further subrules.
-            access_rule = self.make_access_rule(self.visit(node))
+            # Transforming modifies the node, which the logic cache may share with other worlds.
+            access_rule = self.make_access_rule(self.visit(copy.deepcopy(node)))
             if access_rule is self.rule_cache.get('NameConstant(False)') or access_rule is self.rule_cache.get('Constant(False)'):
                 event.access_rule = None
                 event.never = True
@@ -407,22 +553,80 @@ class Rule_AST_Transformer(ast.NodeTransformer):
             else:
                 if access_rule is self.rule_cache.get('NameConstant(True)') or access_rule is self.rule_cache.get('Constant(True)'):
                     event.always = True
-                event.set_rule(access_rule)
+                # the subrule as it was written, where available
+                event.set_rule(self.profile_spot_rule(access_rule, event, getattr(ast, 'unparse', ast.dump)(node)))
+                self.spot_helpers[event] = frozenset(self.current_helpers)
                 region.locations.append(event)
 
                 make_event_item(subrule_name, event)
         # Safeguard in case this is called multiple times per world
         self.delayed_rules.clear()
 
-    def make_access_rule(self, body: ast.AST) -> AccessRule:
-        rule_str = ast.dump(body, False)
+    # Records a name used as an item, which is an event if it isn't an item already
+    # (or always for names that aren't quoted).
+    def add_event(self, name: str, always: bool = False) -> None:
+        self.current_events.append((name, always))
+        if always or name not in ItemInfo.solver_ids:
+            self.events.add(name.replace('_', ' '))
+            Item(name, event=True)
+
+    # Returns a world attribute, setting or attribute of the current spot the rule is transformed with.
+    def read_value(self, source: str, name: str) -> Any:
+        if source == 'world':
+            value = self.world.__dict__[name]
+        elif source == 'settings':
+            value = self.world.settings.settings_dict[name]
+        else:
+            value = attrgetter(name)(self.current_spot)
+        self.current_reads[(source, name)] = repr(value)
+        return value
+
+    # Whether a cached rule was transformed with the same values as the current world and spot would give.
+    def matches_reads(self, cached_rule: CachedRule) -> bool:
+        for (source, name), value in cached_rule.reads.items():
+            if source == 'world':
+                current = self.world.__dict__[name]
+            elif source == 'settings':
+                current = self.world.settings.settings_dict[name]
+            else:
+                current = attrgetter(name)(self.current_spot)
+            if repr(current) != value:
+                return False
+        return True
+
+    # Creates the subrules of a cached rule again, which must give them the same event names
+    # for its transformed rule to be used.
+    def replay_subrules(self, cached_rule: CachedRule) -> bool:
+        for target, node, subrule_name in cached_rule.subrules:
+            if self.replace_subrule(target, node).args[0].id != subrule_name:
+                return False
+        return True
+
+    def make_access_rule(self, body: ast.AST, rule_str: Optional[str] = None) -> AccessRule:
+        if rule_str is None:
+            rule_str = ast.dump(body, False)
         if rule_str not in self.rule_cache:
+            # Rules don't depend on the world they were parsed for, so worlds share them.
+            backend = self.world.settings.logic_rule_backend
+            if (backend, rule_str) not in shared_access_rules:
+                if backend == 'tree':
+                    tree = self.make_rule_tree(body)
+                    access_rule = tree.compile() if isinstance(tree, RuleTree) else tree
+                else:
+                    access_rule = self.compile_lambda(body, rule_str)
+                compiled_rule_dependencies[access_rule] = self.find_dependencies(body)
+                shared_access_rules[(backend, rule_str)] = access_rule
+            self.rule_cache[rule_str] = shared_access_rules[(backend, rule_str)]
+        return self.rule_cache[rule_str]
+
+    def compile_lambda(self, body: ast.AST, rule_str: str) -> AccessRule:
+        if rule_str not in compiled_rule_code:
             # requires consistent iteration on dicts
             kwargs = [ast.arg(arg=k) for k in kwarg_defaults.keys()]
             kwd = list(map(ast.Constant, kwarg_defaults.values()))
             name = f'<{self.current_spot and self.current_spot.name}: {rule_str}>'
             try:
-                self.rule_cache[rule_str] = eval(compile(
+                compiled_rule_code[rule_str] = compile(
                     ast.fix_missing_locations(
                         ast.Expression(ast.Lambda(
                             args=ast.arguments(
@@ -432,13 +636,95 @@ class Rule_AST_Transformer(ast.NodeTransformer):
                                 kwonlyargs=kwargs,
                                 kw_defaults=kwd),
                             body=body))),
-                    name, 'eval'),
-                    # globals/locals. if undefined, everything in the namespace *now* would be allowed
-                    # Intentionally modifiable so we can add the ItemInfo solver ids as we go
-                    allowed_globals)
+                    name, 'eval')
             except TypeError as e:
                 raise Exception('Parse Error: %s' % e, self.current_spot.name, ast.dump(body, False))
-        return self.rule_cache[rule_str]
+        # globals/locals. if undefined, everything in the namespace *now* would be allowed
+        # Intentionally modifiable so we can add the ItemInfo solver ids as we go
+        return eval(compiled_rule_code[rule_str], allowed_globals)
+
+    # Converts a transformed rule into a RuleTree, compiling the parts that aren't item checks.
+    def make_rule_tree(self, body: ast.AST) -> RuleTree | AccessRule:
+        if isinstance(body, ast.Constant) and isinstance(body.value, bool):
+            return RuleTree('const', value=body.value)
+
+        if isinstance(body, ast.BoolOp):
+            tree = RuleTree('and' if isinstance(body.op, ast.And) else 'or')
+            for value in body.values:
+                child = self.make_rule_tree(value)
+                if isinstance(child, RuleTree) and child.op == 'const':
+                    if child.value == (tree.op == 'or'):
+                        return child
+                    # else it doesn't change the result
+                elif isinstance(child, RuleTree) and (child.op == tree.op or (len(child.thresholds) == 1 and not child.children)):
+                    for solver_id, count in child.thresholds.items():
+                        tree.add_threshold(solver_id, count)
+                    tree.children.extend(child.children)
+                else:
+                    tree.children.append(child)
+            return tree
+
+        if (isinstance(body, ast.Call) and isinstance(body.func, ast.Attribute)
+                and isinstance(body.func.value, ast.Name) and body.func.value.id == 'state' and not body.keywords):
+            if body.func.attr == 'has' and isinstance(body.args[0], ast.Name) and body.args[0].id in ItemInfo.solver_ids:
+                if len(body.args) == 1 or (isinstance(body.args[1], ast.Constant) and isinstance(body.args[1].value, int)):
+                    tree = RuleTree('and')
+                    tree.add_threshold(ItemInfo.solver_ids[body.args[0].id], body.args[1].value if len(body.args) > 1 else 1)
+                    return tree
+            elif (body.func.attr in ('has_all_of', 'has_any_of') and isinstance(body.args[0], ast.Tuple)
+                    and all(isinstance(elt, ast.Name) and elt.id in ItemInfo.solver_ids for elt in body.args[0].elts)):
+                tree = RuleTree('and' if body.func.attr == 'has_all_of' else 'or')
+                for elt in body.args[0].elts:
+                    tree.add_threshold(ItemInfo.solver_ids[elt.id], 1)
+                return tree
+
+        rule_str = ast.dump(body, False)
+        if rule_str not in self.residual_rule_cache:
+            self.residual_rule_cache[rule_str] = self.compile_lambda(body, rule_str)
+        return self.residual_rule_cache[rule_str]
+
+    # Item checks in the transformed rule are all names of solver ids,
+    # everything else goes through a State method or the search.
+    @staticmethod
+    def find_dependencies(body: ast.AST) -> RuleDependencies:
+        solver_ids = set()
+        dynamic = False
+        for node in ast.walk(body):
+            if isinstance(node, ast.Name) and node.id in ItemInfo.solver_ids:
+                solver_ids.add(ItemInfo.solver_ids[node.id])
+            elif isinstance(node, ast.Attribute) and isinstance(node.value, ast.Name) and node.value.id == 'state':
+                if node.attr in pure_state_methods:
+                    solver_ids.update(pure_state_methods[node.attr])
+                elif node.attr != 'world':
+                    dynamic = True
+        return RuleDependencies(solver_ids=frozenset(solver_ids), dynamic=dynamic)
+
+    # Builds the reverse dependency index from the dependencies recorded for the compiled rules of every spot.
+    def index_dependents(self) -> dict[int | str, set[Location | Entrance]]:
+        if self.dependents is None:
+            self.dependents = defaultdict(set)
+            self.dynamic_spots = set()
+            for spot in chain(self.world.get_locations(), self.world.get_entrances()):
+                for rule in spot.access_rules:
+                    dependencies = get_rule_dependencies(rule)
+                    if dependencies is None or dependencies.dynamic:
+                        self.dynamic_spots.add(spot)
+                    if dependencies is not None:
+                        for solver_id in dependencies.solver_ids:
+                            self.dependents[solver_id].add(spot)
+                for helper in self.spot_helpers.get(spot, ()):
+                    self.dependents[helper].add(spot)
+        return self.dependents
+
+    # Returns the spots whose access rules depend on the given item, event or helper name.
+    def get_dependents(self, name: str) -> set[Location | Entrance]:
+        dependents = self.index_dependents()
+        if name in rule_aliases:
+            return dependents.get(name, set())
+        solver_id = ItemInfo.solver_ids.get(escape_name(name), None)
+        if solver_id is None:
+            return set()
+        return dependents.get(solver_id, set())
 
     ## Handlers for specific internal functions used in the json logic.
 
@@ -455,29 +741,29 @@ class Rule_AST_Transformer(ast.NodeTransformer):
     def here(self, node: ast.Call) -> ast.Call:
         if not node.args:
             raise Exception('Parse Error: missing here() argument', self.current_spot.name, ast.dump(node, False))
-        return self.replace_subrule(self.current_spot.parent_region.name, node.args[0])
+        return self.replace_subrule(self.read_value('spot', 'parent_region.name'), node.args[0])
 
     ## Handlers for compile-time optimizations (former State functions)
 
     def at_day(self, node: ast.Call) -> ast.expr:
-        if self.world.ensure_tod_access:
+        if self.read_value('world', 'ensure_tod_access'):
             # tod has DAY or (tod == NONE and (ss or find a path from a provider))
             # parsing is better than constructing this expression by hand
             return ast.parse("(tod & TimeOfDay.DAY) if tod else ((state.has_all_of((Ocarina, Suns_Song)) and state.has_all_notes_for_song('Suns Song')) or state.search.can_reach(spot.parent_region, age=age, tod=TimeOfDay.DAY))", mode='eval').body
         return ast.Constant(True)
 
     def at_dampe_time(self, node: ast.Call) -> ast.expr:
-        if self.world.ensure_tod_access:
+        if self.read_value('world', 'ensure_tod_access'):
             # tod has DAMPE or (tod == NONE and (find a path from a provider))
             # parsing is better than constructing this expression by hand
             return ast.parse("(tod & TimeOfDay.DAMPE) if tod else state.search.can_reach(spot.parent_region, age=age, tod=TimeOfDay.DAMPE)", mode='eval').body
         return ast.Constant(True)
 
     def at_night(self, node: ast.Call) -> ast.expr:
-        if self.current_spot and self.current_spot.type == 'GS Token' and self.world.settings.logic_no_night_tokens_without_suns_song:
+        if self.current_spot and self.read_value('spot', 'type') == 'GS Token' and self.read_value('settings', 'logic_no_night_tokens_without_suns_song'):
             # Using visit here to resolve 'can_play' rule
             return self.visit(ast.parse('can_play(Suns_Song)', mode='eval').body)
-        if self.world.ensure_tod_access:
+        if self.read_value('world', 'ensure_tod_access'):
             # tod has DAMPE or (tod == NONE and (ss or find a path from a provider))
             # parsing is better than constructing this expression by hand
             return ast.parse("(tod & TimeOfDay.DAMPE) if tod else ((state.has_all_of((Ocarina, Suns_Song)) and state.has_all_notes_for_song('Suns Song')) or state.search.can_reach(spot.parent_region, age=age, tod=TimeOfDay.DAMPE))", mode='eval').body
@@ -487,13 +773,40 @@ class Rule_AST_Transformer(ast.NodeTransformer):
     # If spot is None, here() rules won't work.
     def parse_rule(self, rule_string: str, spot: Optional[Location | Entrance] = None) -> AccessRule:
         self.current_spot = spot
-        return self.make_access_rule(self.visit(ast.parse(rule_string, mode='eval').body))
+        self.current_helpers = set()
+        self.current_reads = {}
+        self.current_events = []
+        self.current_subrules = []
+        if self.logic_file is None:
+            return self.make_access_rule(self.visit(ast.parse(rule_string, mode='eval').body))
+
+        for cached_rule in self.logic_file.rules.get(rule_string, ()):
+            if self.matches_reads(cached_rule) and self.replay_subrules(cached_rule):
+                for name, always in cached_rule.events:
+                    self.add_event(name, always)
+                self.current_helpers.update(cached_rule.helpers)
+                return self.make_access_rule(cached_rule.body, cached_rule.rule_str)
+
+        body = self.visit(ast.parse(rule_string, mode='eval').body)
+        rule_str = ast.dump(body, False)
+        self.logic_file.add_rule(rule_string, CachedRule(
+            reads=self.current_reads, events=self.current_events, subrules=self.current_subrules,
+            helpers=frozenset(self.current_helpers), body=body, rule_str=rule_str))
+        return self.make_access_rule(body, rule_str)
+
+    # Wraps the rule just parsed for the spot when the rule profiler is active.
+    def profile_spot_rule(self, access_rule: AccessRule, spot: Location | Entrance, rule_string: str) -> AccessRule:
+        profiled_rule = profile_rule(access_rule, spot, rule_string, frozenset(self.current_helpers))
+        if profiled_rule is not access_rule:
+            compiled_rule_dependencies[profiled_rule] = compiled_rule_dependencies[access_rule]
+        return profiled_rule
 
     def parse_spot_rule(self, spot: Location | Entrance) -> None:
         rule = spot.rule_string.split('#', 1)[0].strip()
 
         access_rule = self.parse_rule(rule, spot)
-        spot.set_rule(access_rule)
+        spot.set_rule(self.profile_spot_rule(access_rule, spot, rule))
+        self.spot_helpers[spot] = frozenset(self.current_helpers)
         if access_rule is self.rule_cache.get('NameConstant(False)') or access_rule is self.rule_cache.get('Constant(False)'):
             spot.never = True
         elif access_rule is self.rule_cache.get('NameConstant(True)') or access_rule is self.rule_cache.get('Constant(True)'):
@@ -0,0 +1,107 @@
+from __future__ import annotations
+import time
+from collections.abc import Iterable
+from typing import TYPE_CHECKING, Optional
+
+from RulesCommon import AccessRule
+
+if TYPE_CHECKING:
+    from Entrance import Entrance
+    from Location import Location
+
+
+class RuleStats:
+    __slots__ = ('calls', 'true', 'time', 'helpers')
+
+    def __init__(self, helpers: frozenset[str] = frozenset()) -> None:
+        self.calls: int = 0
+        self.true: int = 0
+        # nanoseconds, including the rules evaluated while this one ran (eg. by can_reach with a time of day)
+        self.time: int = 0
+        # LogicHelpers.json entries that were expanded into the rule
+        self.helpers: frozenset[str] = helpers
+
+    def add(self, other: RuleStats) -> None:
+        self.calls += other.calls
+        self.true += other.true
+        self.time += other.time
+
+
+# Counts the calls, true results and time of the access rules parsed for logic spots
+# while it is active, by spot name and rule string. The spots of all worlds are added up.
+class RuleProfiler:
+    def __init__(self) -> None:
+        self.stats: dict[tuple[str, str], RuleStats] = {}
+
+    def wrap(self, rule: AccessRule, spot_name: str, rule_string: str, helpers: frozenset[str]) -> AccessRule:
+        stats = self.stats.get((spot_name, rule_string), None)
+        if stats is None:
+            stats = self.stats[(spot_name, rule_string)] = RuleStats(helpers)
+        perf_counter_ns = time.perf_counter_ns
+
+        def profiled_rule(state, **kwargs):
+            start = perf_counter_ns()
+            result = rule(state, **kwargs)
+            stats.time += perf_counter_ns() - start
+            stats.calls += 1
+            if result:
+                stats.true += 1
+            return result
+        return profiled_rule
+
+    def by_spot(self) -> dict[str, RuleStats]:
+        return self.group((spot_name, stats) for (spot_name, _), stats in self.stats.items())
+
+    def by_rule(self) -> dict[str, RuleStats]:
+        return self.group((rule_string, stats) for (_, rule_string), stats in self.stats.items())
+
+    # A helper is charged the whole time of every rule it was expanded into.
+    def by_helper(self) -> dict[str, RuleStats]:
+        return self.group((helper, stats) for stats in self.stats.values() for helper in stats.helpers)
+
+    @staticmethod
+    def group(entries: Iterable[tuple[str, RuleStats]]) -> dict[str, RuleStats]:
+        groups = {}
+        for key, stats in entries:
+            if key not in groups:
+                groups[key] = RuleStats()
+            groups[key].add(stats)
+        return groups
+
+    # Tables of the spots, rule strings and helpers that took the most time
+    def report(self, limit: int = 50) -> str:
+        total = RuleStats()
+        for stats in self.stats.values():
+            total.add(stats)
+        lines = [f'{total.calls} access rule calls in {total.time / 1e9:.3f}s']
+        for title, groups in (('Spots', self.by_spot()), ('Rules', self.by_rule()), ('Logic helpers', self.by_helper())):
+            lines += ['', f'{title} by time:', f'{"time (s)":>9} {"share":>6} {"calls":>10} {"true":>6} {"mean (us)":>9}  name']
+            for name, stats in sorted(groups.items(), key=lambda group: group[1].time, reverse=True)[:limit]:
+                lines.append(f'{stats.time / 1e9:9.3f} {stats.time / max(total.time, 1):6.1%} {stats.calls:10} '
+                             f'{stats.true / max(stats.calls, 1):6.1%} {stats.time / max(stats.calls, 1) / 1e3:9.2f}  {name}')
+        return '\n'.join(lines) + '\n'
+
+    def to_file(self, filename: str, limit: int = 50) -> None:
+        with open(filename, 'w', encoding='utf-8') as f:
+            f.write(self.report(limit))
+
+
+# The profiler that rules parsed in this process are wrapped for, if profiling
+active_profiler: Optional[RuleProfiler] = None
+
+
+def start_rule_profiler() -> RuleProfiler:
+    global active_profiler
+    active_profiler = RuleProfiler()
+    return active_profiler
+
+
+def stop_rule_profiler() -> None:
+    global active_profiler
+    active_profiler = None
+
+
+def profile_rule(rule: AccessRule, spot: Location | Entrance, rule_string: str, helpers: frozenset[str]) -> AccessRule:
+    if active_profiler is None:
+        return rule
+    return active_profiler.wrap(rule, spot.name, rule_string, helpers)
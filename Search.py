@@ -6,7 +6,11 @@ from collections.abc import Callable, Iterable
 from dataclasses import dataclass, field
 from typing import TYPE_CHECKING, Optional
 
+from Item import ItemInfo
+from Metrics import counters
 from Region import Region, TimeOfDay
+from RuleParser import rule_dependencies
+from RulesCommon import escape_name
 from State import State
 
 if sys.version_info >= (3, 10):
@@ -21,6 +25,8 @@ if TYPE_CHECKING:
     from Goals import GoalCategory
 
 ValidGoals: TypeAlias = "dict[str, bool | dict[str, list[int] | dict[int, list[str]]]]"
+# (world id, solver id) of an item a failed access rule is waiting on
+DependencyKey: TypeAlias = "tuple[int, int]"
 
 
 @dataclass
@@ -30,16 +36,26 @@ class SearchCache:
     visited_locations: set[Location] = field(default_factory=set)
     child_regions: dict[Region, int] = field(default_factory=dict)
     adult_regions: dict[Region, int] = field(default_factory=dict)
+    # Only used by IncrementalSearch, see there.
+    child_waiting: dict[DependencyKey, list[Entrance]] = field(default_factory=dict)
+    adult_waiting: dict[DependencyKey, list[Entrance]] = field(default_factory=dict)
+    location_waiting: dict[DependencyKey, list[Location]] = field(default_factory=dict)
+    blocked_locations: dict[Location, int] = field(default_factory=dict)
 
     def copy(self) -> SearchCache:
         new = type(self)()
         for name, value in self.__dict__.items():
             setattr(new, name, copy.copy(value))
+        # The waiting lists are appended to in place, so they can't be shared between copies.
+        for waiting in (new.child_waiting, new.adult_waiting, new.location_waiting):
+            for key, spots in waiting.items():
+                waiting[key] = spots.copy()
         return new
 
 
 class Search:
     def __init__(self, state_list: Iterable[State], initial_cache: Optional[SearchCache] = None) -> None:
+        counters.searches += 1
         self.state_list: list[State] = [state.copy() for state in state_list]
 
         # Let the states reference this search.
@@ -71,6 +87,7 @@ class Search:
     def copy(self) -> Search:
         # we only need to copy the top sphere since that's what we're starting with and we don't go back
         # copy always makes a nonreversible instance
+        counters.search_copies += 1
         return Search(self.state_list, initial_cache=self._cache.copy())
 
     def collect_all(self, itempool: Iterable[Item]) -> None:
@@ -99,6 +116,15 @@ class Search:
         p.next_sphere()
         return p
 
+    # Queues exits that were connected after the search reached their region,
+    # so the next sphere tries them.
+    def queue_exits(self, exits: Iterable[Entrance]) -> None:
+        for exit in exits:
+            if exit.parent_region in self._cache.child_regions:
+                self._cache.child_queue.append(exit)
+            if exit.parent_region in self._cache.adult_regions:
+                self._cache.adult_queue.append(exit)
+
     # Truncates the sphere cache based on which sphere a location is in, and
     # drops the location from the appropriate visited set.
     # Doesn't forget which sphere locations are in as an optimization, so be careful
@@ -131,6 +157,7 @@ class Search:
         for exit in exit_queue:
             if exit.world and exit.connected_region and exit.connected_region not in regions:
                 # Evaluate the access rule directly, without tod
+                counters.rule_evaluations += 1
                 if exit.access_rule(self.state_list[exit.world.id], spot=exit, age=age):
                     # If it found a new tod, make sure we try other entrances again.
                     # Probably would take too long and not be worth it if we only grabbed the exits
@@ -154,6 +181,7 @@ class Search:
             # We don't look for new regions, just spreading the tod to our existing regions
             if exit.connected_region in regions and tod & ~regions[exit.connected_region]:
                 # Evaluate the access rule directly
+                counters.rule_evaluations += 1
                 if exit.access_rule(self.state_list[exit.world.id], spot=exit, age=age, tod=tod):
                     regions[exit.connected_region] |= tod
                     if exit.connected_region == goal_region:
@@ -198,19 +226,22 @@ class Search:
                 if loc in visited_locations:
                     continue
                 # Check adult first; it's the most likely.
-                if (loc.parent_region in adult_regions
-                        and loc.access_rule(self.state_list[loc.world.id], spot=loc, age='adult')):
-                    had_reachable_locations = True
-                    # Mark it visited for this algorithm
-                    visited_locations.add(loc)
-                    yield loc
-
-                elif (loc.parent_region in child_regions
-                      and loc.access_rule(self.state_list[loc.world.id], spot=loc, age='child')):
-                    had_reachable_locations = True
-                    # Mark it visited for this algorithm
-                    visited_locations.add(loc)
-                    yield loc
+                if loc.parent_region in adult_regions:
+                    counters.rule_evaluations += 1
+                    if loc.access_rule(self.state_list[loc.world.id], spot=loc, age='adult'):
+                        had_reachable_locations = True
+                        # Mark it visited for this algorithm
+                        visited_locations.add(loc)
+                        yield loc
+                        continue
+
+                if loc.parent_region in child_regions:
+                    counters.rule_evaluations += 1
+                    if loc.access_rule(self.state_list[loc.world.id], spot=loc, age='child'):
+                        had_reachable_locations = True
+                        # Mark it visited for this algorithm
+                        visited_locations.add(loc)
+                        yield loc
 
     # This collects all item locations available in the state list given that
     # the states have collected items. The purpose is that it will search for
@@ -361,19 +392,28 @@ class Search:
     def spot_access(self, spot: Location | Entrance, age: Optional[str] = None, tod: int = TimeOfDay.NONE) -> bool:
         if age == 'adult' or age == 'child':
             return (self.can_reach(spot.parent_region, age=age, tod=tod)
-                    and spot.access_rule(self.state_list[spot.world.id], spot=spot, age=age, tod=tod))
+                    and self._spot_rule(spot, age, tod))
         elif age == 'both':
             return (self.can_reach(spot.parent_region, age=age, tod=tod)
-                    and spot.access_rule(self.state_list[spot.world.id], spot=spot, age='adult', tod=tod)
-                    and spot.access_rule(self.state_list[spot.world.id], spot=spot, age='child', tod=tod))
+                    and self._spot_rule(spot, 'adult', tod)
+                    and self._spot_rule(spot, 'child', tod))
         else:
             return (self.can_reach(spot.parent_region, age='adult', tod=tod)
-                    and spot.access_rule(self.state_list[spot.world.id], spot=spot, age='adult', tod=tod)) or (
+                    and self._spot_rule(spot, 'adult', tod)) or (
                             self.can_reach(spot.parent_region, age='child', tod=tod)
-                            and spot.access_rule(self.state_list[spot.world.id], spot=spot, age='child', tod=tod))
+                            and self._spot_rule(spot, 'child', tod))
+
+    def _spot_rule(self, spot: Location | Entrance, age: str, tod: int) -> bool:
+        counters.rule_evaluations += 1
+        return spot.access_rule(self.state_list[spot.world.id], spot=spot, age=age, tod=tod)
 
 
 class RewindableSearch(Search):
+    # Copies are only used for one-off explorations (eg. can_beat_game), which never rewind.
+    def copy(self) -> Search:
+        counters.search_copies += 1
+        return IncrementalSearch(self.state_list, initial_cache=self._cache.copy())
+
     def unvisit(self, location: Location) -> None:
         # A location being unvisited is either:
         # in the top two caches (if it's the first being unvisited for a sphere)
@@ -394,3 +434,118 @@ class RewindableSearch(Search):
         # Save the current data into the cache.
         self.cached_spheres.append(self._cache.copy())
         self._cache = self.cached_spheres[-1]
+
+
+# A Search that remembers which items each failed access rule reads, so that collecting
+# or uncollecting an item only re-evaluates the exits and locations depending on it.
+# Spots whose rules can't be analysed (see RuleParser.rule_dependencies) are retried every sphere,
+# like Search does for all of them. Results are the same as Search.
+class IncrementalSearch(Search):
+    def copy(self) -> IncrementalSearch:
+        counters.search_copies += 1
+        return IncrementalSearch(self.state_list, initial_cache=self._cache.copy())
+
+    def collect_all(self, itempool: Iterable[Item]) -> None:
+        for item in itempool:
+            if item.solver_id is not None and item.world is not None:
+                self.collect(item)
+
+    def collect(self, item: Item) -> None:
+        super().collect(item)
+        self._wake(item)
+
+    def uncollect(self, item: Item) -> None:
+        super().uncollect(item)
+        self._wake(item)
+
+    # Requeues the spots waiting on any of the solver ids the item changes in its state.
+    def _wake(self, item: Item) -> None:
+        solver_ids = [item.solver_id]
+        if item.alias_id is not None:
+            solver_ids.append(item.alias_id)
+        if 'Small Key Ring' in item.name:
+            dungeon_name = item.name[:-1].split(' (', 1)[1]
+            if item.world.keyring_give_bk(dungeon_name):
+                bk = f'Boss Key ({dungeon_name})'
+                solver_ids.append(ItemInfo.solver_ids[escape_name(bk)])
+
+        cache = self._cache
+        for solver_id in solver_ids:
+            key = (item.world.id, solver_id)
+            cache.child_queue.extend(cache.child_waiting.pop(key, ()))
+            cache.adult_queue.extend(cache.adult_waiting.pop(key, ()))
+            for location in cache.location_waiting.pop(key, ()):
+                cache.blocked_locations.pop(location, None)
+
+    # Same as Search._expand_regions, but failed exits with known dependencies are parked
+    # until one of them changes instead of being returned for the next iteration.
+    def _expand_regions(self, exit_queue: list[Entrance], regions: dict[Region, int], age: Optional[str]) -> list[Entrance]:
+        waiting = self._cache.adult_waiting if age == 'adult' else self._cache.child_waiting
+        # Woken exits may be queued more than once.
+        exit_queue = list(dict.fromkeys(exit_queue))
+        failed = []
+        for exit in exit_queue:
+            if exit.world and exit.connected_region and exit.connected_region not in regions:
+                # Evaluate the access rule directly, without tod
+                counters.rule_evaluations += 1
+                if exit.access_rule(self.state_list[exit.world.id], spot=exit, age=age):
+                    # If it found a new tod, make sure we try other entrances again.
+                    # Exits with known dependencies don't look at tod, so they needn't be retried.
+                    if exit.connected_region.provides_time and ~regions[exit.world.get_region('Root')] & exit.connected_region.provides_time:
+                        exit_queue.extend(failed)
+                        failed = []
+                        regions[exit.world.get_region('Root')] |= exit.connected_region.provides_time
+                    regions[exit.connected_region] = exit.connected_region.provides_time
+                    exit_queue.extend(exit.connected_region.exits)
+                else:
+                    dependencies = rule_dependencies(exit.access_rule)
+                    if dependencies is None:
+                        failed.append(exit)
+                    else:
+                        for solver_id in dependencies:
+                            waiting.setdefault((exit.world.id, solver_id), []).append(exit)
+        return failed
+
+    # Same as Search.iter_reachable_locations, but locations that failed their access rule
+    # are only checked again once one of their dependencies changed, or their region becomes
+    # reachable as another age.
+    def iter_reachable_locations(self, item_locations: Iterable[Location]) -> Iterable[Location]:
+        had_reachable_locations = True
+        # will loop as long as any visits were made, and at least once
+        while had_reachable_locations:
+            child_regions, adult_regions, visited_locations = self.next_sphere()
+            blocked_locations = self._cache.blocked_locations
+            location_waiting = self._cache.location_waiting
+
+            had_reachable_locations = False
+            for loc in item_locations:
+                if loc in visited_locations:
+                    continue
+                # bit 1 is adult, bit 2 is child
+                reached = (loc.parent_region in adult_regions) | (loc.parent_region in child_regions) << 1
+                tried = blocked_locations.get(loc, 0)
+                untried = reached & ~tried
+                if not untried:
+                    continue
+                # Check adult first; it's the most likely.
+                reachable = False
+                if untried & 1:
+                    counters.rule_evaluations += 1
+                    reachable = loc.access_rule(self.state_list[loc.world.id], spot=loc, age='adult')
+                if not reachable and untried & 2:
+                    counters.rule_evaluations += 1
+                    reachable = loc.access_rule(self.state_list[loc.world.id], spot=loc, age='child')
+                if reachable:
+                    had_reachable_locations = True
+                    # Mark it visited for this algorithm
+                    visited_locations.add(loc)
+                    yield loc
+                    continue
+
+                dependencies = rule_dependencies(loc.access_rule)
+                if dependencies is None:
+                    continue
+                if not tried:
+                    for solver_id in dependencies:
+                        location_waiting.setdefault((loc.world.id, solver_id), []).append(loc)
+                blocked_locations[loc] = tried | reached
@@ -405,6 +405,10 @@ def get_settings_from_command_line_args() -> tuple[Settings, bool, str, bool, st
     parser.add_argument('--seed', help='Generate the specified seed.')
     parser.add_argument('--no_log', help='Suppresses the generation of a log file.', action='store_true')
     parser.add_argument('--output_settings', help='Always outputs a settings.json file even when spoiler is enabled.', action='store_true')
+    parser.add_argument('--output_metrics', help='Outputs a metrics.json file with the time and work of each generation phase.', action='store_true')
+    parser.add_argument('--profile_rules', help='Times every access rule and outputs a RuleProfile.txt file ranking the spots, rules and logic helpers by time.', action='store_true')
+    parser.add_argument('--workers', type=int, help='Number of processes generating seeds when the generation count is above 1. Defaults to the number of CPUs.')
+    parser.add_argument('--attempt_workers', type=int, help='Number of generation attempts to run at once in separate processes. Worker processes only find the attempts that fail ahead of time, the main process still generates the attempt it keeps, so a successful attempt a worker also ran costs two generations.')
     parser.add_argument('--diff_rom', help='Generates a ZPF patch from the specified ROM file.')
 
     args = parser.parse_args()
@@ -447,6 +451,12 @@ def get_settings_from_command_line_args() -> tuple[Settings, bool, str, bool, st
     settings = Settings(settings_base)
 
     settings.output_settings = args.output_settings
+    settings.output_metrics = args.output_metrics
+    settings.profile_rules = args.profile_rules
+    if args.workers is not None:
+        settings.batch_workers = args.workers
+    if args.attempt_workers is not None:
+        settings.attempt_workers = args.attempt_workers
 
     if args.settings_string is not None:
         settings.update_with_settings_string(args.settings_string)
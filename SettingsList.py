@@ -11,7 +11,7 @@ from Location import LocationIterator
 from LocationList import location_table
 from Models import get_model_choices
 from SettingsListTricks import logic_tricks
-from SettingTypes import SettingInfo, SettingInfoStr, SettingInfoList, SettingInfoDict, Textbox, Button, Checkbutton, \
+from SettingTypes import SettingInfo, SettingInfoStr, SettingInfoInt, SettingInfoList, SettingInfoDict, Textbox, Button, Checkbutton, \
     Combobox, Radiobutton, Fileinput, Directoryinput, Textinput, ComboboxInt, Scale, Numberinput, MultipleSelect, \
     SearchBox
 import Sounds
@@ -41,10 +41,17 @@ class SettingInfos:
     check_version = Checkbutton(None)
     checked_version = SettingInfoStr(None, None)
     output_settings = Checkbutton(None)
+    output_metrics = Checkbutton(None)
+    profile_rules = Checkbutton(None)
     patch_without_output = Checkbutton(None)
     generating_patch_file = Checkbutton(None)
     output_file = SettingInfoStr(None, None)
     seed = SettingInfoStr(None, None)
+    logic_rule_backend = SettingInfoStr(None, None, choices=['lambda', 'tree'], default='lambda')
+    logic_cache = Checkbutton(None, default=True)
+    rom_compression_cache = Checkbutton(None, default=True)
+    batch_workers = SettingInfoInt(None, None, False, default=0)
+    attempt_workers = SettingInfoInt(None, None, False, default=1)
 
     # GUI Only Buttons/Text
 
@@ -3,11 +3,11 @@ import logging
 import random
 from collections import OrderedDict
 from itertools import chain
-from typing import TYPE_CHECKING, Any
+from typing import TYPE_CHECKING, Any, Optional
 
 from Item import Item
 from LocationList import location_sort_order
-from Search import Search, RewindableSearch
+from Search import Search, RewindableSearch, IncrementalSearch
 
 if TYPE_CHECKING:
     from Dungeon import Dungeon
@@ -15,6 +15,7 @@ if TYPE_CHECKING:
     from Goals import GoalCategory
     from Hints import GossipText
     from Location import Location
+    from Metrics import Metrics
     from Region import Region
     from Settings import Settings
     from World import World
@@ -78,6 +79,8 @@ class Spoiler:
         self.hints: dict[int, dict[int, GossipText]] = {world.id: {} for world in worlds}
         self.file_hash: list[int] = []
         self.password: list[int] = []
+        # time and work of each phase of generating this seed, set by Main.main
+        self.metrics: Optional[Metrics] = None
 
     def build_file_hash(self) -> None:
         dist_file_hash = self.settings.distribution.file_hash
@@ -159,14 +162,14 @@ class Spoiler:
 
     def create_playthrough(self) -> None:
         logger = logging.getLogger('')
-        if self.worlds[0].check_beatable_only and not Search([world.state for world in self.worlds]).can_beat_game():
+        if self.worlds[0].check_beatable_only and not IncrementalSearch([world.state for world in self.worlds]).can_beat_game():
             raise RuntimeError('Game unbeatable after placing all items.')
 
         # create a copy as we will modify it
         worlds = self.copy_worlds()
 
         # if we only check for beatable, we can do this sanity check first before writing down spheres
-        if worlds[0].check_beatable_only and not Search([world.state for world in worlds]).can_beat_game():
+        if worlds[0].check_beatable_only and not IncrementalSearch([world.state for world in worlds]).can_beat_game():
             raise RuntimeError('Uncopied world beatable but copied world is not.')
 
         search = RewindableSearch([world.state for world in worlds])
@@ -249,7 +252,7 @@ class Spoiler:
                 old_connected_region = entrance.disconnect()
 
                 # we use a new search to ensure the disconnected entrance is no longer used
-                sub_search = Search([world.state for world in worlds])
+                sub_search = IncrementalSearch([world.state for world in worlds])
 
                 # Test whether the game is still beatable from here.
                 logger.debug('Checking if reaching %s, through %s, is required to beat the game.', old_connected_region.name, entrance.name)
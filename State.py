@@ -1,10 +1,13 @@
 from __future__ import annotations
+from array import array
 from collections.abc import Iterable
+from operator import countOf
 from typing import TYPE_CHECKING, Optional, Any
 
 from Item import Item, ItemInfo
 from Location import Location
-from RulesCommon import AccessRule, escape_name
+from Metrics import counters
+from RulesCommon import escape_name
 from Boulders import BOULDER_TYPE
 from Location import Location, LocationFactory
 
@@ -37,18 +40,17 @@ can_kill_drop_cache = {}
 
 class State:
     def __init__(self, parent: World) -> None:
-        self.solv_items: list[int] = [0] * len(ItemInfo.solver_ids)
+        # Item counts indexed by solver id, packed so that copies are a single memcpy.
+        self.solv_items: array[int] = array('H', [0]) * len(ItemInfo.solver_ids)
         self.world: World = parent
         self.search: Optional[Search] = None
 
-        self.can_blast_or_smash: AccessRule = self.world.parser.parse_rule("can_blast_or_smash")
-        self.Blue_Fire: AccessRule = self.world.parser.parse_rule("Blue_Fire")
-
     def copy(self, new_world: Optional[World] = None) -> State:
+        counters.state_copies += 1
         new_world = new_world if new_world else self.world
         new_state = State(new_world)
-        for i, val in enumerate(self.solv_items):
-            new_state.solv_items[i] = val
+        # Events parsed since this state was created have no count here yet.
+        new_state.solv_items[:len(self.solv_items)] = self.solv_items
         return new_state
 
     def item_name(self, location: str | Location) -> Optional[str]:
@@ -70,19 +72,14 @@ class State:
         return self.solv_items[item] >= count
 
     def has_any_of(self, items: Iterable[int]) -> bool:
-        for i in items:
-            if self.solv_items[i]:
-                return True
-        return False
+        return any(map(self.solv_items.__getitem__, items))
 
     def has_all_of(self, items: Iterable[int]) -> bool:
-        for i in items:
-            if not self.solv_items[i]:
-                return False
-        return True
+        return all(map(self.solv_items.__getitem__, items))
 
     def count_distinct(self, items: Iterable[int]) -> int:
-        return sum(1 for i in items if self.solv_items[i] > 0)
+        counts = list(map(self.solv_items.__getitem__, items))
+        return len(counts) - countOf(counts, 0)
 
     def item_count(self, item: int) -> int:
         return self.solv_items[item]
@@ -183,9 +180,8 @@ class State:
                 bk = f'Boss Key ({dungeon_name})'
                 self.solv_items[ItemInfo.solver_ids[escape_name(bk)]] = 0
         if item.alias and item.alias_id is not None and self.solv_items[item.alias_id] > 0:
-            self.solv_items[item.alias_id] -= item.alias[1]
-            if self.solv_items[item.alias_id] < 0:
-                self.solv_items[item.alias_id] = 0
+            # Counts are unsigned
+            self.solv_items[item.alias_id] = max(self.solv_items[item.alias_id] - item.alias[1], 0)
         if self.solv_items[item.solver_id] > 0:
             self.solv_items[item.solver_id] -= 1
 
@@ -376,11 +372,10 @@ class State:
             return age == 'adult' and self.has(Progressive_Strength_Upgrade, 2)
         elif boulder_type == BOULDER_TYPE.BROWN:
             # Check for adult+hammer or explosives
-            return self.can_blast_or_smash(self, age=age)
+            return self.world.can_blast_or_smash_rule(self, age=age)
         elif boulder_type == BOULDER_TYPE.RED_ICE:
             # Check for blue fire
-            #return self.world.parser.parse_rule('Blue_Fire')(self, age=age)
-            return self.Blue_Fire(self, age=age)
+            return self.world.blue_fire_rule(self, age=age)
         
         # Should never get here
         return False
@@ -3,27 +3,52 @@
 # See `python -m unittest -h` or `pytest -h` for more options.
 
 from __future__ import annotations
+import copy
+import crc
+import gzip
 import io
+import itertools
 import json
 import logging
 import os
+import pickle
 import random
 import re
+import shutil
+import struct
 import unittest
+import unittest.mock
+import zipfile
 from collections import Counter, defaultdict
 from typing import Literal, Optional, Any, overload
 
-from EntranceShuffle import EntranceShuffleError
+from Benchmark import Tolerances, baseline_results, compare_results, time_crc
+from Entrance import Entrance
+from EntranceShuffle import EntranceShuffleError, TargetCompatibility, ValidationSearches, assume_entrance_pool, change_connections, entrance_unreachable_as, \
+    place_entrance, placed_connections, replace_entrance, restore_connections, take_placed_target
 from Fill import ShuffleError
-from Hints import HintArea, build_misc_item_hints
-from Item import ItemInfo
+from Goals import update_goal_items
+from Hints import HintArea, HintAreaNotFound, build_gossip_hints, build_misc_item_hints
+from Item import ItemInfo, ItemFactory
 from ItemPool import remove_junk_items, remove_junk_ludicrous_items, ludicrous_items_base, ludicrous_items_extended, trade_items, ludicrous_exclusions
+from LogicCache import cache_path, logic_files
+from Location import Location
 from LocationList import location_is_viewable
-from Main import main, resolve_settings, build_world_graphs
+from MBSDIFFPatch import apply_minibsdiff_patch_file
+import Main
+from Main import main, main_batch, resolve_settings, SeedResult, build_world_graphs, place_items
 from Messages import Message, read_messages, shuffle_messages
+from N64Patch import apply_patch_archive, apply_patch_file, create_patch_file
+from ntype import BigStream
 from Settings import Settings, get_preset_files
 from Spoiler import Spoiler
-from Rom import Rom
+from World import World
+from Yaz0 import compress_rom_data, compressed_files, decompress_rom_data, has_compressed_files, yaz0_compress, yaz0_decompress
+from Rom import AddressRanges, Rom, RomBuffer, ROM_PAGE_SIZE
+from RuleParser import get_rule_dependencies, rule_dependencies
+from RuleProfiler import start_rule_profiler, stop_rule_profiler
+from Search import Search, IncrementalSearch
+from State import State
 from Audiobank import *
 
 test_dir = os.path.join(os.path.dirname(__file__), 'tests')
@@ -650,6 +675,24 @@ class TestHints(unittest.TestCase):
             if message.id == 0x70CC: # Ganondorf hint message
                 self.assertTrue("thosepotsoverthere" in message.text.replace('\n', '').replace(' ', ''))
 
+    def test_hints_without_woth(self):
+        # Hint distributions without woth, barren and goal hints get the same hints without the WOTH search
+        for hint_dist in ('useless', 'bingo', 'coop'):
+            with self.subTest(hint_dist):
+                hints = []
+                for search_woth in (True, False):
+                    settings = make_settings_for_test({'hint_dist': hint_dist}, seed='TESTTESTTEST')
+                    resolve_settings(settings)
+                    worlds = build_world_graphs(settings)
+                    place_items(worlds)
+                    self.assertFalse(worlds[0].enable_woth_hints)
+                    spoiler = Spoiler(worlds)
+                    update_goal_items(spoiler, search_woth)
+                    self.assertEqual(bool(spoiler.required_locations[0]), search_woth)
+                    build_gossip_hints(spoiler, worlds)
+                    hints.append(({stone: hint.text for stone, hint in spoiler.hints[0].items()}, random.getstate()))
+                self.assertEqual(hints[0], hints[1])
+
     def test_blue_fire_arrows(self):
         # Blue Fire Arrows should be WotH and in the item pool
         _, spoiler = generate_with_plandomizer("plando-blue-fire-arrows-hints")
@@ -680,6 +723,343 @@ class TestEntranceRandomizer(unittest.TestCase):
             with self.assertRaises(EntranceShuffleError):
                 build_world_graphs(settings)
 
+    def test_hint_area_cache(self):
+        # Cached hint areas must match a fresh search after entrances are reconnected
+        settings = load_settings('entrance.sav', seed='TESTTESTTEST')
+        resolve_settings(settings)
+        for attempt in range(10):
+            settings.reset_distribution()
+            try:
+                world = build_world_graphs(settings)[0]
+                break
+            except ShuffleError:
+                continue
+
+        def hint_areas(clear_cache: bool = False) -> dict[str, Optional[HintArea]]:
+            if clear_cache:
+                world.hint_area_cache.clear()
+                world.hint_area_dependents.clear()
+            areas = {}
+            for region in world.regions:
+                try:
+                    areas[region.name] = HintArea.at(region)
+                except HintAreaNotFound:
+                    areas[region.name] = None
+            return areas
+
+        self.assertDictEqual(hint_areas(), hint_areas(clear_cache=True))
+        grottos = world.get_shufflable_entrances(type='Grotto', only_primary=True)
+        first = grottos[0]
+        second = next(entrance for entrance in grottos if HintArea.at(entrance.parent_region) != HintArea.at(first.parent_region))
+        first_region, second_region = first.disconnect(), second.disconnect()
+        first.connect(second_region)
+        second.connect(first_region)
+        self.assertEqual(HintArea.at(second_region), HintArea.at(first.parent_region))
+        self.assertDictEqual(hint_areas(), hint_areas(clear_cache=True))
+
+    def test_take_placed_target(self):
+        # An entrance left without a valid target takes the target of an entrance placed before, which moves to the target left
+        settings = load_settings('plentiful.sav', seed='TESTTESTTEST')
+        resolve_settings(settings)
+        worlds = build_world_graphs(settings)
+        world = worlds[0]
+        itempool = [item for world in worlds for item in world.get_itempool_with_dungeon_items()]
+        windmill = world.get_entrance('Kakariko Village -> Kak Windmill')
+        fairy = world.get_entrance('Ganons Castle Grounds -> OGC Great Fairy Fountain')
+        entrances = [windmill, fairy]
+        for entrance in entrances:
+            entrance.shuffled = entrance.reverse.shuffled = True
+        windmill_target, fairy_target = target_entrances = assume_entrance_pool(entrances)
+        searches = ValidationSearches(worlds, itempool, entrances, target_entrances)
+        compatibility = TargetCompatibility(target_entrances)
+        rollbacks = []
+
+        self.assertTrue(replace_entrance(worlds, windmill, fairy_target, rollbacks, (), itempool, searches=searches))
+        # The windmill can be reached from Dampe's grave as child, which the fairy fountain's exit must not be
+        self.assertFalse(place_entrance(worlds, fairy, target_entrances, rollbacks, (), itempool, [], searches, compatibility))
+        undone = take_placed_target(worlds, fairy, entrances, target_entrances, rollbacks, rollbacks, (), itempool, [], searches, compatibility, defaultdict(set))
+        self.assertListEqual(undone, [])
+        self.assertListEqual(rollbacks, [(fairy, fairy_target), (windmill, windmill_target)])
+        self.assertIs(fairy.connected_region, world.get_region('OGC Great Fairy Fountain'))
+        self.assertIs(windmill.connected_region, world.get_region('Kak Windmill'))
+
+    def test_unreachable_as_cache(self):
+        # Cached entrance_unreachable_as results must match a fresh check after entrances are reconnected
+        settings = load_settings('plentiful.sav', seed='TESTTESTTEST')
+        resolve_settings(settings)
+        world = build_world_graphs(settings)[0]
+        entrances = world.get_shufflable_entrances()
+
+        def unreachable(clear_cache: bool = False) -> dict[tuple[str, str], bool]:
+            if clear_cache:
+                world.unreachable_as_cache.clear()
+                world.unreachable_as_dependents.clear()
+            return {(entrance.name, age): entrance_unreachable_as(entrance, age, already_checked=[entrance.reverse])
+                    for entrance in entrances for age in ('child', 'adult')}
+
+        first_results = unreachable()
+        self.assertDictEqual(first_results, unreachable(clear_cache=True))
+        swapped = [entrance for entrance_type in ('Interior', 'Overworld') for entrance in world.get_shufflable_entrances(type=entrance_type, only_primary=True)]
+        random.seed('unreachable as cache')
+        for _ in range(10):
+            first, second = random.sample(swapped, 2)
+            first_region, second_region = first.disconnect(), second.disconnect()
+            first.connect(second_region)
+            second.connect(first_region)
+            results = unreachable()
+            self.assertDictEqual(results, unreachable(clear_cache=True))
+        self.assertNotEqual(results, first_results)
+
+    def test_validation_searches(self):
+        # Searches kept between placements must reach what searches from scratch reach
+        settings = load_settings('plentiful.sav', seed='TESTTESTTEST')
+        resolve_settings(settings)
+        worlds = build_world_graphs(settings)
+        itempool = [item for world in worlds for item in world.get_itempool_with_dungeon_items()]
+        entrances = worlds[0].get_shufflable_entrances(type='Interior', only_primary=True)
+        target_entrances = assume_entrance_pool(entrances)
+        searches = ValidationSearches(worlds, itempool, entrances, target_entrances)
+        random.seed('validation searches')
+        for entrance in entrances:
+            target = random.choice([target for target in target_entrances if target.connected_region is not None])
+            change_connections(entrance, target)
+            searches.place(placed_connections(entrance))
+            expected_searches = ValidationSearches(worlds, itempool)
+            for name in ('max_explore', 'no_items', 'time_travel'):
+                search, expected = getattr(searches, name)(), getattr(expected_searches, name)()
+                for age in ('child', 'adult'):
+                    self.assertSetEqual(search.reachable_regions(age), expected.reachable_regions(age))
+                self.assertSetEqual(search._cache.visited_locations, expected._cache.visited_locations)
+            # Undo some placements, like replace_entrance does when a placement isn't valid
+            if random.random() < 0.25:
+                restore_connections(entrance, target)
+                searches.discard()
+            else:
+                searches.confirm()
+
+    def test_target_compatibility(self):
+        # Targets left out as incompatible must be the ones replace_entrance rejects
+        settings = load_settings('plentiful.sav', seed='TESTTESTTEST')
+        resolve_settings(settings)
+        worlds = build_world_graphs(settings)
+        itempool = [item for world in worlds for item in world.get_itempool_with_dungeon_items()]
+        entrances = [entrance for entrance_type in ('Interior', 'SpecialInterior', 'Overworld')
+                     for entrance in worlds[0].get_shufflable_entrances(type=entrance_type, only_primary=True)]
+        for entrance in entrances:
+            entrance.shuffled = entrance.reverse.shuffled = True
+        target_entrances = assume_entrance_pool(entrances)
+        searches = ValidationSearches(worlds, itempool, entrances, target_entrances)
+        compatibility = TargetCompatibility(target_entrances)
+        rollbacks = []
+        random.seed('target compatibility')
+        random.shuffle(entrances)
+        incompatible_count = 0
+        for entrance in entrances:
+            random.shuffle(target_entrances)
+            compatible = list(compatibility.compatible_targets(entrance, target_entrances, rollbacks, []))
+            for target in target_entrances:
+                if target.connected_region is not None and target not in compatible:
+                    incompatible_count += 1
+                    self.assertFalse(replace_entrance(worlds, entrance, target, rollbacks, (), itempool, searches=searches),
+                                     f'{entrance} replacing {target.replaces} was left out')
+            # Shuffling the pool starts over when an entrance can't be placed, which isn't needed here
+            if not any(replace_entrance(worlds, entrance, target, rollbacks, (), itempool, searches=searches) for target in compatible):
+                break
+        self.assertGreater(incompatible_count, 0)
+
+
+class TestSearch(unittest.TestCase):
+    def test_incremental_search(self):
+        # IncrementalSearch must reach exactly what Search reaches, sphere by sphere
+        for filename in ('entrance.sav', 'multiworld.sav'):
+            with self.subTest(filename):
+                settings = load_settings(filename, seed='TESTTESTTEST')
+                resolve_settings(settings)
+                for attempt in range(10):
+                    settings.reset_distribution()
+                    try:
+                        worlds = build_world_graphs(settings)
+                        place_items(worlds)
+                        break
+                    except ShuffleError:
+                        continue
+
+                searches = [Search([world.state for world in worlds]), IncrementalSearch([world.state for world in worlds])]
+                item_locations = searches[0].progression_locations()
+                collected = []
+                while True:
+                    spheres = [set(search.iter_reachable_locations(item_locations)) for search in searches]
+                    self.assertSetEqual(spheres[0], spheres[1])
+                    for age in ('child', 'adult'):
+                        self.assertSetEqual(searches[0].reachable_regions(age), searches[1].reachable_regions(age))
+                    if not spheres[0]:
+                        break
+                    for location in spheres[0]:
+                        collected.append(location.item)
+                        for search in searches:
+                            search.collect(location.item)
+
+                # Removing items, as fill_restrictive does, must wake the same spots
+                random.seed(filename)
+                for item in random.sample(collected, 10):
+                    max_searches = []
+                    for search in searches:
+                        search.uncollect(item)
+                        max_searches.append(search.copy())
+                        max_searches[-1].collect_locations()
+                    self.assertSetEqual(max_searches[0]._cache.visited_locations, max_searches[1]._cache.visited_locations)
+                    self.assertEqual(max_searches[0].can_beat_game(False), max_searches[1].can_beat_game(False))
+
+    def test_rule_dependencies(self):
+        settings = load_settings('plentiful.sav', seed='TESTTESTTEST')
+        resolve_settings(settings)
+        worlds = build_world_graphs(settings)
+        location = worlds[0].get_location('Bottom of the Well Back Left Bombable Chest')
+        dependencies = get_rule_dependencies(location.access_rule)
+        # The rule is has_explosives, a helper which checks for Bomb Bag among others
+        self.assertIn(ItemInfo.solver_ids['Bomb_Bag'], dependencies.solver_ids)
+        self.assertFalse(dependencies.dynamic)
+        self.assertNotIn(ItemInfo.solver_ids['Progressive_Hookshot'], dependencies.solver_ids)
+
+    def test_rule_dependency_index(self):
+        settings = load_settings('plentiful.sav', seed='TESTTESTTEST')
+        resolve_settings(settings)
+        worlds = build_world_graphs(settings)
+        world = worlds[0]
+        parser = world.parser
+        location = world.get_location('Bottom of the Well Back Left Bombable Chest')
+        # The rule is has_explosives, a helper which checks for Bomb Bag among others
+        self.assertIn(location, parser.get_dependents('has_explosives'))
+        self.assertIn(location, parser.get_dependents('Bomb Bag'))
+        self.assertNotIn(location, parser.dynamic_spots)
+        self.assertNotIn(location, parser.get_dependents('Progressive Hookshot'))
+        # Events are looked up by name like items
+        self.assertIn(world.get_entrance('Kakariko Village -> Bottom of the Well'), parser.get_dependents('Drain Well'))
+
+        # Rules added later are indexed too, including in place of an always rule
+        always_location = next(spot for spot in world.get_locations() if spot.always)
+        hookshot_rule = parser.parse_rule('Progressive_Hookshot')
+        for spot in (location, always_location):
+            spot.add_rule(hookshot_rule)
+            self.assertIn(spot, parser.get_dependents('Progressive Hookshot'))
+
+    def test_counted_event_dependencies(self):
+        settings = load_settings('plentiful.sav', seed='TESTTESTTEST')
+        resolve_settings(settings)
+        worlds = build_world_graphs(settings)
+        # An event counted before any rule created it must still be a dependency, or its spots are never woken
+        self.assertNotIn('Counted_Test_Event', ItemInfo.solver_ids)
+        dependencies = get_rule_dependencies(worlds[0].parser.parse_rule("('Counted Test Event', 2)"))
+        self.assertIn(ItemInfo.solver_ids['Counted_Test_Event'], dependencies.solver_ids)
+        self.assertFalse(dependencies.dynamic)
+
+
+# Result of a spot's access rule, or the error it raised
+def evaluate_rule(spot: Location | Entrance, search: Search, age: str) -> bool | type[Exception]:
+    try:
+        return bool(spot.access_rule(search.state_list[0], spot=spot, age=age))
+    except Exception as e:
+        return type(e)
+
+
+class TestRuleParser(unittest.TestCase):
+    # Checks that every access rule of the second world gives the same result as in the first one
+    def assert_same_rules(self, world: World, other_world: World) -> None:
+        random.seed('TESTTESTTEST')
+        item_names = [item.name for item in world.itempool if item.solver_id is not None]
+        for fraction in (0, 0.3, 0.7, 1):
+            collected = random.sample(item_names, int(len(item_names) * fraction))
+            searches = []
+            for w in (world, other_world):
+                state = State(w)
+                for name in collected:
+                    state.collect(ItemFactory(name, w))
+                searches.append(Search([state]))
+
+            # Entrance names aren't unique (savewarps)
+            spots = itertools.chain(world.get_locations(), world.get_entrances())
+            other_spots = itertools.chain(other_world.get_locations(), other_world.get_entrances())
+            for spot, other in itertools.zip_longest(spots, other_spots):
+                self.assertEqual(spot.name, other.name)
+                self.assertEqual((spot.never, spot.always), (other.never, other.always), spot.name)
+                for age in ('child', 'adult'):
+                    self.assertEqual(evaluate_rule(spot, searches[0], age), evaluate_rule(other, searches[1], age),
+                                     f'{spot.name} as {age}')
+
+    def test_tree_backend(self):
+        # Every rule in every logic file must give the same result with both backends
+        configs = [
+            {'mq_dungeons_mode': 'vanilla'},
+            {'mq_dungeons_mode': 'mq'},
+            {'logic_rules': 'glitched'},
+            {'enemizer': 'on', 'mq_dungeons_mode': 'vanilla'},
+            {'enemizer': 'on', 'mq_dungeons_mode': 'mq'},
+        ]
+        for config in configs:
+            with self.subTest(**config):
+                worlds = {}
+                for backend in ('lambda', 'tree'):
+                    settings = make_settings_for_test({**config, 'logic_rule_backend': backend}, seed='TESTTESTTEST')
+                    resolve_settings(settings)
+                    worlds[backend] = build_world_graphs(settings)[0]
+                self.assert_same_rules(worlds['lambda'], worlds['tree'])
+
+    def test_logic_cache(self):
+        # Rules loaded from the logic cache must be the same as freshly parsed ones,
+        # including for settings read by the parser (tricks, time of day access, ...)
+        configs = [
+            {},
+            {'allowed_tricks': ['logic_dc_jump', 'logic_lens_botw'], 'mq_dungeons_mode': 'mq'},
+            {'logic_rules': 'glitched'},
+        ]
+        for config in configs:
+            with self.subTest(**config):
+                worlds = {}
+                for logic_cache in (False, True, True):
+                    # Start from the files on disk, or from scratch.
+                    logic_files.clear()
+                    settings = make_settings_for_test({**config, 'logic_cache': logic_cache}, seed='TESTTESTTEST')
+                    resolve_settings(settings)
+                    worlds[logic_cache] = build_world_graphs(settings)[0]
+                for key in logic_files:
+                    self.assertTrue(os.path.isfile(os.path.join(cache_path(), key + '.pickle')))
+                self.assert_same_rules(worlds[False], worlds[True])
+
+    def test_shared_rules(self):
+        # Worlds with the same settings share the parsed rules of their logic files
+        settings = make_settings_for_test({'world_count': 3}, seed='TESTTESTTEST')
+        resolve_settings(settings)
+        worlds = build_world_graphs(settings)
+        for spots in zip(*(itertools.chain(world.get_locations(), world.get_entrances()) for world in worlds)):
+            if spots[0].rule_string is None:
+                continue
+            self.assertEqual(len({spot.name for spot in spots}), 1)
+            self.assertEqual(len({id(spot.access_rules[0]) for spot in spots}), 1, spots[0].name)
+            self.assertEqual(len({spot.world.id for spot in spots}), len(worlds))
+
+    def test_rule_profiler(self):
+        # Profiled rules give the same results and keep their dependencies
+        worlds = []
+        for profile in (False, True):
+            profiler = start_rule_profiler() if profile else None
+            try:
+                settings = make_settings_for_test({}, seed='TESTTESTTEST')
+                resolve_settings(settings)
+                worlds.append(build_world_graphs(settings)[0])
+            finally:
+                stop_rule_profiler()
+        for spot, other in zip(itertools.chain(worlds[0].get_locations(), worlds[0].get_entrances()),
+                               itertools.chain(worlds[1].get_locations(), worlds[1].get_entrances())):
+            self.assertEqual(rule_dependencies(spot.access_rule), rule_dependencies(other.access_rule), spot.name)
+        self.assert_same_rules(*worlds)
+
+        spots = profiler.by_spot()
+        self.assertGreater(spots['Kokiri Forest -> KF Outside Deku Tree'].calls, 0)
+        self.assertLessEqual(spots['Kokiri Forest -> KF Outside Deku Tree'].true, spots['Kokiri Forest -> KF Outside Deku Tree'].calls)
+        self.assertEqual(sum(stats.calls for stats in spots.values()), sum(stats.calls for stats in profiler.by_rule().values()))
+        self.assertIn('can_use', profiler.by_helper())
+        self.assertIn('Logic helpers by time:', profiler.report())
+
 
 class TestValidSpoilers(unittest.TestCase):
     # Normalizes spoiler dict for single world or multiple worlds
@@ -871,6 +1251,348 @@ class TestValidSpoilers(unittest.TestCase):
                     raise
 
 
+class TestParallelGeneration(unittest.TestCase):
+    def test_batch_matches_serial(self):
+        spoilers = {}
+        for workers in (1, 2):
+            settings = make_settings_for_test({'output_dir': output_dir}, seed='TESTBATCH')
+            settings.count = 3
+            settings.output_file = ''
+            results = main_batch(settings, workers=workers)
+            self.assertEqual([result.seed for result in results], ['TESTBATCH-0', 'TESTBATCH-1', 'TESTBATCH-2'])
+            for result in results:
+                self.assertIsNone(result.error)
+                self.assertGreaterEqual(result.attempts, 1)
+                self.assertLessEqual({'resolve', 'generate', 'output', 'build_world_graphs', 'distribute_items'}, result.times.keys())
+            spoilers[workers] = [load_spoiler(os.path.join(output_dir, filename))
+                                 for result in results for filename in os.listdir(output_dir)
+                                 if filename.endswith(f'_{result.seed}_Spoiler.json')]
+            self.assertEqual(len(spoilers[workers]), 3)
+        self.assertEqual(spoilers[1], spoilers[2])
+
+    def test_speculative_attempts(self):
+        # An attempt that succeeds right away is generated exactly like a sequential one
+        spoilers = []
+        for attempt_workers in (1, 3):
+            settings = load_settings('plentiful.sav', seed='TESTTESTTEST')
+            settings.attempt_workers = attempt_workers
+            result = SeedResult(settings.seed)
+            main(settings, result=result)
+            self.assertEqual(result.attempts, 1)
+            spoilers.append(load_spoiler('%s_Spoiler.json' % settings.output_file))
+        self.assertEqual(spoilers[0], spoilers[1])
+
+        # Every failed attempt is reported
+        distribution_file = load_spoiler(os.path.join(test_dir, 'plando', 'plando-fix-broken-drops-bad.json'))
+        settings = load_settings(distribution_file['settings'], seed='TESTTESTTEST', filename='plando-fix-broken-drops-bad')
+        settings.attempt_workers = 2
+        result = SeedResult(settings.seed)
+        self.assertRaises(ShuffleError, main, settings, 3, None, result)
+        self.assertEqual(result.attempts, 3)
+
+        generate_attempt = Main.generate_attempt
+
+        # A retried attempt comes out the same with or without workers, attempt 1 only runs in this process
+        def fail_first_attempt(settings, rng_state, attempt):
+            if attempt == 1:
+                raise ShuffleError('Attempt 1 failed')
+            return generate_attempt(settings, rng_state, attempt)
+
+        spoilers = []
+        for attempt_workers in (1, 3):
+            settings = load_settings('plentiful.sav', seed='TESTTESTTEST')
+            settings.attempt_workers = attempt_workers
+            result = SeedResult(settings.seed)
+            with unittest.mock.patch('Main.generate_attempt', fail_first_attempt):
+                main(settings, 3, None, result)
+            self.assertEqual(result.attempts, 2)
+            spoilers.append(load_spoiler('%s_Spoiler.json' % settings.output_file))
+        self.assertEqual(spoilers[0], spoilers[1])
+
+        # An attempt that succeeded in a worker but fails when generated here moves on to the next one
+        main_pid = os.getpid()
+
+        def fail_in_main_process(settings, rng_state, attempt):
+            if os.getpid() == main_pid and attempt < 3:
+                raise ShuffleError(f'Attempt {attempt} failed in the main process')
+            return generate_attempt(settings, rng_state, attempt)
+
+        settings = load_settings('plentiful.sav', seed='TESTTESTTEST')
+        settings.attempt_workers = 3
+        result = SeedResult(settings.seed)
+        with unittest.mock.patch('Main.generate_attempt', fail_in_main_process):
+            main(settings, 3, None, result)
+        self.assertEqual(result.attempts, 3)
+
+        # Other errors of a worker are returned for this process to log
+        def crash(settings, rng_state, attempt):
+            raise RuntimeError('Worker crashed')
+
+        with unittest.mock.patch('Main.generate_attempt', crash):
+            outcome = Main.try_attempt(pickle.dumps(settings), random.getstate(), 2)
+        self.assertIsInstance(outcome, str)
+        self.assertIn('RuntimeError: Worker crashed', outcome)
+
+
+class TestMetrics(unittest.TestCase):
+    def test_generation_metrics(self):
+        settings = load_settings('plentiful.sav', seed='TESTTESTTEST')
+        settings.output_metrics = True
+        spoiler = main(settings)
+        metrics = spoiler.metrics.to_json()
+        for name in ('resolve', 'generate', 'output', 'build_world_graphs', 'distribute_items', 'create_playthrough', 'build_gossip_hints'):
+            self.assertIn(name, metrics['phases'])
+            self.assertGreaterEqual(metrics['phases'][name]['calls'], 1)
+        for name in ('rule_evaluations', 'searches', 'search_copies', 'state_copies'):
+            self.assertGreater(metrics['counters'][name], 0)
+        # nested phases are part of the phase around them
+        phases = metrics['phases']
+        self.assertLessEqual(phases['distribute_items']['counters']['rule_evaluations'], phases['generate']['counters']['rule_evaluations'])
+        self.assertLessEqual(phases['generate']['counters']['rule_evaluations'], metrics['counters']['rule_evaluations'])
+
+        with open('%s_Metrics.json' % settings.output_file) as f:
+            self.assertEqual(json.load(f).keys(), metrics.keys())
+
+
+class TestBenchmark(unittest.TestCase):
+    def test_compare_results(self):
+        def case(cpu_time: float, rule_evaluations: int, attempts: int = 1) -> dict[str, Any]:
+            return {'attempts': attempts, 'peak_rss': 100 << 20, 'cpu_time': cpu_time, 'wall_time': cpu_time,
+                    'counters': {'rule_evaluations': rule_evaluations, 'searches': 10},
+                    'phases': {'distribute_items': {'cpu_time': cpu_time / 2, 'wall_time': cpu_time / 2}}}
+        baseline = baseline_results({'version': 'test', 'cases': {'a': case(10, 1000), 'b': case(10, 1000)}})
+        # only what is the same on every machine is kept
+        self.assertEqual(baseline['cases']['a'], {'attempts': 1, 'counters': {'rule_evaluations': 1000, 'searches': 10}})
+        tolerances = Tolerances(counters=0.05)
+
+        # fewer evaluations, or more within the tolerance, times are only reported
+        self.assertEqual(compare_results({'cases': {'a': case(50, 900), 'b': case(1, 1040)}}, baseline, tolerances), [])
+        regressions = compare_results({'cases': {'a': case(10, 1100, attempts=2), 'd': case(100, 10 ** 6),
+                                                 'b': {'attempts': 10, 'error': 'ShuffleError: Game unbeatable'}}}, baseline, tolerances)
+        self.assertEqual(len(regressions), 3)
+        self.assertTrue(all(regression.startswith(('a:', 'b:')) for regression in regressions))
+
+    def test_time_crc(self):
+        timings = time_crc(repeat=1)
+        self.assertIn('python', timings)
+        self.assertTrue(all(best > 0 for best in timings.values()))
+
+
+class TestRom(unittest.TestCase):
+    # A random rom with a small dma table: the two files before it, the table itself and three files
+    def make_rom(self, rng: random.Random) -> Rom:
+        data = bytearray(rng.randbytes(0x4000000))
+        files = [(0, 0x1060), (0x1060, 0x7430), (0x7430, 0x74B0), (0x10000, 0x20000), (0x20000, 0x38000), (0x40000, 0x41000)]
+        for index in range(8):
+            start, end = files[index] if index < len(files) else (0, 0)
+            data[0x7430 + index * 0x10:0x7440 + index * 0x10] = struct.pack('>IIII', start, end, start, 0)
+        rom = Rom()
+        rom.buffer = RomBuffer(bytes(data))
+        rom.original = rom.copy()
+        return rom
+
+    def test_matches_bytearray(self):
+        rng = random.Random(1)
+        for trial in range(20):
+            base = rng.randbytes(rng.randint(1, 5 * ROM_PAGE_SIZE))
+            buffer, expected = RomBuffer(base), bytearray(base)
+            copies = []
+            for _ in range(50):
+                start = rng.randrange(len(expected))
+                end = min(len(expected), start + rng.randint(0, 3 * ROM_PAGE_SIZE))
+                operation = rng.randrange(5)
+                if operation == 0:
+                    data = rng.randbytes(end - start)
+                    buffer[start:end] = data
+                    expected[start:end] = data
+                elif operation == 1:
+                    buffer[start] = expected[start] = rng.getrandbits(8)
+                elif operation == 2:
+                    data = rng.randbytes(rng.randint(0, 100))
+                    buffer.extend(data)
+                    expected.extend(data)
+                elif operation == 3:
+                    size = rng.randint(1, len(expected) + 2 * ROM_PAGE_SIZE)
+                    buffer.resize(size)
+                    expected[size:] = bytes(max(size - len(expected), 0))
+                else:
+                    copies.append((copy.copy(buffer), bytes(expected)))
+                self.assertEqual(buffer[start:end], expected[start:end])
+                self.assertEqual(buffer[-1], expected[-1])
+                self.assertEqual(len(buffer), len(expected))
+            self.assertEqual(bytes(buffer), expected)
+            for buffer_copy, copy_expected in copies:
+                self.assertEqual(bytes(buffer_copy), copy_expected)
+                # every difference is in a page reported as changed
+                pages = set(buffer.changed_pages(buffer_copy))
+                for address in range(max(len(expected), len(copy_expected))):
+                    if expected[address:address + 1] != copy_expected[address:address + 1]:
+                        self.assertIn(address - address % ROM_PAGE_SIZE, pages)
+
+    def test_address_ranges(self):
+        rng = random.Random(3)
+        ranges, expected = AddressRanges(), set()
+        for i in range(5000):
+            start = rng.randrange(100000)
+            end = start + rng.randint(0, 40)
+            ranges.add(start, end)
+            expected.update(range(start, end))
+            if i % 500 == 0:
+                address = rng.randrange(100000)
+                self.assertEqual(address in ranges, address in expected)
+        self.assertEqual(list(ranges.addresses()), sorted(expected))
+        # merged ranges neither overlap nor touch
+        self.assertTrue(all(end < next_start for (_, end), (next_start, _) in zip(ranges, list(ranges)[1:])))
+
+    def test_patch_file(self):
+        rng = random.Random(4)
+        rom = self.make_rom(rng)
+        for _ in range(1000):
+            address = rng.randrange(0x8000, 0x3000000)
+            rom.write_bytes(address, rng.randbytes(rng.choice([1, 4, 300])))
+        rom.write_int32s(0x500000, [rng.getrandbits(32) for _ in range(100)])
+        # a block of 0s longer than a patch block section
+        rom.write_bytes(0x600000, bytes(0x18000))
+        # move a file
+        rom.write_int32s(0x7480, [0x50000, 0x51000, 0x50000, 0])
+        rom.write_bytes(0x50000, rom.original.read_bytes(0x40000, 0x1000))
+        rom.scan_dmadata_update(assume_move=True)
+
+        path = os.path.join(output_dir, 'test_patch_file.zpf')
+        create_patch_file(rom, path)
+        patched_rom = rom.original.copy()
+        patched_rom.original = rom.original
+        apply_patch_file(patched_rom, Settings({'patch_file': path, 'repatch_cosmetics': False}))
+        self.assertEqual(bytes(patched_rom.buffer), bytes(rom.buffer))
+
+        # the same patch as a member of a patch archive in memory
+        archive = io.BytesIO()
+        with zipfile.ZipFile(archive, mode='w') as patch_archive:
+            patch_archive.write(path, 'P2.zpf', compress_type=zipfile.ZIP_DEFLATED)
+        os.remove(path)
+        patched_rom = rom.original.copy()
+        patched_rom.original = rom.original
+        apply_patch_archive(patched_rom, archive, 'P2.zpf')
+        self.assertEqual(bytes(patched_rom.buffer), bytes(rom.buffer))
+        with self.assertRaises(FileNotFoundError):
+            apply_patch_archive(patched_rom, archive, 'P3.zpf')
+
+    def test_rom_changes(self):
+        rng = random.Random(2)
+        rom = Rom()
+        rom.buffer = RomBuffer(rng.randbytes(64 * ROM_PAGE_SIZE))
+        rom.original = rom.copy()
+        for _ in range(200):
+            address = rng.randrange(len(rom.buffer) - 16)
+            rom.write_bytes(address, rng.randbytes(rng.randint(1, 16)))
+        rom.buffer[0:4] = rom.original.buffer[4:8]
+        expected = [address for address, byte in enumerate(rom.buffer) if byte != rom.original.buffer[address]]
+        rom.rescan_changed_bytes()
+        self.assertEqual(list(rom.changed_ranges.addresses()), expected)
+        self.assertEqual(len(rom.original.buffer.pages), 0)
+
+        rom.restore()
+        self.assertEqual(bytes(rom.buffer[0x40:]), bytes(rom.original.buffer[0x40:]))
+        self.assertLessEqual(len(rom.buffer.pages), 1)
+
+        path = os.path.join(output_dir, 'rom_buffer.bin')
+        with open(path, 'wb') as f:
+            f.write(bytes(rom.buffer))
+        mapped = RomBuffer.map_file(path)
+        self.assertEqual(bytes(mapped), bytes(rom.buffer))
+        mapped[5] = 0
+        self.assertEqual(mapped[5], 0)
+        del mapped
+        os.remove(path)
+
+    def test_minibsdiff_patch(self):
+        rng = random.Random(5)
+        rom = Rom()
+        rom.buffer = RomBuffer(rng.randbytes(3 * ROM_PAGE_SIZE))
+        rom.original = rom.copy()
+        # (diff size, extra size, old seek); the second diff block runs past the end of the original
+        controls = [(0x1800, 0x10, -0x400), (0x2000, 0x300, 0x1000), (0x1500, 0x200, 0)]
+        new_size = sum(diff_size + extra_size for diff_size, extra_size, _ in controls)
+        expected, diff_data, extra_data = bytearray(), bytearray(), bytearray()
+        old_pos = 0
+        for diff_size, extra_size, seek in controls:
+            diff = rng.choice([bytes(diff_size), rng.randbytes(diff_size)])
+            for i, byte in enumerate(diff):
+                old_byte = rom.original.buffer[old_pos + i] if 0 <= old_pos + i < len(rom.original.buffer) else 0
+                expected.append((old_byte + byte) & 0xFF)
+            extra = rng.randbytes(extra_size)
+            expected += extra
+            diff_data += diff
+            extra_data += extra
+            old_pos += diff_size + seek
+
+        def int64(value: int) -> bytes:
+            return (abs(value) | (0x8000000000000000 if value < 0 else 0)).to_bytes(8, 'little')
+        control_data = b''.join(map(int64, itertools.chain.from_iterable(controls)))
+        path = os.path.join(output_dir, 'test_minibsdiff.patch')
+        with gzip.open(path, 'wb') as f:
+            f.write(b'MBSDIF43' + int64(len(control_data)) + int64(len(diff_data)) + int64(new_size) + control_data + diff_data + extra_data)
+        apply_minibsdiff_patch_file(rom, path)
+        os.remove(path)
+        self.assertEqual(bytes(rom.buffer), bytes(expected))
+        expected_changes = [address for address, byte in enumerate(expected) if address >= len(rom.original.buffer) or byte != rom.original.buffer[address]]
+        self.assertEqual(list(rom.changed_ranges.addresses()), expected_changes)
+
+    def test_yaz0(self):
+        # compressed by bin/Compress
+        data = bytes(range(8)) * 40 + bytes(100)
+        expected = '59617a30000001a40000000000000000ff0001020304050607000007ff01171600005100000000000000000000000000'
+        self.assertEqual(yaz0_compress(data).hex(), expected)
+        rng = random.Random(6)
+        pieces = [rng.randbytes(rng.randint(1, 30)) for _ in range(10)] + [bytes(300)]
+        for size in (0, 1, 2, 3, 0x1000, 0x5000):
+            data = b''.join(rng.choice(pieces) for _ in range(size))[:size]
+            self.assertEqual(yaz0_decompress(yaz0_compress(data), len(data)), data)
+
+        # a rom with a full size dma table, as dmaTable.dat expects
+        rom = bytearray(rng.randbytes(0x7430)) + bytes(0x4000000 - 0x7430)
+        entries = [(0, 0x1060), (0x1060, 0x7430), (0x7430, 0x7430 + 1540 * 0x10)]
+        for index in range(3, 1540):
+            start = 0x10000 + index * 0x100
+            size = rng.choice([0, 0x10, 0xF0])
+            rom[start:start + size] = b''.join(rng.choice(pieces) for _ in range(size))[:size]
+            entries.append((start, start + size))
+        for index, (start, end) in enumerate(entries):
+            struct.pack_into('>IIII', rom, 0x7430 + index * 0x10, start, end, start, 0)
+        cache_dir = os.path.join(output_dir, 'yaz0_cache')
+        shutil.rmtree(cache_dir, ignore_errors=True)
+        compressed_files.clear()
+        self.assertFalse(has_compressed_files(cache_dir))
+        compressed = compress_rom_data(rom, workers=1, cache_dir=cache_dir)
+        self.assertEqual(len(compressed), 0x2000000)
+        decompressed = decompress_rom_data(compressed)
+        self.assertEqual(decompressed[0x18:], rom[0x18:])
+
+        # the cache on disk has every distinct compressed file, and only a changed file is added
+        cached_count = len(os.listdir(cache_dir))
+        compressed_files.clear()
+        self.assertTrue(has_compressed_files(cache_dir))
+        self.assertFalse(has_compressed_files())
+        self.assertEqual(compress_rom_data(rom, workers=1, cache_dir=cache_dir), compressed)
+        self.assertEqual(len(os.listdir(cache_dir)), cached_count)
+        rom[entries[-2][0]] ^= 0xFF
+        compressed_files.clear()
+        self.assertEqual(decompress_rom_data(compress_rom_data(rom, workers=1, cache_dir=cache_dir))[0x18:], rom[0x18:])
+        self.assertEqual(len(os.listdir(cache_dir)), cached_count + 1)
+        shutil.rmtree(cache_dir)
+
+    def test_crc(self):
+        streams = [BigStream(bytearray(random.Random(0).randbytes(0x101000))), BigStream(bytearray(0x101000))]
+        expected = ['7f2a58983b5dafca', 'df26f436df26f436']
+        for stream, crc_hex in zip(streams, expected):
+            words = struct.unpack('>262144I', stream.read_bytes(0x1000, 0x100000))
+            words2 = struct.unpack('>64I', stream.read_bytes(0x750, 0x100))
+            self.assertEqual(crc.crc_python(words, words2).hex(), crc_hex)
+            if crc.numpy is not None:
+                self.assertEqual(crc.crc_numpy(words, words2).hex(), crc_hex)
+            self.assertEqual(crc.calculate_crc(stream).hex(), crc_hex)
+
+
 class TestTextShuffle(unittest.TestCase):
     def test_text_shuffle(self):
         if not os.path.isfile('./ZOOTDEC.z64'):
@@ -12,21 +12,23 @@ from Dungeon import Dungeon
 from Entrance import Entrance
 from Goals import Goal, GoalCategory
 from HintList import get_required_hints, misc_item_hint_table, misc_location_hint_table
-from Hints import HintArea, hint_dist_keys, hint_dist_files
+from Hints import HintArea, HintAreaNotFound, hint_dist_keys, hint_dist_files
 from Item import Item, ItemFactory, ItemInfo, make_event_item
 from ItemList import REWARD_COLORS
 from ItemPool import reward_list
 from Location import Location, LocationFactory
+from LogicCache import cache_path, load_logic_file
 from LocationList import business_scrubs, location_groups, location_table
 from OcarinaSongs import generate_song_list, Song
 from Plandomizer import WorldDistribution, InvalidFileException
 from Region import Region, TimeOfDay
 from RuleParser import Rule_AST_Transformer
+from RulesCommon import AccessRule
 from Settings import Settings
 from SettingsList import SettingInfos, get_settings_from_section
 from Spoiler import Spoiler
 from State import State
-from Utils import data_path, read_logic_file
+from Utils import data_path
 from Boulders import BOULDER_TYPE
 
 class World:
@@ -39,6 +41,13 @@ class World:
         self._entrance_cache: dict[str, Entrance] = {}
         self._region_cache: dict[str, Region] = {}
         self._location_cache: dict[str, Location] = {}
+        # HintArea.at results by region name and use_alt_hint, and the results each region's entrances were searched for
+        self.hint_area_cache: dict[tuple[str, bool], HintArea] = {}
+        self.hint_area_dependents: defaultdict[str, set[tuple[str, bool]]] = defaultdict(set)
+        # entrance_unreachable_as results by entrance, age and entrances not to check, with the regions whose entrances
+        # they checked, and the results each region's entrances were checked for
+        self.unreachable_as_cache: dict[tuple[Entrance, str, frozenset[Entrance]], tuple[bool, set[Region]]] = {}
+        self.unreachable_as_dependents: defaultdict[str, set[tuple[Entrance, str, frozenset[Entrance]]]] = defaultdict(set)
         self.shop_prices: dict[str, int] = {}
         self.scrub_prices: dict[int, int] = {}
         self.maximum_wallets: int = 0
@@ -270,6 +279,9 @@ class World:
         self.misc_hint_items: dict[str, str] = {hint_type: self.hint_dist_user.get('misc_hint_items', {}).get(hint_type, data['default_item']) for hint_type, data in misc_item_hint_table.items()}
         self.misc_hint_locations: dict[str, str] = {hint_type: self.hint_dist_user.get('misc_hint_locations', {}).get(hint_type, data['item_location']) for hint_type, data in misc_location_hint_table.items()}
 
+        # Rules used by State helpers, parsed once per world rather than for every State.
+        self.can_blast_or_smash_rule: AccessRule = self.parser.parse_rule('can_blast_or_smash')
+        self.blue_fire_rule: AccessRule = self.parser.parse_rule('Blue_Fire')
         self.state: State = State(self)
 
         # Allows us to cut down on checking whether some items are required
@@ -304,13 +316,10 @@ class World:
         self.available_tokens: int = 100
 
         # Disable goal hints if the hint distro does not require them.
-        # WOTH locations are always searched.
-        self.enable_goal_hints: bool = False
-        if ('distribution' in self.hint_dist_user and
-                'goal' in self.hint_dist_user['distribution'] and
-                (self.hint_dist_user['distribution']['goal']['fixed'] != 0 or
-                 self.hint_dist_user['distribution']['goal']['weight'] != 0)):
-            self.enable_goal_hints = True
+        self.enable_goal_hints: bool = self.hint_type_enabled('goal')
+        # WOTH locations are only searched for the hints that use them, or for the spoiler log.
+        # Barren hints leave out areas with WOTH items, and goal hints can fall back to WOTH.
+        self.enable_woth_hints: bool = self.enable_goal_hints or self.hint_type_enabled('woth') or self.hint_type_enabled('barren')
 
         # Initialize default goals for win condition
         self.goal_categories: dict[str, GoalCategory] = OrderedDict()
@@ -374,6 +383,12 @@ class World:
         self.locked_goal_categories: dict[str, GoalCategory] = {name: category for (name, category) in self.goal_categories.items() if category.lock_entrances}
         self.unlocked_goal_categories: dict[str, GoalCategory] = {name: category for (name, category) in self.goal_categories.items() if not category.lock_entrances}
 
+    def hint_type_enabled(self, hint_type: str) -> bool:
+        return ('distribution' in self.hint_dist_user and
+                hint_type in self.hint_dist_user['distribution'] and
+                (self.hint_dist_user['distribution'][hint_type]['fixed'] != 0 or
+                 self.hint_dist_user['distribution'][hint_type]['weight'] != 0))
+
     def copy(self) -> World:
         new_world = World(self.id, self.settings, False)
 
@@ -587,10 +602,11 @@ class World:
             self.settings.silver_rupee_pouches = self.silver_rupee_puzzles()
 
     def load_regions_from_json(self, file_path: str) -> list[tuple[Entrance, str]]:
-        region_json = read_logic_file(file_path)
+        logic_file = load_logic_file(file_path, self)
         savewarps_to_connect = []
 
-        for region in region_json:
+        self.parser.logic_file = logic_file
+        for region in logic_file.regions:
             if 'scene' not in region and 'dungeon' not in region:
                 print(region['region_name'])
             new_region = Region(self, region['region_name'])
@@ -652,6 +668,10 @@ class World:
                 # the replaced entrance may not exist yet so we connect it after all region files have been read
                 savewarps_to_connect.append((new_exit, region['savewarp']))
             self.regions.append(new_region)
+        self.parser.logic_file = None
+
+        if logic_file.changed and self.settings.logic_cache:
+            logic_file.save(cache_path())
         return savewarps_to_connect
 
     def create_dungeons(self) -> list[tuple[Entrance, str]]:
@@ -1256,6 +1276,27 @@ class World:
     def get_shuffled_entrances(self, type=None, only_primary=False) -> list[Entrance]:
         return [entrance for entrance in self.get_shufflable_entrances(type=type, only_primary=only_primary) if entrance.shuffled]
 
+    # Forgets the hint areas that were found by searching through the entrances into the region,
+    # called when an entrance is connected to or disconnected from it.
+    def invalidate_hint_areas(self, region: Region) -> None:
+        for key in self.hint_area_dependents.pop(region.name, ()):
+            self.hint_area_cache.pop(key, None)
+
+    # Forgets the entrance_unreachable_as results that checked the entrances into the region,
+    # called when an entrance is connected to or disconnected from it.
+    def invalidate_unreachable_as(self, region: Region) -> None:
+        for key in self.unreachable_as_dependents.pop(region.name, ()):
+            self.unreachable_as_cache.pop(key, None)
+
+    # Finds the hint area of every region at once, for when many of them are about to be looked up
+    # and the entrances won't change anymore.
+    def resolve_hint_areas(self) -> None:
+        for region in self.regions:
+            try:
+                HintArea.at(region)
+            except HintAreaNotFound:
+                pass
+
     def region_has_shortcuts(self, region_name: str) -> bool:
         region = self.get_region(region_name)
         dungeon_name = HintArea.at(region).dungeon_name
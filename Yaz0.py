@@ -0,0 +1,322 @@
+from __future__ import annotations
+import hashlib
+import logging
+import os
+import struct
+from concurrent.futures import ProcessPoolExecutor
+from typing import Optional
+
+from Utils import local_path
+from crc import calculate_crc
+from ntype import BigStream
+
+# In process versions of bin/Compress and bin/Decompress. The encoder makes the
+# same choices as bin/Compress, so the compressed roms are byte-identical.
+
+YAZ0_HEADER_SIZE: int = 0x10
+MAX_DISTANCE: int = 0x1000
+MAX_MATCH: int = 0x111
+
+COMPRESSED_ROM_SIZE: int = 0x2000000
+DECOMPRESSED_ROM_SIZE: int = 0x4000000
+
+# Version of the encoder output in the compressed file cache, and the size it is pruned at
+CACHE_VERSION: int = 1
+CACHE_SIZE: int = 0x10000000
+
+# Compressed files of the last compressed rom by the sha1 of their decompressed bytes
+compressed_files: dict[bytes, bytes] = {}
+
+
+# Finds the longest match for data[position:] in the 0x1000 bytes before it,
+# the first one of the longest. Returns (size, match position).
+def find_match(data: bytes, position: int) -> tuple[int, int]:
+    max_size = min(len(data) - position, MAX_MATCH)
+    if max_size < 3:
+        return 0, 0
+    window_start = max(position - MAX_DISTANCE, 0)
+    best_size = best_position = 0
+    size = 3
+    while True:
+        # the first match that is at least one byte longer than the best so far
+        match = data.find(data[position:position + size], window_start, position + size - 1)
+        if match < 0:
+            break
+        # extend it as far as possible
+        if data[match:match + max_size] == data[position:position + max_size]:
+            size = max_size
+        else:
+            while data[match + size] == data[position + size]:
+                size += 1
+        best_size, best_position = size, match
+        if best_size == max_size:
+            break
+        size = best_size + 1
+        window_start = match + 1
+    return best_size, best_position
+
+
+def yaz0_compress(data: bytes) -> bytes:
+    data = bytes(data)
+    size = len(data)
+    output = bytearray(b'Yaz0' + size.to_bytes(4, 'big') + bytes(8))
+    code_byte_position = len(output)
+    output.append(0)
+    code_byte = 0
+    bitmask = 0x80
+    position = 0
+    lookahead: Optional[tuple[int, int]] = None
+    while position < size:
+        if lookahead is not None:
+            match_size, match_position = lookahead
+            lookahead = None
+        else:
+            match_size, match_position = find_match(data, position)
+            if match_size >= 3:
+                # use a single byte if that allows a much longer match at the next byte
+                next_size, next_position = find_match(data, position + 1)
+                if next_size >= match_size + 2:
+                    match_size = 1
+                    lookahead = next_size, next_position
+
+        if match_size < 3:
+            output.append(data[position])
+            position += 1
+            code_byte |= bitmask
+        else:
+            distance = position - match_position - 1
+            if match_size > 0x11:
+                output += bytes((distance >> 8, distance & 0xFF, match_size - 0x12))
+            else:
+                output += bytes((((match_size - 2) << 4) | (distance >> 8), distance & 0xFF))
+            position += match_size
+
+        bitmask >>= 1
+        if bitmask == 0:
+            output[code_byte_position] = code_byte
+            code_byte_position = len(output)
+            if position < size:
+                output.append(0)
+            code_byte = 0
+            bitmask = 0x80
+
+    if code_byte_position < len(output):
+        output[code_byte_position] = code_byte
+    # the compressed data is padded to a multiple of 0x10 bytes
+    output += bytes(-len(output) % 0x10)
+    return bytes(output)
+
+
+def yaz0_decompress(data: bytes, size: int) -> bytearray:
+    output = bytearray()
+    position = YAZ0_HEADER_SIZE
+    while len(output) < size:
+        code_byte = data[position]
+        position += 1
+        if code_byte == 0xFF:
+            # eight single bytes
+            output += data[position:position + 8]
+            position += 8
+            continue
+        for bit in range(7, -1, -1):
+            if len(output) >= size:
+                break
+            if code_byte & (1 << bit):
+                output.append(data[position])
+                position += 1
+                continue
+            byte1, byte2 = data[position], data[position + 1]
+            position += 2
+            copy_position = len(output) - (((byte1 & 0xF) << 8) | byte2) - 1
+            copy_size = byte1 >> 4
+            if copy_size:
+                copy_size += 2
+            else:
+                copy_size = data[position] + 0x12
+                position += 1
+            copied = output[copy_position:copy_position + copy_size]
+            if len(copied) < copy_size:
+                # the copy overlaps the bytes it writes, which repeats them
+                copied = (copied * (copy_size // len(copied) + 1))[:copy_size]
+            output += copied
+    # a last group of single bytes can run past the end of the file
+    del output[size:]
+    return output
+
+
+def compression_cache_path() -> str:
+    return local_path(os.path.join('Cache', f'Yaz0-{CACHE_VERSION}'))
+
+
+# Whether compressed files are kept from a previous rom of this process or in the cache directory.
+def has_compressed_files(cache_dir: Optional[str] = None) -> bool:
+    if compressed_files:
+        return True
+    if cache_dir is None:
+        return False
+    try:
+        with os.scandir(cache_dir) as entries:
+            return any(entry.name.endswith('.yaz0') for entry in entries)
+    except OSError:
+        return False
+
+
+def load_cached_file(cache_dir: str, key: bytes, size: int) -> Optional[bytes]:
+    path = os.path.join(cache_dir, key.hex() + '.yaz0')
+    try:
+        with open(path, 'rb') as f:
+            compressed = f.read()
+        # mark it as used for the pruning
+        os.utime(path)
+    except OSError:
+        return None
+    # a partial or foreign file is compressed again
+    if compressed[:4] != b'Yaz0' or int.from_bytes(compressed[4:8], 'big') != size or len(compressed) % 0x10:
+        return None
+    return compressed
+
+
+def save_cached_files(cache_dir: str, files: dict[bytes, bytes]) -> None:
+    try:
+        os.makedirs(cache_dir, exist_ok=True)
+        for key, compressed in files.items():
+            path = os.path.join(cache_dir, key.hex() + '.yaz0')
+            # Write to a temporary file first so other processes never read a partial file
+            temp_path = f'{path}.{os.getpid()}.tmp'
+            with open(temp_path, 'wb') as f:
+                f.write(compressed)
+            os.replace(temp_path, path)
+        prune_cache(cache_dir)
+    except OSError as e:
+        logging.getLogger('').warning('Unable to write compressed file cache %s: %s', cache_dir, e)
+
+
+# Removes the least recently used files when the cache grows past CACHE_SIZE.
+def prune_cache(cache_dir: str) -> None:
+    files = [(entry.stat().st_mtime, entry.stat().st_size, entry.path) for entry in os.scandir(cache_dir) if entry.name.endswith('.yaz0')]
+    total = sum(size for _, size, _ in files)
+    if total <= CACHE_SIZE:
+        return
+    for _, size, path in sorted(files):
+        try:
+            os.remove(path)
+        except FileNotFoundError:
+            pass
+        total -= size
+        if total <= CACHE_SIZE // 2:
+            break
+
+
+# DMA table entries as (virtual start, virtual end, physical start, physical end)
+def dma_entries(data: bytes) -> tuple[int, list[tuple[int, int, int, int]]]:
+    # the table starts with the entry of the makerom, the first file
+    dma_start = 0x1060
+    while data[dma_start:dma_start + 8] != b'\x00\x00\x00\x00\x00\x00\x10\x60':
+        dma_start += 4
+        if dma_start + 8 > len(data):
+            raise Exception("Couldn't find the DMA table in the ROM.")
+    # the third file is the DMA table itself
+    table_start, table_end = struct.unpack_from('>II', data, dma_start + 0x20)
+    entries = [struct.unpack_from('>IIII', data, dma_start + index * 0x10) for index in range((table_end - table_start) // 0x10)]
+    return dma_start, entries
+
+
+# The files bin/Compress leaves uncompressed, and the ones that are removed from the rom
+def read_exclusions(entry_count: int) -> tuple[set[int], set[int]]:
+    # bin/Compress never compresses the last file either, its exclusion list is one entry short
+    uncompressed, removed = {0, 1, 2, entry_count - 1}, set()
+    with open(local_path('dmaTable.dat'), 'r') as f:
+        for value in map(int, f.read().split()):
+            if value > entry_count - 1 or value < -(entry_count - 1):
+                raise Exception(f"Entry {value} in dmaTable.dat is out of bounds.")
+            if value < 0:
+                removed.add(-value)
+            else:
+                uncompressed.add(value)
+    return uncompressed, removed
+
+
+# With a cache_dir, compressed files are kept on disk by the hash of their bytes, across roms and processes.
+def compress_rom_data(data: bytes, workers: Optional[int] = None, cache_dir: Optional[str] = None) -> bytearray:
+    data = bytes(data)
+    dma_start, entries = dma_entries(data)
+    uncompressed, removed = read_exclusions(len(entries))
+
+    # compress every file that isn't compressed yet, on a process pool
+    files = {index: data[entries[index][0]:entries[index][1]] for index in range(3, len(entries))
+             if index not in uncompressed and index not in removed}
+    keys = {index: hashlib.sha1(file).digest() for index, file in files.items()}
+    missing = {key: files[index] for index, key in keys.items() if key not in compressed_files}
+    if cache_dir is not None:
+        for key, file in list(missing.items()):
+            cached = load_cached_file(cache_dir, key, len(file))
+            if cached is not None:
+                compressed_files[key] = cached
+                del missing[key]
+    if workers is None:
+        workers = os.cpu_count() or 1
+    if workers > 1 and len(missing) > 1:
+        with ProcessPoolExecutor(min(workers, len(missing))) as executor:
+            new_files = dict(zip(missing.keys(), executor.map(yaz0_compress, missing.values(), chunksize=8)))
+    else:
+        new_files = {key: yaz0_compress(file) for key, file in missing.items()}
+    compressed_files.update(new_files)
+    if cache_dir is not None and new_files:
+        save_cached_files(cache_dir, new_files)
+    compressed = {index: compressed_files[key] for index, key in keys.items()}
+    # only keep the files of this rom for the next one, most of them are the same in every rom
+    compressed_files.clear()
+    compressed_files.update((keys[index], file) for index, file in compressed.items())
+
+    # the files up to the end of the DMA table stay where they are
+    table_end = dma_start + len(entries) * 0x10
+    output = bytearray(data[:table_end])
+    for index in range(3, len(entries)):
+        start, end, physical_start, physical_end = entries[index]
+        if index in removed:
+            file = b''
+        elif index in compressed:
+            file = compressed[index]
+        else:
+            file = data[start:end]
+        if start != end:
+            physical_start = len(output)
+            if index in removed:
+                physical_start = physical_end = 0xFFFFFFFF
+            elif index in compressed:
+                physical_end = physical_start + len(file)
+            struct.pack_into('>IIII', output, dma_start + index * 0x10, start, end, physical_start, physical_end)
+            output += file
+        else:
+            # empty files still take up their space, but nothing is written there
+            output += bytes(len(file))
+    if len(output) < COMPRESSED_ROM_SIZE:
+        output += bytes(COMPRESSED_ROM_SIZE - len(output))
+    output[0x10:0x18] = calculate_crc(BigStream(output))
+    return output
+
+
+def decompress_rom_data(data: bytes) -> bytearray:
+    data = bytes(data)
+    if data[0] == 0x37:
+        # byteswapped rom
+        swapped = bytearray(len(data))
+        swapped[0::2] = data[1::2]
+        swapped[1::2] = data[0::2]
+        data = bytes(swapped)
+    dma_start, entries = dma_entries(data)
+    table_end = entries[2][1]
+
+    output = bytearray(data[:table_end])
+    output += bytes(DECOMPRESSED_ROM_SIZE - len(output))
+    for index in range(3, len(entries)):
+        start, end, physical_start, physical_end = entries[index]
+        if physical_start >= DECOMPRESSED_ROM_SIZE or physical_end == 0xFFFFFFFF:
+            continue
+        if physical_end == 0:
+            output[start:end] = data[physical_start:physical_start + end - start]
+        else:
+            output[start:end] = yaz0_decompress(data[physical_start:physical_end], end - start)
+        struct.pack_into('>IIII', output, dma_start + index * 0x10, start, end, start, 0)
+    output[0x10:0x18] = calculate_crc(BigStream(output))
+    return output
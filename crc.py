@@ -1,38 +1,73 @@
 import itertools
+import operator
+import struct
+from functools import reduce
 
-from ntype import uint32, BigStream
+from ntype import BigStream
 
+# NumPy is optional, it only speeds up the checksum
+try:
+    import numpy
+except ImportError:
+    numpy = None
 
-def calculate_crc(data: BigStream) -> bytearray:
-    t1 = t2 = t3 = t4 = t5 = t6 = 0xDF26F436
+CRC_SEED: int = 0xDF26F436
+CRC_START: int = 0x1000
+CRC_LENGTH: int = 0x100000
+
+u32 = 0xFFFFFFFF
 
-    u32 = 0xFFFFFFFF
 
-    m1 = data.read_bytes(0x1000, 0x100000)
-    words = map(uint32.value, zip(m1[0::4], m1[1::4], m1[2::4], m1[3::4]))
+def calculate_crc(data: BigStream) -> bytearray:
+    words = struct.unpack(f'>{CRC_LENGTH // 4}I', data.read_bytes(CRC_START, CRC_LENGTH))
+    words2 = struct.unpack('>64I', data.read_bytes(0x750, 0x100))
+    if numpy is not None:
+        return crc_numpy(words, words2)
+    return crc_python(words, words2)
 
-    m2 = data.read_bytes(0x750, 0x100)
-    words2 = map(uint32.value, zip(m2[0::4], m2[1::4], m2[2::4], m2[3::4]))
 
-    for d, d2 in zip(words, itertools.cycle(words2)):
-        # keep t2 and t6 in u32 for comparisons; others can wait to be truncated
-        if ((t6 + d) & u32) < t6:
-            t4 += 1
+# Only t2 depends on the order of the words. The other sums are done in bulk:
+# t6 is the running sum, and t4 counts how often it wrapped around.
+def crc_python(words: tuple[int, ...], words2: tuple[int, ...]) -> bytearray:
+    total = CRC_SEED + sum(words)
+    t4 = CRC_SEED + (total >> 32)
+    t3 = reduce(operator.xor, words, CRC_SEED)
+    t1 = CRC_SEED + sum(map(operator.xor, words, itertools.cycle(words2)))
 
-        t6 = (t6+d) & u32
-        t3 ^= d
+    t2 = t5 = t6 = CRC_SEED
+    for d in words:
+        t6 = (t6 + d) & u32
         shift = d & 0x1F
-        r = ((d << shift) | (d >> (32 - shift)))
+        r = ((d << shift) | (d >> (32 - shift))) & u32
         t5 += r
-
         if t2 > d:
-            t2 ^= r & u32
+            t2 ^= r
         else:
             t2 ^= t6 ^ d
 
-        t1 += d2 ^ d
+    return crc_bytes(total ^ t4 ^ t3, t5 ^ t2 ^ t1)
+
+
+def crc_numpy(words: tuple[int, ...], words2: tuple[int, ...]) -> bytearray:
+    d = numpy.array(words, dtype=numpy.uint64)
+    d2 = numpy.resize(numpy.array(words2, dtype=numpy.uint64), len(words))
+    # at most 2^18 words below 2^32, so none of these sums overflow 64 bits
+    t6s = numpy.cumsum(d) + numpy.uint64(CRC_SEED)
+    total = int(t6s[-1])
+    t4 = CRC_SEED + (total >> 32)
+    t3 = CRC_SEED ^ int(numpy.bitwise_xor.reduce(d))
+    t1 = CRC_SEED + int(numpy.sum(d ^ d2))
+    shift = d & numpy.uint64(0x1F)
+    r = ((d << shift) | (d >> (numpy.uint64(32) - shift))) & numpy.uint64(u32)
+    t5 = CRC_SEED + int(numpy.sum(r))
+
+    t2 = CRC_SEED
+    for d_value, r_value, t6_value in zip(words, r.tolist(), ((t6s & numpy.uint64(u32)) ^ d).tolist()):
+        t2 ^= r_value if t2 > d_value else t6_value
+
+    return crc_bytes(total ^ t4 ^ t3, t5 ^ t2 ^ t1)
+
 
-    crc0 = (t6 ^ t4 ^ t3) & u32
-    crc1 = (t5 ^ t2 ^ t1) & u32
+def crc_bytes(crc0: int, crc1: int) -> bytearray:
+    return bytearray(struct.pack('>II', crc0 & u32, crc1 & u32))
 
-    return uint32.bytes(crc0) + uint32.bytes(crc1)
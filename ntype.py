@@ -173,29 +173,26 @@ class BigStream:
     def write_int16s(self, address: Optional[int], values: Sequence[int]) -> None:
         if address is None:
             address = self.last_address
-
-        i: int
-        value: int
-        for i, value in enumerate(values):
-            self.write_int16(address + (i * 2), value)
+        if not values:
+            return
+        # a single write, so a Rom records one changed range
+        self.write_bytes(address, bytearray().join(map(uint16.bytes, values)))
 
     def write_int24s(self, address: Optional[int], values: Sequence[int]) -> None:
         if address is None:
             address = self.last_address
-
-        i: int
-        value: int
-        for i, value in enumerate(values):
-            self.write_int24(address + (i * 3), value)
+        if not values:
+            return
+        # a single write, so a Rom records one changed range
+        self.write_bytes(address, bytearray().join(map(uint24.bytes, values)))
 
     def write_int32s(self, address: Optional[int], values: Sequence[int]) -> None:
         if address is None:
             address = self.last_address
-
-        i: int
-        value: int
-        for i, value in enumerate(values):
-            self.write_int32(address + (i * 4), value)
+        if not values:
+            return
+        # a single write, so a Rom records one changed range
+        self.write_bytes(address, bytearray().join(map(uint32.bytes, values)))
 
     def append_byte(self, value: int) -> None:
         self.buffer.append(value)